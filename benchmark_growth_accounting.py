@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+### Benchmarks of the growth_accounting functions on synthetic transaction logs
+### Run from the command line, e.g.
+###     python benchmark_growth_accounting.py --scales 10k 1M --output results.json
+### Each scale generates a seeded transaction log with that many users, then
+### times each benchmarked function and measures its peak memory allocations
+### with tracemalloc. The results are written as JSON, one record per scale and
+### function with the report of the stages inside it, so runs of different 
+### versions can be compared. The 10M scale needs tens of GB of memory with the
+### default settings. With --check-backends, each scale also checks that the 
+### compiled kernels give the same results as the pandas backend, e.g.
+###     python benchmark_growth_accounting.py --scales 10k --check-backends
+
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import growth_accounting as ga
+
+
+SCALES = {'10k' : 10000,
+          '1M' : 1000000,
+          '10M' : 10000000}
+
+
+
+### Seeded synthetic transaction log. Users sign up over the days with a rate
+### that grows by growth_rate over the whole range, and alternate between active
+### spells and dormant gaps. A spell ends with probability churn_rate per day
+### and a gap with probability resurrection_rate per day (0 means churned users
+### never come back). Within a spell, each user is active on a day with their
+### own probability, drawn from a beta distribution averaging activity_rate, and
+### makes 1 + Poisson(transactions_per_day - 1) transactions per active day. The
+### amounts are drawn from revenue_dist ('lognormal', 'pareto' or 'constant')
+### scaled to average mean_revenue, and zero_revenue_share of them are 0. Users
+### belong to one of n_segments segments, with Zipf-like segment sizes
+def make_transactions(n_users,
+                      days = 365,
+                      seed = 0,
+                      start_date = '2018-01-01',
+                      growth_rate = 1.0,
+                      activity_rate = 0.2,
+                      churn_rate = 0.02,
+                      resurrection_rate = 0.01,
+                      max_spells = 4,
+                      transactions_per_day = 1.5,
+                      revenue_dist = 'lognormal',
+                      mean_revenue = 20.0,
+                      zero_revenue_share = 0.05,
+                      n_segments = 0):
+    rng = np.random.default_rng(seed)
+
+    # Sign-up days, denser towards the end of the range when growth_rate > 0
+    first_day = (days * rng.random(n_users) ** (1 / (1 + growth_rate))).astype(np.int64)
+    user_rate = rng.beta(2, 2 * (1 - activity_rate) / activity_rate, n_users)
+
+    # Active spells and dormant gaps of each user
+    spell_len = rng.geometric(churn_rate, (n_users, max_spells))
+    if resurrection_rate > 0:
+        gap_len = rng.geometric(resurrection_rate, (n_users, max_spells))
+    else:
+        gap_len = np.full((n_users, max_spells), days)
+    spell_start = first_day[:, np.newaxis] + np.cumsum(spell_len + gap_len, axis = 1) - spell_len - gap_len
+    spell_len = np.clip(np.minimum(spell_start + spell_len, days) - spell_start, 0, None)
+
+    # Active days within each spell, plus each user's first day
+    spell_active = rng.binomial(spell_len, user_rate[:, np.newaxis])
+    spell_user = np.repeat(np.arange(n_users), max_spells)
+    spell_active = spell_active.ravel()
+    day_user = np.concatenate([np.arange(n_users), np.repeat(spell_user, spell_active)])
+    day_offset = (rng.random(spell_active.sum()) * np.repeat(spell_len.ravel(), spell_active)).astype(np.int64)
+    day = np.concatenate([first_day, np.repeat(spell_start.ravel(), spell_active) + day_offset])
+
+    user_days = pd.DataFrame({'user_id' : day_user, 'day' : day}).drop_duplicates()
+
+    # Transactions of each active day
+    n_transactions = 1 + rng.poisson(max(transactions_per_day - 1, 0), len(user_days))
+    t = user_days.iloc[np.repeat(np.arange(len(user_days)), n_transactions)].reset_index(drop = True)
+
+    if revenue_dist == 'lognormal':
+        inc_amt = rng.lognormal(0, 1, len(t)) / np.exp(0.5)
+    elif revenue_dist == 'pareto':
+        inc_amt = (rng.pareto(3, len(t)) + 1) * 2 / 3
+    else:
+        inc_amt = np.ones(len(t))
+    inc_amt = np.round(inc_amt * mean_revenue, 2)
+    inc_amt[rng.random(len(t)) < zero_revenue_share] = 0
+
+    t['dt'] = pd.Timestamp(start_date) + pd.to_timedelta(t['day'], unit = 'D')
+    t['inc_amt'] = inc_amt
+    if n_segments > 0:
+        segment_weights = 1 / np.arange(1, n_segments + 1)
+        user_segment = rng.choice(n_segments, n_users, p = segment_weights / segment_weights.sum())
+        segment_names = np.array(['segment_%s' % s for s in range(n_segments)], dtype = object)
+        t['segment'] = segment_names[user_segment[t['user_id']]]
+
+    return t.drop(columns = 'day')
+
+
+
+### The benchmarked steps, in the order they run. Each one takes the dict of
+### earlier results and returns its own result, stored under its name
+BENCHMARKS = [
+    ('create_dau_df', lambda r, a: ga.create_dau_df(r['transactions'].copy(), activity_date = 'dt',
+                                                   segment_col = 'segment' if a.segments else None,
+                                                   compact = a.compact)),
+    ('create_dau_decorated_df', lambda r, a: ga.create_dau_decorated_df(get_dau(r), a.segments > 0)),
+    ('create_period_decorated_dfs', lambda r, a: ga.create_period_decorated_dfs(get_dau(r), a.segments > 0)),
+    ('consolidate_all_ga_week', lambda r, a: ga.consolidate_all_ga(r['create_period_decorated_dfs']['week'],
+                                                                   'week', a.segments > 0)),
+    ('consolidate_all_ga_month', lambda r, a: ga.consolidate_all_ga(r['create_period_decorated_dfs']['month'],
+                                                                    'month', a.segments > 0)),
+    ('xau_retention_by_cohort_df', lambda r, a: ga.xau_retention_by_cohort_df(r['create_period_decorated_dfs']['month'],
+                                                                             'month', a.segments > 0)),
+    ('calc_rolling_qr_window', lambda r, a: ga.calc_rolling_qr_window(r['create_dau_decorated_df'],
+                                                                      a.window_days, a.segments > 0)),
+    ('create_dau_window_df', lambda r, a: ga.create_dau_window_df(r['create_dau_decorated_df'],
+                                                                  a.window_days, [2, 4], a.segments > 0)),
+    ('calc_user_daily_usage', lambda r, a: ga.calc_user_daily_usage(r['create_dau_decorated_df'],
+                                                                    max(r['create_dau_decorated_df']['activity_date']),
+                                                                    max(a.window_days), [], a.segments > 0)),
+]
+BENCHMARKS_NAMES = [name for name, func in BENCHMARKS]
+
+
+
+### The functions with a kernel backend (see ga.set_backend), run by 
+### check_backends with the pandas backend and the one checked. The revenue 
+### sums are added up in a different order, so they are compared to a relative
+### tolerance of BACKEND_RTOL
+BACKEND_CHECKS = [
+    ('create_growth_accounting_dfs_week', lambda r, a: ga.create_growth_accounting_dfs(r['create_period_decorated_dfs']['week'],
+                                                                                       'week', a.segments > 0)),
+    ('create_growth_accounting_dfs_month', lambda r, a: ga.create_growth_accounting_dfs(r['create_period_decorated_dfs']['month'],
+                                                                                        'month', a.segments > 0)),
+    ('consolidate_all_ga_week', lambda r, a: ga.consolidate_all_ga(r['create_period_decorated_dfs']['week'],
+                                                                   'week', a.segments > 0)),
+    ('calc_rolling_qr_window', lambda r, a: ga.calc_rolling_qr_window(r['create_dau_decorated_df'],
+                                                                      a.window_days, a.segments > 0)),
+    ('create_dau_window_df', lambda r, a: ga.create_dau_window_df(r['create_dau_decorated_df'],
+                                                                  a.window_days, [2, 4], a.segments > 0)),
+]
+BACKEND_RTOL = 1e-9
+
+
+
+### The DAU dataframe of create_dau_df, without the user ID lookup of compact mode
+def get_dau(results):
+    dau = results['create_dau_df']
+    if isinstance(dau, tuple):
+        return dau[0]
+    return dau
+
+
+
+### Runs func(results, args) as the stage 'benchmark name', returning its 
+### result along with the seconds it took, its peak memory allocations in MB 
+### (None without track_memory), and the stage report of the growth_accounting
+### stages it ran (see ga.create_stage_report), with missing values as None. 
+### The peak memory is that of the stage around the whole run
+def run_benchmark(name, func, results, args, track_memory = True):
+    with ga.record_stages(trace_memory = track_memory) as stage_records:
+        with ga.instrument_stage('benchmark ' + name) as run_record:
+            result = func(results, args)
+    seconds = run_record['seconds']
+    peak_mb = run_record['peak_mb']
+    stage_records = [record for record in stage_records if record is not run_record]
+    stage_report = ga.create_stage_report(stage_records)
+    stage_report = stage_report.astype(object).where(stage_report.notnull(), None)
+    return result, seconds, peak_mb, stage_report.to_dict('records')
+
+
+
+### Runs each of BACKEND_CHECKS with the pandas backend and the given one, 
+### returning one record per check with whether the results agree, and the 
+### first difference when they do not. The backend used is 'pandas' when the 
+### checked one is not available, e.g. numba is not installed
+def check_backends(scale, results, args):
+    for name in ['create_dau_df', 'create_dau_decorated_df', 'create_period_decorated_dfs']:
+        if name not in results:
+            results[name] = dict(BENCHMARKS)[name](results, args)
+    
+    backend = args.check_backends
+    backend_used = backend if ga.get_kernels(backend) is not None else 'pandas'
+    check_records = []
+    for name, func in BACKEND_CHECKS:
+        print('Checking %s backend of %s at %s scale' % (backend_used, name, scale))
+        outputs = []
+        for b in ['pandas', backend]:
+            ga.set_backend(b)
+            start = time.perf_counter()
+            output = func(results, args)
+            outputs.append((output if isinstance(output, tuple) else (output,), time.perf_counter() - start))
+        ga.set_backend('auto')
+        
+        difference = None
+        for expected, result in zip(outputs[0][0], outputs[1][0]):
+            try:
+                pd.testing.assert_frame_equal(expected.reset_index(drop = True), result.reset_index(drop = True),
+                                              rtol = BACKEND_RTOL)
+            except AssertionError as e:
+                difference = str(e)
+                print('%s backend of %s differs: %s' % (backend_used, name, difference))
+                break
+        check_records.append({'scale' : scale,
+                              'function' : name,
+                              'backend' : backend_used,
+                              'agree' : difference is None,
+                              'difference' : difference,
+                              'pandas_seconds' : outputs[0][1],
+                              'backend_seconds' : outputs[1][1]})
+    return check_records
+
+
+
+def run_scale(scale, args):
+    n_users = SCALES[scale]
+    print('Generating %s transactions' % scale)
+    start = time.perf_counter()
+    transactions = make_transactions(n_users, days = args.days, seed = args.seed,
+                                     n_segments = args.segments)
+    generate_seconds = time.perf_counter() - start
+
+    scale_records = []
+    results = {'transactions' : transactions}
+    for name, func in BENCHMARKS:
+        if args.functions and name not in args.functions and not is_needed(name, args.functions):
+            continue
+        print('Running %s at %s scale' % (name, scale))
+        results[name], seconds, peak_mb, stages = run_benchmark(name, func, results, args, not args.no_memory)
+        scale_records.append({'scale' : scale,
+                              'n_users' : n_users,
+                              'n_transactions' : len(transactions),
+                              'days' : args.days,
+                              'segments' : args.segments,
+                              'compact' : args.compact,
+                              'function' : name,
+                              'seconds' : seconds,
+                              'peak_mb' : peak_mb,
+                              'generate_seconds' : generate_seconds,
+                              'stages' : stages})
+    
+    check_records = []
+    if args.check_backends:
+        check_records = check_backends(scale, results, args)
+    return scale_records, check_records
+
+
+
+### Whether the benchmark step name is needed by the steps selected with
+### --functions, since those use the results of the steps before them
+def is_needed(name, functions):
+    needs = {'create_dau_df' : BENCHMARKS_NAMES[1:],
+             'create_dau_decorated_df' : ['calc_rolling_qr_window', 'create_dau_window_df', 'calc_user_daily_usage'],
+             'create_period_decorated_dfs' : ['consolidate_all_ga_week', 'consolidate_all_ga_month',
+                                              'xau_retention_by_cohort_df']}
+    return any(f in needs.get(name, []) for f in functions)
+
+
+
+def get_numba_version():
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.__version__
+
+
+
+def get_environment():
+    return {'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'pandas' : pd.__version__,
+            'numba' : get_numba_version(),
+            'platform' : platform.platform(),
+            'processor' : platform.processor(),
+            'cpu_count' : os.cpu_count(),
+            'timestamp' : datetime.now().isoformat()}
+
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the growth_accounting functions on synthetic data')
+    parser.add_argument('--scales', nargs = '+', default = list(SCALES), choices = list(SCALES))
+    parser.add_argument('--days', type = int, default = 365)
+    parser.add_argument('--segments', type = int, default = 0, help = 'number of segments, 0 for unsegmented')
+    parser.add_argument('--window-days', type = int, nargs = '+', default = [7, 28])
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--compact', action = 'store_true', help = 'use compact dataframes (see create_dau_df)')
+    parser.add_argument('--functions', nargs = '+', choices = BENCHMARKS_NAMES,
+                        help = 'only run these functions (and the steps they need)')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip tracemalloc, which slows the runs down')
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    parser.add_argument('--check-backends', nargs = '?', const = 'numba', choices = ['numba', 'python'],
+                        help = 'check that this kernel backend (numba unless given) agrees with pandas')
+    parser.add_argument('--log-level', default = 'WARNING', help = 'level of the growth_accounting progress messages')
+    return parser.parse_args(argv)
+
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    ga.set_log_level(args.log_level)
+    records = []
+    backend_checks = []
+    for scale in args.scales:
+        scale_records, check_records = run_scale(scale, args)
+        records = records + scale_records
+        backend_checks = backend_checks + check_records
+
+        # Written after every scale, so the smaller scales are kept if a larger
+        # one runs out of memory
+        with open(args.output, 'w') as f:
+            json.dump({'environment' : get_environment(),
+                       'settings' : vars(args),
+                       'results' : records,
+                       'backend_checks' : backend_checks}, f, indent = 2)
+    print('Wrote %s' % args.output)
+    
+    if not all(c['agree'] for c in backend_checks):
+        print('The %s backend does not agree with pandas' % args.check_backends)
+    return records
+
+
+if __name__ == '__main__':
+    main()
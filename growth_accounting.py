@@ -10,30 +10,276 @@ import numpy as np
 from datetime import timedelta
 from datetime import datetime
 import math
+import os
+import json
+import time
+import logging
+import functools
+import tracemalloc
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+### Instrumentation
+### Progress messages go through the 'growth_accounting' logger, at INFO for
+### the main steps and DEBUG for every window end date of the window loops, so
+### the level decides how much is shown (see set_log_level). Each stage of a 
+### calculation (a decorated function or an instrument_stage block) is also 
+### timed and recorded: its wall time, rows in and out, and, inside 
+### record_stages(trace_memory = True), the peak memory it allocated on top of
+### what was allocated when it started. Every record is passed to the callbacks
+### of add_stage_callback, and record_stages collects them for 
+### create_stage_report. Stages run in the worker processes of run_parallel are
+### not recorded in the calling process
+logger = logging.getLogger('growth_accounting')
+STAGE_CALLBACKS = []
+STAGE_STACK = []
+STAGE_MEMORY = {'tracing' : 0}
+
+
+
+### Shows the progress messages at the given logging level ('INFO' shows the 
+### main steps, 'DEBUG' every stage's timing and every window end date) by 
+### adding a handler to the logger if it does not have one
+def set_log_level(level = 'INFO'):
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+
+def add_stage_callback(callback):
+    STAGE_CALLBACKS.append(callback)
+
+
+def remove_stage_callback(callback):
+    STAGE_CALLBACKS.remove(callback)
+
+
+
+### Number of rows of a stage's input or output: the first dataframe or array
+### of a result that is a tuple, or None if there is none
+def count_stage_rows(value):
+    if isinstance(value, tuple) and len(value) > 0:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+
+### Times and records the code run inside it as the stage name, logging message
+### at INFO when given. Yields the stage's record, a dict where rows_out can be
+### filled in
+@contextmanager
+def instrument_stage(name, rows_in = None, message = None):
+    if message is not None:
+        logger.info(message)
+    record = {'stage' : name,
+              'parent' : STAGE_STACK[-1]['stage'] if STAGE_STACK else None,
+              'depth' : len(STAGE_STACK),
+              'rows_in' : rows_in,
+              'rows_out' : None,
+              'seconds' : None,
+              'peak_mb' : None}
+    
+    # The peak of tracemalloc is reset for each stage, so the stage around it
+    # keeps the peak it had reached so far. This is only done while the 
+    # tracemalloc session of record_stages is running, so the peak of a session
+    # started by someone else is never lost
+    tracing = STAGE_MEMORY['tracing'] > 0 and tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if STAGE_STACK and '_peak' in STAGE_STACK[-1]:
+            STAGE_STACK[-1]['_peak'] = max(STAGE_STACK[-1]['_peak'], peak)
+        record['_start'] = current
+        record['_peak'] = current
+        tracemalloc.reset_peak()
+    
+    STAGE_STACK.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        STAGE_STACK.pop()
+        if tracing and tracemalloc.is_tracing():
+            peak = max(record['_peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (peak - record['_start']) / 2**20
+            if STAGE_STACK and '_peak' in STAGE_STACK[-1]:
+                STAGE_STACK[-1]['_peak'] = max(STAGE_STACK[-1]['_peak'], peak)
+        record.pop('_start', None)
+        record.pop('_peak', None)
+        
+        logger.debug('%s took %.3fs (rows in %s, rows out %s, peak MB %s)' % 
+                     (name, record['seconds'], record['rows_in'], record['rows_out'], record['peak_mb']))
+        for callback in list(STAGE_CALLBACKS):
+            callback(record)
+
+
+
+### Decorator that runs each call of a function as an instrument_stage, named
+### after the function unless name is given. The rows in are those of the 
+### first argument and the rows out those of the result
+def instrumented(name = None, message = None):
+    def decorator(func):
+        stage_name = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = count_stage_rows(args[0]) if len(args) > 0 else None
+            with instrument_stage(stage_name, rows_in, message) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = count_stage_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+
+### Collects the records of the stages run inside it into the list it yields.
+### With trace_memory, tracemalloc is started for the duration, which gives the
+### peak memory of each stage but slows the run down. The peak memory of the
+### whole block is that of a stage around it. When tracemalloc is already
+### tracing, its peak is left alone and the stages get no peak memory
+@contextmanager
+def record_stages(trace_memory = False):
+    records = []
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+        STAGE_MEMORY['tracing'] += 1
+    elif trace_memory:
+        logger.warning('tracemalloc is already tracing, the stages get no peak memory')
+    add_stage_callback(records.append)
+    try:
+        yield records
+    finally:
+        remove_stage_callback(records.append)
+        if started_tracing:
+            STAGE_MEMORY['tracing'] -= 1
+            tracemalloc.stop()
+
+
+
+### Summary of the stage records of record_stages: one row per stage with its
+### number of calls, total, mean and maximum seconds, share of the time of the
+### outermost stages, total rows in and out, and maximum peak memory, sorted by
+### total time. Nested stages are included in the time of the stages around them
+def create_stage_report(records):
+    columns = ['stage', 'calls', 'total_seconds', 'mean_seconds', 'max_seconds', 'pct_of_run',
+               'rows_in', 'rows_out', 'peak_mb']
+    if len(records) == 0:
+        return pd.DataFrame(columns = columns)
+    
+    records_df = pd.DataFrame(records)
+    for c in ['rows_in', 'rows_out', 'peak_mb']:
+        records_df[c] = pd.to_numeric(records_df[c])
+    run_seconds = records_df.loc[records_df['depth'] == records_df['depth'].min(), 'seconds'].sum()
+    report = (records_df
+              .groupby('stage', sort = False)
+              .agg(calls = ('seconds', 'size'),
+                   total_seconds = ('seconds', 'sum'),
+                   mean_seconds = ('seconds', 'mean'),
+                   max_seconds = ('seconds', 'max'),
+                   rows_in = ('rows_in', lambda rows: rows.sum(min_count = 1)),
+                   rows_out = ('rows_out', lambda rows: rows.sum(min_count = 1)),
+                   peak_mb = ('peak_mb', 'max'))
+              .reset_index())
+    report['pct_of_run'] = report['total_seconds'] / run_seconds if run_seconds > 0 else np.nan
+    
+    return report[columns].sort_values('total_seconds', ascending = False).reset_index(drop = True)
+
+
+
+### Logs the report of create_stage_report at INFO and returns it
+def log_stage_report(records):
+    report = create_stage_report(records)
+    logger.info('Stage report\n' + report.to_string(index = False))
+    return report
+
+
+
+### Integer period arithmetic behind the time periods below. Each time period 
+### has a to_ordinal function that maps day numbers (see date_to_day_number) to
+### integer period ordinals, and a start_day function that maps period ordinals
+### back to the day number of the first day of the period. The ordinals of the 
+### day, week, month, quarter and year periods are the ones pandas uses for its 
+### 'D', 'W' (weeks ending on Sunday), 'M', 'Q' and 'Y' Period objects
+def day_to_month_ordinal(days):
+    return np.asarray(days, dtype = np.int64).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+
+def month_ordinal_to_day(ordinals):
+    return np.asarray(ordinals, dtype = np.int64).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
 
 ### For discrete time period calculations, this helps set the variable names
-### in the different dataframes 
+### in the different dataframes and holds the period arithmetic of each time 
+### period. pandas_freq is the frequency of the pandas Period objects used for 
+### the period columns of non-compact dataframes; periods without one, like the
+### fiscal periods of register_fiscal_445_periods, use integer ordinals instead
+TIME_PERIODS = {
+                'day' : {'grouping_col' : 'Day',
+                         'first_period_col' : 'first_day',
+                         'frequency' : 'Daily',
+                         'unit' : 'Day',
+                         'period_abbr' : 'D',
+                         'python_period' : 'days',
+                         'pandas_freq' : 'D',
+                         'to_ordinal' : lambda days: np.asarray(days, dtype = np.int64),
+                         'start_day' : lambda ordinals: np.asarray(ordinals, dtype = np.int64)
+                         },
+                'week' : {'grouping_col' : 'Week',
+                          'first_period_col' : 'first_week',
+                          'frequency' : 'Weekly',
+                          'unit' : 'Week',
+                          'period_abbr' : 'W',
+                          'python_period' : 'weeks',
+                          'pandas_freq' : 'W',
+                          'to_ordinal' : lambda days: (np.asarray(days, dtype = np.int64) + 10) // 7,
+                          'start_day' : lambda ordinals: 7 * np.asarray(ordinals, dtype = np.int64) - 10
+                          },
+                'month' : {'grouping_col' : 'Month_Year',
+                           'first_period_col' : 'first_month',
+                           'frequency' : 'Monthly',
+                           'unit' : 'Month',
+                           'period_abbr' : 'M',
+                           'python_period' : 'months',
+                           'pandas_freq' : 'M',
+                           'to_ordinal' : day_to_month_ordinal,
+                           'start_day' : month_ordinal_to_day
+                          },
+                'quarter' : {'grouping_col' : 'Quarter',
+                             'first_period_col' : 'first_quarter',
+                             'frequency' : 'Quarterly',
+                             'unit' : 'Quarter',
+                             'period_abbr' : 'Q',
+                             'python_period' : 'quarters',
+                             'pandas_freq' : 'Q',
+                             'to_ordinal' : lambda days: day_to_month_ordinal(days) // 3,
+                             'start_day' : lambda ordinals: month_ordinal_to_day(3 * np.asarray(ordinals))
+                             },
+                'year' : {'grouping_col' : 'Year',
+                          'first_period_col' : 'first_year',
+                          'frequency' : 'Yearly',
+                          'unit' : 'Year',
+                          'period_abbr' : 'Y',
+                          'python_period' : 'years',
+                          'pandas_freq' : 'Y',
+                          'to_ordinal' : lambda days: day_to_month_ordinal(days) // 12,
+                          'start_day' : lambda ordinals: month_ordinal_to_day(12 * np.asarray(ordinals))
+                          }
+                }
+
 def get_time_period_dict(time_period):
     
-    time_fields_dict = {
-                        'week' : {'grouping_col' : 'Week',
-                                  'first_period_col' : 'first_week',
-                                  'frequency' : 'Weekly',
-                                  'unit' : 'Week',
-                                  'period_abbr' : 'W',
-                                  'python_period' : 'weeks'
-                                  },
-                        'month' : {'grouping_col' : 'Month_Year',
-                                   'first_period_col' : 'first_month',
-                                   'frequency' : 'Monthly',
-                                   'unit' : 'Month',
-                                   'period_abbr' : 'M',
-                                   'python_period' : 'months'
-                                  }
-                        }
-                    
-    if time_period in time_fields_dict:
-        time_fields = time_fields_dict[time_period]
+    if time_period in TIME_PERIODS:
+        time_fields = TIME_PERIODS[time_period]
     else:
         time_fields = None
     
@@ -41,16 +287,172 @@ def get_time_period_dict(time_period):
 
 
 
+### Adds a time period that the growth accounting and cohort functions accept by
+### name. to_ordinal and start_day are the integer period functions described
+### above, and pandas_freq is the frequency of the matching pandas Period 
+### objects, if there is one whose ordinals are the same
+def register_time_period(time_period, grouping_col, first_period_col, frequency, unit, period_abbr,
+                         to_ordinal, start_day, pandas_freq = None):
+    TIME_PERIODS[time_period] = {'grouping_col' : grouping_col,
+                                 'first_period_col' : first_period_col,
+                                 'frequency' : frequency,
+                                 'unit' : unit,
+                                 'period_abbr' : period_abbr,
+                                 'python_period' : time_period + 's',
+                                 'pandas_freq' : pandas_freq,
+                                 'to_ordinal' : to_ordinal,
+                                 'start_day' : start_day}
+
+
+
+### Registers the 'fiscal_month', 'fiscal_quarter' and 'fiscal_year' time periods
+### of a 4-4-5 fiscal calendar. Each fiscal year starts on one of 
+### year_start_dates, which must include the start of the year after the last 
+### one in the data, and its quarters are 13 weeks made up of months of 4, 4 and
+### 5 weeks. The 53rd week of a 53-week year is added to its last month. Days
+### before the first start or on or after the last one raise a ValueError
+def register_fiscal_445_periods(year_start_dates):
+    year_start_days = np.sort(date_to_day_number(year_start_dates))
+    if len(year_start_days) < 2:
+        raise ValueError('year_start_dates must include the start of the year after the last one')
+    
+    def day_to_year_week(days):
+        days = np.asarray(days, dtype = np.int64)
+        if days.size > 0 and (days.min() < year_start_days[0] or days.max() >= year_start_days[-1]):
+            raise ValueError('Fiscal years only cover %s to %s, before the last of year_start_dates' %
+                             tuple(np.array(year_start_days[[0, -1]], dtype = 'datetime64[D]')))
+        years = np.searchsorted(year_start_days, days, side = 'right') - 1
+        weeks = (days - year_start_days[years]) // 7
+        return years, weeks
+    
+    def day_to_fiscal_month(days):
+        years, weeks = day_to_year_week(days)
+        quarters = np.minimum(weeks // 13, 3)
+        months = np.minimum((weeks - 13 * quarters) // 4, 2)
+        return 12 * years + 3 * quarters + months
+    
+    def fiscal_month_to_day(ordinals):
+        ordinals = np.asarray(ordinals, dtype = np.int64)
+        return year_start_days[ordinals // 12] + 91 * (ordinals % 12 // 3) + 28 * (ordinals % 3)
+    
+    register_time_period('fiscal_month', 'Fiscal_Month', 'first_fiscal_month', 'Fiscal Monthly', 
+                         'Fiscal Month', 'FM', day_to_fiscal_month, fiscal_month_to_day)
+    register_time_period('fiscal_quarter', 'Fiscal_Quarter', 'first_fiscal_quarter', 'Fiscal Quarterly', 
+                         'Fiscal Quarter', 'FQ', lambda days: day_to_fiscal_month(days) // 3,
+                         lambda ordinals: fiscal_month_to_day(3 * np.asarray(ordinals)))
+    register_time_period('fiscal_year', 'Fiscal_Year', 'first_fiscal_year', 'Fiscal Yearly', 
+                         'Fiscal Year', 'FY', lambda days: day_to_year_week(days)[0],
+                         lambda ordinals: year_start_days[np.asarray(ordinals, dtype = np.int64)])
+
+
+
+### Converts a column of dates (datetime.date objects or datetime64 values) to
+### integer day numbers counted from 1970-01-01, which are much cheaper to
+### compare and index than date objects
+def date_to_day_number(dates):
+    return pd.to_datetime(pd.Series(dates)).values.astype('datetime64[D]').astype(np.int64)
+
+
+
+### Compact dataframes (see create_dau_df) store activity_date and first_dt as
+### datetime64 values instead of datetime.date objects, user_id as int32 codes,
+### and the week and month columns as integer period ordinals
+def is_compact_dau(dau_df):
+    return pd.api.types.is_datetime64_any_dtype(dau_df['activity_date'])
+
+
+
+### Converts a date to the type used by a dataframe date column so the two can
+### be compared, whether the column holds datetime.date objects or datetime64
+def as_column_date(date_col, d):
+    if pd.api.types.is_datetime64_any_dtype(date_col):
+        return pd.Timestamp(d)
+    return d
+
+
+
+### Integer period ordinal of each date, the same number pandas uses internally 
+### for its Period objects of the time periods that have them
+def date_to_period_ordinal(dates, time_period):
+    return day_to_period_ordinal(date_to_day_number(dates), time_period)
+
+
+
+### Integer period ordinal of each day number
+def day_to_period_ordinal(days, time_period):
+    return get_time_period_dict(time_period)['to_ordinal'](days)
+
+
+
+### Integer period ordinals of a column holding either pandas Period objects or
+### compact integer ordinals
+def period_to_ordinal(periods):
+    if isinstance(periods.dtype, pd.PeriodDtype):
+        return pd.Series(periods.array.asi8, index = periods.index)
+    return periods
+
+
+
+### pandas Period objects of an array of integer period ordinals, the inverse
+### of period_to_ordinal. Time periods without a pandas frequency keep the 
+### integer ordinals
+def ordinal_to_period(ordinals, time_period):
+    pandas_freq = get_time_period_dict(time_period)['pandas_freq']
+    if pandas_freq is None:
+        return np.asarray(ordinals, dtype = np.int64)
+    return pd.arrays.PeriodArray(np.asarray(ordinals, dtype = np.int64), dtype = pd.PeriodDtype(pandas_freq))
+
+
+
+### Period column of each date in the format of the dataframe it goes in: integer
+### ordinals for compact dataframes, pandas Period objects otherwise
+def date_to_period_col(dates, time_period, compact):
+    ordinals = date_to_period_ordinal(dates, time_period)
+    if not compact:
+        ordinals = ordinal_to_period(ordinals, time_period)
+    return pd.Series(ordinals, index = dates.index)
+
+
+
+### Start time of each period in a column of pandas Period objects or compact 
+### integer period ordinals
+def period_start_time(periods, time_period):
+    ordinals = np.asarray(period_to_ordinal(pd.Series(periods)), dtype = np.int64)
+    start_days = get_time_period_dict(time_period)['start_day'](ordinals)
+    return pd.DatetimeIndex(start_days.astype('datetime64[D]').astype('datetime64[ns]'))
+
+
+
+### Maps the int32 user_id codes of a compact dataframe back to the original
+### user IDs, using the lookup returned by create_dau_df(compact = True)
+def decode_user_ids(df, user_id_lookup):
+    decoded_df = df.copy()
+    decoded_df['user_id'] = user_id_lookup.take(df['user_id'].values)
+    return decoded_df
+
+
+
 ### Create Daily Active Users dataframe that aggregates all activity by user and day
 ### If the segmentation column is specified, this function includes the segment
 ### in the finial dataframe
+### If compact is True, user IDs are replaced by int32 codes and dates are kept as
+### datetime64 values, which uses several times less memory and makes the merges 
+### and groupbys in the functions below faster. The functions below recognize a
+### compact dataframe and store its week and month columns as integer period 
+### ordinals. In that case the function returns the DAU dataframe and the lookup
+### of original user IDs, which decode_user_ids uses to map the codes back
+@instrumented()
 def create_dau_df(transactions, 
                   user_id = 'user_id', 
                   activity_date = 'activity_date', 
                   inc_amt = 'inc_amt', 
-                  segment_col = None):
+                  segment_col = None,
+                  compact = False):
     
-    transactions[activity_date] = pd.to_datetime(transactions[activity_date]).dt.date
+    if compact:
+        transactions[activity_date] = pd.to_datetime(transactions[activity_date]).dt.normalize()
+    else:
+        transactions[activity_date] = pd.to_datetime(transactions[activity_date]).dt.date
     
     if segment_col is None:
         dau = transactions.loc[transactions[inc_amt] > 0]\
@@ -67,19 +469,81 @@ def create_dau_df(transactions,
                                    activity_date : 'activity_date', 
                                    inc_amt : 'inc_amt', 
                                    segment_col : 'segment'})
-        
+    
+    if compact:
+        user_id_codes, user_id_lookup = pd.factorize(dau['user_id'], sort = True)
+        dau['user_id'] = user_id_codes.astype(np.int32)
+        return dau, user_id_lookup
+
     return dau
 
 
 
+### Aggregates one chunk of transactions to (user, day[, segment]) sums, with
+### the dates as datetime64 days. Used by create_dau_df_from_chunks
+def aggregate_transaction_chunk(transactions, user_id, activity_date, inc_amt, segment_col):
+    transactions = transactions.loc[transactions[inc_amt] > 0]
+    groupby_cols = [transactions[user_id],
+                    pd.to_datetime(transactions[activity_date]).dt.normalize().rename('activity_date')]
+    if segment_col is not None:
+        groupby_cols.append(transactions[segment_col])
+    partial_dau = transactions[inc_amt].groupby(groupby_cols).sum()
+    partial_dau.index.names = ['user_id', 'activity_date', 'segment'][:len(groupby_cols)]
+    return partial_dau.rename('inc_amt')
+
+
+
+### Streaming version of create_dau_df for transaction files that do not fit in
+### memory. transactions_chunks is any iterable of transaction dataframes, such
+### as pd.read_csv(filename, chunksize = 1000000). Each chunk is aggregated to
+### (user, day[, segment]) sums as it is read, and the partial sums are merged
+### whenever they grow past the size of the last merge, so memory is bounded by
+### the size of the DAU dataframe rather than the size of the raw transactions
+### Returns the DAU dataframe in the same format as create_dau_df and the
+### first_dt dataframe of create_first_dt_df, followed by the user ID lookup
+### if compact is True
+@instrumented()
+def create_dau_df_from_chunks(transactions_chunks,
+                              user_id = 'user_id',
+                              activity_date = 'activity_date',
+                              inc_amt = 'inc_amt',
+                              segment_col = None,
+                              compact = False):
+    partial_daus = []
+    partial_rows = 0
+    merged_rows = 0
+    for i, chunk in enumerate(transactions_chunks):
+        logger.info('Aggregating transactions chunk %d' % i)
+        partial_dau = aggregate_transaction_chunk(chunk, user_id, activity_date, inc_amt, segment_col)
+        partial_daus.append(partial_dau)
+        partial_rows = partial_rows + len(partial_dau)
+        if len(partial_daus) > 1 and partial_rows > 2*merged_rows:
+            merged = pd.concat(partial_daus)
+            merged = merged.groupby(level = list(range(merged.index.nlevels))).sum()
+            partial_daus = [merged]
+            partial_rows = merged_rows = len(merged)
+
+    merged = pd.concat(partial_daus)
+    dau = merged.groupby(level = list(range(merged.index.nlevels))).sum().reset_index()
+
+    if compact:
+        user_id_codes, user_id_lookup = pd.factorize(dau['user_id'], sort = True)
+        dau['user_id'] = user_id_codes.astype(np.int32)
+        return dau, create_first_dt_df(dau), user_id_lookup
+
+    dau['activity_date'] = dau['activity_date'].dt.date
+    return dau, create_first_dt_df(dau)
+
+
+
 ### Using the DAU dataframe created in the function above, this creates a
 ### Weekly Active Users (WAU) dataframe
+@instrumented(message = 'Creating WAU dataframe')
 def create_wau_df(dau_df):
-    print('Creating WAU dataframe')
-    dau = dau_df.copy()
-    dau['Week'] = pd.to_datetime(dau['activity_date']).dt.to_period('W')
-    wau = dau.groupby(['user_id', 'Week'], as_index = False)['inc_amt']\
-            .sum()
+    week = date_to_period_col(dau_df['activity_date'], 'week', is_compact_dau(dau_df))
+    wau = dau_df.groupby([dau_df['user_id'], week.rename('Week')])['inc_amt']\
+            .sum()\
+            .reset_index()
     return wau
 
 
@@ -87,12 +551,12 @@ def create_wau_df(dau_df):
 
 ### Using the DAU dataframe created in the function above, this creates a
 ### Monthly Active Users (MAU) dataframe
+@instrumented(message = 'Creating MAU dataframe')
 def create_mau_df(dau_df):
-    print('Creating MAU dataframe')
-    dau = dau_df.copy()
-    dau['Month_Year'] = pd.to_datetime(dau['activity_date']).dt.to_period('M')
-    mau = dau.groupby(['user_id', 'Month_Year'], as_index = False)['inc_amt']\
-            .sum()
+    month = date_to_period_col(dau_df['activity_date'], 'month', is_compact_dau(dau_df))
+    mau = dau_df.groupby([dau_df['user_id'], month.rename('Month_Year')])['inc_amt']\
+            .sum()\
+            .reset_index()
     return mau
 
 
@@ -100,15 +564,16 @@ def create_mau_df(dau_df):
 
 ### Using the DAU dataframe created in the function above, this creates a
 ### dataframe that contains the first usage day, week, and month for each user
+@instrumented(message = 'Creating first_dt dataframe')
 def create_first_dt_df(dau_df):
-    print('Creating first_dt dataframe')
-    dau = dau_df.copy()
-    first_dt = dau.groupby(['user_id'], as_index = False)['activity_date']\
+    first_dt = dau_df.groupby(['user_id'], as_index = False)['activity_date']\
             .min()\
             .rename(columns = { 'activity_date' : 'first_dt' })
-    first_dt['first_dt'] = pd.to_datetime(first_dt['first_dt']).dt.date
-    first_dt['first_week'] = pd.to_datetime(first_dt['first_dt']).dt.to_period('W')
-    first_dt['first_month'] = pd.to_datetime(first_dt['first_dt']).dt.to_period('M')
+    compact = is_compact_dau(dau_df)
+    if not compact:
+        first_dt['first_dt'] = pd.to_datetime(first_dt['first_dt']).dt.date
+    first_dt['first_week'] = date_to_period_col(first_dt['first_dt'], 'week', compact)
+    first_dt['first_month'] = date_to_period_col(first_dt['first_dt'], 'month', compact)
     return first_dt
 
 
@@ -118,8 +583,10 @@ def create_first_dt_df(dau_df):
 ### first usage date to the DAU dataframe
 ### dau_decorated is used in the subsequent functions below
 ### Using the segmented column from a segmented DAU dataframe is a T|F option
-def create_dau_decorated_df(dau_df, use_segment, first_dt_df = None):
-    print('Creating DAU Decorated dataframe')
+### With date_index, the result is sorted by activity_date and indexed by 
+### index_dau_by_date, which speeds up the window functions
+@instrumented(message = 'Creating DAU Decorated dataframe')
+def create_dau_decorated_df(dau_df, use_segment, first_dt_df = None, date_index = False):
     if first_dt_df is None:
         first_dt_df = create_first_dt_df(dau_df)
     dau_decorated_df = pd.merge(dau_df, first_dt_df, how = 'left', on = 'user_id')
@@ -129,11 +596,117 @@ def create_dau_decorated_df(dau_df, use_segment, first_dt_df = None):
 #    else:
 #        return_df = dau_decorated_df[['user_id', 'activity_date', 'inc_amt', 
 #                                      'first_dt', 'first_week', 'first_month']]
-    
+
+    if date_index:
+        return index_dau_by_date(dau_decorated_df)
     return dau_decorated_df
 
 
 
+### Saves a DAU or DAU decorated dataframe as a directory of Parquet files, one
+### per month of activity_date (path/month=YYYY-MM/part-0.parquet), so a daily
+### job can read back only the months it needs instead of re-parsing the raw
+### transactions. Months already in the store are replaced by the ones in
+### dau_df and the other months are left as they are. Needs pyarrow
+@instrumented()
+def save_dau_store(dau_df, path):
+    logger.info('Saving DAU store to ' + path)
+    months = dau_df['activity_date'].values.astype('datetime64[D]').astype('datetime64[M]')
+    for month in np.unique(months):
+        month_dir = os.path.join(path, 'month=' + str(month))
+        os.makedirs(month_dir, exist_ok = True)
+        dau_df.loc[months == month].to_parquet(os.path.join(month_dir, 'part-0.parquet'), index = False)
+
+
+
+### Months stored in a DAU store written by save_dau_store, as datetime64[M]
+def get_dau_store_months(path):
+    month_dirs = [d for d in os.listdir(path) if d.startswith('month=')]
+    return np.array(sorted(d[len('month='):] for d in month_dirs), dtype = 'datetime64[M]')
+
+
+
+### Loads a DAU store written by save_dau_store. If start_date or end_date are
+### given, only the monthly files covering them are read and the rows are
+### filtered to activity dates between them, inclusive. When no month is in 
+### range, the result has no rows but the columns and types of the store, read
+### from the schema of one of its files
+@instrumented()
+def load_dau_store(path, start_date = None, end_date = None):
+    all_months = get_dau_store_months(path)
+    months = all_months
+    if start_date is not None:
+        months = months[months >= np.datetime64(start_date, 'M')]
+    if end_date is not None:
+        months = months[months <= np.datetime64(end_date, 'M')]
+
+    dau_dfs = [pd.read_parquet(os.path.join(path, 'month=' + str(month), 'part-0.parquet'))
+               for month in months]
+    if len(dau_dfs) == 0:
+        if len(all_months) == 0:
+            return pd.DataFrame()
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(os.path.join(path, 'month=' + str(all_months[0]), 'part-0.parquet'))
+        return schema.empty_table().to_pandas()
+    dau_df = pd.concat(dau_dfs, ignore_index = True)
+
+    dates = dau_df['activity_date']
+    if start_date is not None:
+        dau_df = dau_df.loc[dates >= as_column_date(dates, start_date)]
+    if end_date is not None:
+        dau_df = dau_df.loc[dates <= as_column_date(dates, end_date)]
+    return dau_df.reset_index(drop = True)
+
+
+
+### The window functions below take either a dataframe or the path of a DAU
+### store. For a store, this reads only the days from start_date to end_date.
+### For a dataframe with a date index (see index_dau_by_date), it is the slice
+### of the rows of those days, and otherwise the whole dataframe
+def get_dau_window_df(dau_df, start_date, end_date):
+    if isinstance(dau_df, pd.DataFrame):
+        window_rows = get_date_index_rows(dau_df, start_date, end_date)
+        if window_rows is None:
+            return dau_df
+        return dau_df.iloc[window_rows[0]:window_rows[1]]
+    return load_dau_store(dau_df, start_date, end_date)
+
+
+
+### Sorts a DAU (or DAU decorated) dataframe by activity_date and indexes it by
+### the day number of activity_date (see date_to_day_number), in an index named
+### activity_day. The rows of any date window are then a contiguous block, 
+### found by searchsorted on the index, which get_dau_window_df slices without
+### scanning or copying the dataframe. The index moves with the rows, so a 
+### filtered copy keeps a valid date index, and a re-sorted copy, whose index
+### is no longer sorted, falls back to the full scan
+DATE_INDEX_NAME = 'activity_day'
+
+
+def index_dau_by_date(dau_df):
+    days = date_to_day_number(dau_df['activity_date'])
+    order = np.argsort(days, kind = 'stable')
+    indexed_df = dau_df.iloc[order]
+    indexed_df.index = pd.Index(days[order], name = DATE_INDEX_NAME)
+    return indexed_df
+
+
+
+### First and last (exclusive) row positions of the days from start_date to 
+### end_date in a dataframe indexed by index_dau_by_date, or None if it has no
+### sorted date index
+def get_date_index_rows(dau_df, start_date, end_date):
+    if dau_df.index.name != DATE_INDEX_NAME or not dau_df.index.is_monotonic_increasing:
+        return None
+    
+    start_day, end_day = date_to_day_number([start_date, end_date])
+    first_row = dau_df.index.searchsorted(start_day, side = 'left')
+    last_row = dau_df.index.searchsorted(end_day, side = 'right')
+    return first_row, max(first_row, last_row)
+
+
+
+
 ### Merging the WAU and first_dt dataframes created in the functions above, this 
 ### adds the user's first week to the WAU dataframe
 ### wau_decorated is used in the subsequent functions below
@@ -150,54 +723,111 @@ def create_dau_decorated_df(dau_df, use_segment, first_dt_df = None):
 
 
 def increment_period(xau_grouping_col, time_period):
-    time_fields = get_time_period_dict(time_period)
-    period_abbr = time_fields['period_abbr']
+    # Compact integer period ordinals
+    if pd.api.types.is_integer_dtype(xau_grouping_col):
+        return xau_grouping_col + 1
     
-    if time_period == 'week':
-        start_of_next_period = pd.to_datetime(pd.PeriodIndex(xau_grouping_col).start_time + timedelta(weeks = 1))
-    elif time_period == 'month':
-        start_of_next_period = pd.to_datetime(pd.PeriodIndex(xau_grouping_col, freq = period_abbr).start_time) + pd.DateOffset(months = 1)
-    else:
-        start_of_next_period = None
-        
-    if start_of_next_period is not None:
-        next_period = pd.Series(start_of_next_period).dt.to_period(period_abbr)
-    else:
-        next_period = None
-    
-    return next_period
+    next_ordinals = period_to_ordinal(xau_grouping_col).values + 1
+    return pd.Series(ordinal_to_period(next_ordinals, time_period), index = xau_grouping_col.index)
 
 
 
 
+@instrumented()
 def create_xau_decorated_df(dau_decorated_df, time_period, use_segment):
     
     time_fields = get_time_period_dict(time_period)
     grouping_col = time_fields['grouping_col']
     frequency = time_fields['frequency']
     first_period_col = time_fields['first_period_col']
-    period_abbr = time_fields['period_abbr']
     
-    print('Creating ' + frequency + ' Active Users Decorated dataframe')
+    logger.info('Creating ' + frequency + ' Active Users Decorated dataframe')
     
     groupby_cols = [grouping_col, 'user_id', first_period_col]
     if use_segment:
         groupby_cols = groupby_cols + ['segment']
         
-    dau_decorated = dau_decorated_df.copy()
-    dau_decorated[grouping_col] = pd.to_datetime(dau_decorated['activity_date']).dt.to_period(period_abbr)
-    xau = (dau_decorated.groupby(groupby_cols, as_index = False)['inc_amt'].sum())
+    compact = is_compact_dau(dau_decorated_df)
+    period = date_to_period_col(dau_decorated_df['activity_date'], time_period, compact)
+    # Only the first week and month are stored in dau_decorated, the first 
+    # period of the other time periods comes from first_dt
+    if first_period_col in dau_decorated_df:
+        first_period = dau_decorated_df[first_period_col]
+    else:
+        first_period = date_to_period_col(dau_decorated_df['first_dt'], time_period, compact)
+    groupby_keys = [period.rename(grouping_col), dau_decorated_df['user_id'], first_period.rename(first_period_col)]
+    groupby_keys = groupby_keys + [dau_decorated_df[c] for c in groupby_cols[3:]]
+    xau = (dau_decorated_df['inc_amt'].groupby(groupby_keys).sum().reset_index())
     xau['Next_' + grouping_col] = increment_period(xau[grouping_col], time_period)
     
     output_cols = [grouping_col, 'user_id', 'inc_amt', first_period_col, 'Next_' + grouping_col]
     if use_segment:
         output_cols = output_cols + ['segment']
     xau = xau[output_cols]
-    
+
     return xau
 
 
 
+### Builds the first_dt dataframe of create_first_dt_df and the decorated
+### dataframes of create_xau_decorated_df for several time periods from a single
+### scan of a DAU (or DAU decorated) dataframe. The dates are converted to day
+### numbers and the user IDs and segments to integer codes once, the week and
+### month keys are integer arithmetic on the day numbers, and the DAU dataframe
+### is never copied. Returns a dict keyed by 'first_dt' and the time periods
+@instrumented()
+def create_period_decorated_dfs(dau_df, use_segment = False, time_periods = ['week', 'month']):
+    logger.info('Creating first_dt and ' + ', '.join(time_periods) + ' decorated dataframes')
+    compact = is_compact_dau(dau_df)
+
+    days = date_to_day_number(dau_df['activity_date'])
+    user_codes, user_ids = pd.factorize(dau_df['user_id'], sort = True)
+    user_ids = np.asarray(user_ids, dtype = dau_df['user_id'].dtype)
+    first_days = pd.Series(days).groupby(user_codes).min().values
+    if use_segment:
+        segment_codes, segments = pd.factorize(dau_df['segment'], sort = True)
+
+    first_dt = pd.DataFrame({'user_id' : user_ids})
+    if compact:
+        first_dt['first_dt'] = first_days.astype('datetime64[D]').astype('datetime64[ns]')
+    else:
+        first_dt['first_dt'] = pd.Series(first_days.astype('datetime64[D]').astype('datetime64[ns]')).dt.date
+
+    period_dfs = {'first_dt' : first_dt}
+    for time_period in time_periods:
+        time_fields = get_time_period_dict(time_period)
+        grouping_col = time_fields['grouping_col']
+        first_period_col = time_fields['first_period_col']
+
+        first_ordinals = day_to_period_ordinal(first_days, time_period)
+        if compact:
+            first_dt[first_period_col] = first_ordinals
+        else:
+            first_dt[first_period_col] = ordinal_to_period(first_ordinals, time_period)
+
+        groupby_keys = [day_to_period_ordinal(days, time_period), user_codes]
+        if use_segment:
+            groupby_keys.append(segment_codes)
+        xau_sums = dau_df['inc_amt'].groupby(groupby_keys).sum()
+
+        ordinals = xau_sums.index.get_level_values(0).values
+        xau_user_codes = xau_sums.index.get_level_values(1).values
+        xau = pd.DataFrame({grouping_col : ordinals,
+                            'user_id' : user_ids.take(xau_user_codes),
+                            'inc_amt' : xau_sums.values,
+                            first_period_col : first_ordinals[xau_user_codes],
+                            'Next_' + grouping_col : ordinals + 1})
+        if not compact:
+            for period_col in [grouping_col, first_period_col, 'Next_' + grouping_col]:
+                xau[period_col] = ordinal_to_period(xau[period_col], time_period)
+        if use_segment:
+            xau['segment'] = segments.take(xau_sums.index.get_level_values(2).values)
+        period_dfs[time_period] = xau
+
+    return period_dfs
+
+
+
 
 ### Merging the MAU and first_dt dataframes created in the functions above, this 
 ### adds the user's first month to the MAU dataframe
@@ -251,6 +881,37 @@ def calc_rev_qr(row, new_col = 'new', res_col = 'resurrected',
 
 
 
+### Column-wise versions of calc_user_qr and calc_rev_qr, which calculate the
+### quick ratio of every row of a dataframe at once. Missing columns and NaN 
+### values count as 0, and the ratio is NaN when nothing was lost
+def get_ga_col(df, col):
+    if col in df:
+        return np.asarray(df[col].fillna(0), dtype = float)
+    return np.zeros(len(df))
+
+
+
+def calc_user_qr_col(df, new_col = 'new', res_col = 'resurrected', churned_col = 'churned'):
+    churned_users = get_ga_col(df, churned_col)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(churned_users < 0, 
+                        -1 * (get_ga_col(df, new_col) + get_ga_col(df, res_col)) / churned_users, 
+                        math.nan)
+
+
+
+def calc_rev_qr_col(df, new_col = 'new', res_col = 'resurrected', 
+                    churned_col = 'churned', exp_col = 'expansion', 
+                    con_col = 'contraction'):
+    lost_rev = get_ga_col(df, churned_col) + get_ga_col(df, con_col)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(lost_rev < 0, 
+                        -1 * (get_ga_col(df, new_col) + get_ga_col(df, res_col) + get_ga_col(df, exp_col)) / lost_rev, 
+                        math.nan)
+
+
+
+
 ### This takes a dataframe of transactions grouped by a particular date period
 ### and returns active, retained, new, resurrected, and churned users for that
 ### time period
@@ -292,66 +953,139 @@ def calc_rev_ga(x, grouping_col, first_period_col):
 
 
 
-### Produces the "final" growth accounting dataframe with both user and
-### revenue numbers for each time period in the "decorated" dataframe
-def create_growth_accounting_dfs(xau_decorated_df, 
-                                 time_period, 
-                                 use_segment = False,
-                                 keep_last_period = True, 
-                                 date_limit = None):
-    print('Creating Growth Accounting dataframes')
+### Column names of the user and revenue growth accounting dataframes, in the 
+### same order as the values returned by calc_user_ga and calc_rev_ga
+def get_user_ga_cols(frequency):
+    return [frequency + ' Active Users', 'Retained Users', 'New Users', 
+            'Resurrected Users', 'Churned Users']
+
+
+
+def get_rev_ga_cols(frequency):
+    return [frequency + ' Revenue', 'Retained Revenue', 'New Revenue', 
+            'Resurrected Revenue', 'Expansion Revenue', 'Contraction Revenue', 
+            'Churned Revenue']
+
+
+
+### Vectorized version of calc_user_ga and calc_rev_ga. Classifies every row
+### of the joined this period (.t) / last period (.l) dataframe at once and 
+### returns one column per growth accounting figure, holding the row's
+### contribution to that figure, so that each period's figures are a plain sum
+### of its rows. Each user appears at most once per period and segment, so 
+### summing the user flags gives the same counts as nunique() in calc_user_ga
+@instrumented()
+def calc_ga_flags(xga_interim, grouping_col, first_period_col, frequency):
+    inc_t = xga_interim['inc_amt.t']
+    inc_l = xga_interim['inc_amt.l']
+    
+    is_active = xga_interim[grouping_col + '.t'].notnull()
+    is_new = xga_interim[first_period_col + '.t'] == xga_interim[grouping_col + '.t']
+    is_not_new = xga_interim[first_period_col + '.t'] != xga_interim[grouping_col + '.t']
+    is_retained = (inc_t > 0) & (inc_l > 0)
+    is_resurrected = is_not_new & ~(inc_l > 0)
+    is_churned = ~(inc_t > 0)
+    is_expansion = is_not_new & is_retained & (inc_t > inc_l)
+    is_contraction = is_not_new & is_retained & (inc_t < inc_l)
+    
+    user_flags = [is_active, is_retained, is_new, is_resurrected, -1 * is_churned]
+    rev_amts = [inc_t.where(is_active, 0), 
+                np.minimum(inc_t, inc_l).where(is_retained, 0), 
+                inc_t.where(is_new, 0),
+                inc_t.where(is_resurrected, 0),
+                (inc_t - inc_l).where(is_expansion, 0),
+                (inc_t - inc_l).where(is_contraction, 0),
+                -1 * inc_l.where(is_churned, 0)]
+    
+    xga_flags = pd.DataFrame(dict(zip(get_user_ga_cols(frequency), user_flags)))
+    for c, amt in zip(get_rev_ga_cols(frequency), rev_amts):
+        xga_flags[c] = amt
+        
+    return xga_flags
+
+
+
+
+### Matches each user's period in the "decorated" dataframe to the one before 
+### it, so calc_ga_flags can classify the user in that period, with the same 
+### rows as an outer join of the dataframe to itself on the user (and segment)
+### and the next period. Instead of the join, the rows are sorted once by user
+### and period, so a user's last period is the row before when that row's 
+### Next_ period is this row's period. A row whose user has no row for its 
+### Next_ period also gets a row for that period, with only the last period's
+### inc_amt, where the user is churned. Periods are integer ordinals and the 
+### missing values NaN, and only the columns calc_ga_flags and the grouping 
+### need are kept. The dataframe passed in is not changed
+@instrumented()
+def join_xau_to_last_period(xau_decorated_df, time_period, use_segment = False):
     time_fields = get_time_period_dict(time_period)
     grouping_col = time_fields['grouping_col']
     first_period_col = time_fields['first_period_col']
-    frequency = time_fields['frequency']
     
-    xau_decorated_df_last = xau_decorated_df.copy()
-    xau_decorated_df_last[grouping_col + '_join'] = xau_decorated_df_last['Next_' + grouping_col]
-    xau_decorated_df[grouping_col + '_join'] = xau_decorated_df[grouping_col]
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    key_codes = xau_decorated_df.groupby(key_cols, sort = False).ngroup().values
+    periods = period_to_ordinal(xau_decorated_df[grouping_col]).values
+    order = np.lexsort((periods, key_codes))
     
-    interim_join_cols = ['user_id', grouping_col + '_join']
-    if use_segment:
-        interim_join_cols = interim_join_cols + ['segment']
+    key_codes = key_codes[order]
+    periods = periods[order]
+    next_periods = period_to_ordinal(xau_decorated_df['Next_' + grouping_col]).values[order]
+    inc_amt = xau_decorated_df['inc_amt'].values[order]
     
-    xga_interim = pd.merge(xau_decorated_df, xau_decorated_df_last, 
-                           suffixes = ['.t', '.l'],
-                           how = 'outer', 
-                           left_on = interim_join_cols, 
-                           right_on = interim_join_cols)
+    has_last = np.zeros(len(order), dtype = bool)
+    has_last[1:] = (key_codes[1:] == key_codes[:-1]) & (next_periods[:-1] == periods[1:])
+    is_churned = np.ones(len(order), dtype = bool)
+    is_churned[:-1] = ~has_last[1:]
     
-    groupby_cols = [grouping_col + '_join']
-    if use_segment:
-        groupby_cols = groupby_cols + ['segment']
-                        
-    user_xga = (xga_interim.groupby(groupby_cols)
-                .apply(lambda x: pd.Series(calc_user_ga(x, grouping_col, first_period_col),
-                                           index = [frequency + ' Active Users', 
-                                                    'Retained Users', 
-                                                    'New Users', 
-                                                    'Resurrected Users',
-                                                    'Churned Users'
-                                                    ]))
-                .reset_index()
-                .rename(columns = {grouping_col + '_join' : grouping_col}))
-                
-    rev_xga = (xga_interim.groupby(groupby_cols)
-                .apply(lambda x: pd.Series(calc_rev_ga(x, grouping_col, first_period_col),
-                                           index = [frequency + ' Revenue',
-                                                    'Retained Revenue',
-                                                    'New Revenue',
-                                                    'Resurrected Revenue',
-                                                    'Expansion Revenue',
-                                                    'Contraction Revenue',
-                                                    'Churned Revenue'
-                                                    ]))
-                .reset_index()
-                .rename(columns = {grouping_col + '_join' : grouping_col}))
+    last_inc_amt = np.full(len(order), np.nan)
+    last_inc_amt[1:] = np.where(has_last[1:], inc_amt[:-1], np.nan)
+    churned_nan = np.full(is_churned.sum(), np.nan)
+    
+    xga_interim = pd.DataFrame({grouping_col + '_join' : np.concatenate([periods, next_periods[is_churned]])})
+    for c in key_cols:
+        values = xau_decorated_df[c].values[order]
+        xga_interim[c] = np.concatenate([values, values[is_churned]])
+    first_periods = period_to_ordinal(xau_decorated_df[first_period_col]).values[order]
+    xga_interim[grouping_col + '.t'] = np.concatenate([periods.astype(float), churned_nan])
+    xga_interim[first_period_col + '.t'] = np.concatenate([first_periods.astype(float), churned_nan])
+    xga_interim['inc_amt.t'] = np.concatenate([inc_amt, churned_nan])
+    xga_interim['inc_amt.l'] = np.concatenate([last_inc_amt, inc_amt[is_churned]])
+    
+    return xga_interim
+
+
+
+
+### Sums the flags of calc_ga_flags by the given key columns (the period first)
+### and splits the result into the user and revenue growth accounting 
+### dataframes, dropping the periods without activity
+@instrumented()
+def sum_ga_flags(xga_flags, key_series, key_cols, time_period,
+                 keep_last_period = True, date_limit = None):
+    xga = xga_flags.groupby(key_series).sum()
+    xga.index.names = key_cols
+    xga = xga.reset_index()
+    
+    return split_ga_sums(xga, key_cols, time_period, keep_last_period, date_limit)
+
+
+
+### Splits the growth accounting sums of each period (and segment) into the 
+### user and revenue growth accounting dataframes, dropping the periods without
+### activity and turning the period ordinals into the start time of the periods
+def split_ga_sums(xga, key_cols, time_period, keep_last_period = True, date_limit = None):
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    frequency = time_fields['frequency']
+    
+    user_xga = xga[key_cols + get_user_ga_cols(frequency)].copy()
+    rev_xga = xga[key_cols + get_rev_ga_cols(frequency)].copy()
                 
     user_xga = user_xga[user_xga[frequency + ' Active Users'] > 0]
     rev_xga = rev_xga[rev_xga[frequency + ' Revenue'] > 0]
     
-    user_xga[grouping_col] = pd.to_datetime(pd.PeriodIndex(user_xga[grouping_col]).start_time) + timedelta(hours = 7) 
-    rev_xga[grouping_col] = pd.to_datetime(pd.PeriodIndex(rev_xga[grouping_col]).start_time) + timedelta(hours = 7)
+    user_xga[grouping_col] = period_start_time(user_xga[grouping_col], time_period) + timedelta(hours = 7) 
+    rev_xga[grouping_col] = period_start_time(rev_xga[grouping_col], time_period) + timedelta(hours = 7)
     
     if not keep_last_period:
         user_xga = user_xga[:-1]
@@ -366,39 +1100,170 @@ def create_growth_accounting_dfs(xau_decorated_df,
 
 
 
+### Produces the "final" growth accounting dataframe with both user and
+### revenue numbers for each time period in the "decorated" dataframe
+@instrumented(message = 'Creating Growth Accounting dataframes')
+def create_growth_accounting_dfs(xau_decorated_df, 
+                                 time_period, 
+                                 use_segment = False,
+                                 keep_last_period = True, 
+                                 date_limit = None):
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    frequency = time_fields['frequency']
+    
+    kernels = get_kernels()
+    if kernels is not None:
+        return calc_period_ga_with_kernel(kernels, xau_decorated_df, time_period, use_segment,
+                                          keep_last_period, date_limit)
+    
+    xga_interim = join_xau_to_last_period(xau_decorated_df, time_period, use_segment)
+    
+    key_series = [xga_interim[grouping_col + '_join']]
+    key_cols = [grouping_col]
+    if use_segment:
+        key_series = key_series + [xga_interim['segment']]
+        key_cols = key_cols + ['segment']
+    
+    xga_flags = calc_ga_flags(xga_interim, grouping_col, first_period_col, frequency)
+    return sum_ga_flags(xga_flags, key_series, key_cols, time_period, 
+                        keep_last_period, date_limit)
+
+
+
+
+### Label of the rows of create_growth_accounting_cube, e.g. "country=US, plan=Pro",
+### or "All" for the rows that roll up every segment column
+def get_grouping_set_labels(grouping_set, xga_df):
+    if len(grouping_set) == 0:
+        return pd.Series('All', index = xga_df.index)
+    
+    labels = grouping_set[0] + '=' + xga_df[grouping_set[0]].astype(str)
+    for c in grouping_set[1:]:
+        labels = labels + ', ' + c + '=' + xga_df[c].astype(str)
+    return labels
+
+
+
+
+### Growth accounting for several segmentations at once, like SQL GROUPING SETS.
+### user_segments_df has a user_id column and one column per segment (country,
+### plan, ...) holding the value of each user. The users are joined and 
+### classified once per period on the unsegmented xau_decorated_df, and their
+### flags are then summed under each grouping set, a list of segment columns
+### ([] is every user). The default is all users plus each column on its own.
+### Segment columns that a grouping set rolls up are 'All', and the segment 
+### column labels the rows so consolidate_ga_cube can add the ratios. 
+### Since users are classified once, their segment values must not change
+### over time, so user_segments_df must have one row per user_id; users 
+### missing from it are 'Unknown'. A column named 'segment' would clash with 
+### the row labels and raises a ValueError, as do repeated user_ids
+@instrumented(message = 'Creating Growth Accounting cube')
+def create_growth_accounting_cube(xau_decorated_df, 
+                                  time_period, 
+                                  user_segments_df,
+                                  grouping_sets = None,
+                                  keep_last_period = True, 
+                                  date_limit = None):
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    frequency = time_fields['frequency']
+    
+    if 'segment' in user_segments_df.columns:
+        raise ValueError("user_segments_df cannot have a 'segment' column, it labels the rows of the cube")
+    duplicated_users = user_segments_df['user_id'].duplicated()
+    if duplicated_users.any():
+        raise ValueError('user_segments_df must have one row per user_id, %d user_ids are repeated, e.g. %s' %
+                         (user_segments_df.loc[duplicated_users, 'user_id'].nunique(), 
+                          user_segments_df.loc[duplicated_users, 'user_id'].iloc[0]))
+    
+    segment_cols = [c for c in user_segments_df.columns if c != 'user_id']
+    if grouping_sets is None:
+        grouping_sets = [[]] + [[c] for c in segment_cols]
+    
+    xga_interim = join_xau_to_last_period(xau_decorated_df, time_period)
+    xga_flags = calc_ga_flags(xga_interim, grouping_col, first_period_col, frequency)
+    
+    user_segments = pd.merge(xga_interim[['user_id']], user_segments_df, 
+                             how = 'left', on = 'user_id')
+    user_segments.index = xga_interim.index
+    
+    user_xgas = []
+    rev_xgas = []
+    for grouping_set in grouping_sets:
+        logger.info('Summing growth accounting by ' + (', '.join(grouping_set) if grouping_set else 'All'))
+        key_series = [xga_interim[grouping_col + '_join']] + \
+                     [user_segments[c].fillna('Unknown') for c in grouping_set]
+        user_xga, rev_xga = sum_ga_flags(xga_flags, key_series, [grouping_col] + grouping_set, 
+                                         time_period, keep_last_period, date_limit)
+        for xga_df in [user_xga, rev_xga]:
+            for c in segment_cols:
+                if c not in grouping_set:
+                    xga_df[c] = 'All'
+            xga_df['segment'] = get_grouping_set_labels(grouping_set, xga_df)
+        user_xgas.append(user_xga)
+        rev_xgas.append(rev_xga)
+    
+    key_cols = [grouping_col, 'segment'] + segment_cols
+    user_cube = pd.concat(user_xgas, ignore_index = True)
+    rev_cube = pd.concat(rev_xgas, ignore_index = True)
+    user_cube = user_cube[key_cols + get_user_ga_cols(frequency)]
+    rev_cube = rev_cube[key_cols + get_rev_ga_cols(frequency)]
+    
+    return user_cube, rev_cube
+
+
+
+
+### Rows of a growth accounting dataframe grouped by segment, in the order the
+### segments first appear, with the original index kept in an 'index' column 
+### and each segment's rows numbered from 0, as the ratio functions below have
+### always returned them. Without segmentation the segment is 'All'
+def group_ga_rows_by_segment(xga_df, use_segment):
+    if not use_segment:
+        ratio_df = xga_df.reset_index()
+        ratio_df['segment'] = 'All'
+        return ratio_df
+    
+    segment_pos = pd.Index(xga_df['segment'].unique()).get_indexer(xga_df['segment'])
+    ratio_df = xga_df.iloc[np.argsort(segment_pos, kind = 'mergesort')].reset_index()
+    ratio_df.index = ratio_df.groupby('segment', sort = False).cumcount().values
+    return ratio_df
+
+
+
+### Shifts a column of a dataframe from group_ga_rows_by_segment by the given
+### number of periods within each segment
+def shift_within_segment(ratio_df, col, periods):
+    return ratio_df.groupby('segment', sort = False)[col].shift(periods).values
+
+
+
 ### Using the numbers in the "final" growth accounting dataframe, calculate
 ### the number of users at the beginning of the period (BOP), the  
 ### period-over-period user retention ratio, and the user quick ratio
+### The ratios of all segments are calculated together, shifting within each
+### segment, with the same results as calc_user_qr row by row
+@instrumented()
 def calc_user_ga_ratios(user_xga_df, time_period, use_segment = False, growth_rate_periods = 12):
     
     time_fields = get_time_period_dict(time_period)
     frequency = time_fields['frequency']
     per = time_fields['period_abbr']
     
-    if use_segment:
-        segments = user_xga_df.segment.unique()
-    else:
-        segments = ['All']
-
-    ratio_df = pd.DataFrame()    
-    for s in segments:
-        if s != 'All':
-            this_ratio_df = user_xga_df.copy().loc[user_xga_df['segment'] == s].reset_index()
-        else:
-            this_ratio_df = user_xga_df.copy().reset_index()
-            this_ratio_df['segment'] = s
-            
-        this_ratio_df['Users BOP'] = this_ratio_df[frequency + ' Active Users'].shift(1)
-        this_ratio_df[per + 'o' + per + ' User Retention'] = this_ratio_df['Retained Users'] / this_ratio_df['Users BOP']
-        this_ratio_df['User Quick Ratio'] = this_ratio_df.apply(lambda x: calc_user_qr(x, 
-                     new_col = 'New Users', res_col = 'Resurrected Users', 
-                     churned_col = 'Churned Users'), axis = 1)
-    
-        cgr_col = 'T%s%s User C%sGR' % (growth_rate_periods, per, per)
-        this_ratio_df[cgr_col] = np.power((this_ratio_df[frequency + ' Active Users'] / \
-                     this_ratio_df[frequency + ' Active Users'].shift(growth_rate_periods)), 1/growth_rate_periods)-1
-        
-        ratio_df = ratio_df.append(this_ratio_df)
+    ratio_df = group_ga_rows_by_segment(user_xga_df, use_segment)
+    
+    ratio_df['Users BOP'] = shift_within_segment(ratio_df, frequency + ' Active Users', 1)
+    ratio_df[per + 'o' + per + ' User Retention'] = ratio_df['Retained Users'] / ratio_df['Users BOP']
+    ratio_df['User Quick Ratio'] = calc_user_qr_col(ratio_df, new_col = 'New Users', 
+                                                    res_col = 'Resurrected Users', 
+                                                    churned_col = 'Churned Users')
+    
+    cgr_col = 'T%s%s User C%sGR' % (growth_rate_periods, per, per)
+    ratio_df[cgr_col] = np.power((ratio_df[frequency + ' Active Users'] / \
+                 shift_within_segment(ratio_df, frequency + ' Active Users', growth_rate_periods)), 1/growth_rate_periods)-1
     
     return ratio_df
 
@@ -408,39 +1273,29 @@ def calc_user_ga_ratios(user_xga_df, time_period, use_segment = False, growth_ra
 ### Using the numbers in the "final" growth accounting dataframe, calculate
 ### the revenue at the beginning of the period (BOP), the  
 ### period-over-period revenue retention ratio, and the revenue quick ratio
+### The ratios of all segments are calculated together, as in calc_user_ga_ratios
+@instrumented()
 def calc_rev_ga_ratios(rev_xga_df, time_period, use_segment = False, growth_rate_periods = 12):
     
     time_fields = get_time_period_dict(time_period)
     frequency = time_fields['frequency']
     per = time_fields['period_abbr']
     
-    if use_segment:
-        segments = rev_xga_df.segment.unique()
-    else:
-        segments = ['All']
-        
-    ratio_df = pd.DataFrame()
-    for s in segments:
-        if s!= 'All':
-            this_ratio_df = rev_xga_df.copy().loc[rev_xga_df['segment'] == s].reset_index()
-        else:
-            this_ratio_df = rev_xga_df.copy().reset_index()
-            this_ratio_df['segment'] = s
-            
-        this_ratio_df['Revenue BOP'] = this_ratio_df[frequency + ' Revenue'].shift(1)
-        this_ratio_df[per + 'o' + per + ' Revenue Retention'] = this_ratio_df['Retained Revenue'] / this_ratio_df['Revenue BOP']
-        this_ratio_df['Revenue Quick Ratio'] = this_ratio_df.apply(lambda x: calc_rev_qr(x,
-                new_col = 'New Revenue', res_col = 'Resurrected Revenue', 
-                exp_col = 'Expansion Revenue', churned_col = 'Churned Revenue', 
-                con_col = 'Contraction Revenue'), axis = 1)
-        this_ratio_df['Net Expansion Revenue'] = this_ratio_df['Expansion Revenue'] + \
-                                            this_ratio_df['Contraction Revenue']
-        
-        cgr_col = 'T%s%s Revenue C%sGR' % (growth_rate_periods, per, per)
-        this_ratio_df[cgr_col] = np.power((this_ratio_df[frequency + ' Revenue'] / \
-                this_ratio_df[frequency + ' Revenue'].shift(growth_rate_periods)), 1/growth_rate_periods)-1
-        
-        ratio_df = ratio_df.append(this_ratio_df)
+    ratio_df = group_ga_rows_by_segment(rev_xga_df, use_segment)
+    
+    ratio_df['Revenue BOP'] = shift_within_segment(ratio_df, frequency + ' Revenue', 1)
+    ratio_df[per + 'o' + per + ' Revenue Retention'] = ratio_df['Retained Revenue'] / ratio_df['Revenue BOP']
+    ratio_df['Revenue Quick Ratio'] = calc_rev_qr_col(ratio_df, new_col = 'New Revenue', 
+                                                      res_col = 'Resurrected Revenue', 
+                                                      exp_col = 'Expansion Revenue', 
+                                                      churned_col = 'Churned Revenue', 
+                                                      con_col = 'Contraction Revenue')
+    ratio_df['Net Expansion Revenue'] = ratio_df['Expansion Revenue'] + \
+                                        ratio_df['Contraction Revenue']
+    
+    cgr_col = 'T%s%s Revenue C%sGR' % (growth_rate_periods, per, per)
+    ratio_df[cgr_col] = np.power((ratio_df[frequency + ' Revenue'] / \
+            shift_within_segment(ratio_df, frequency + ' Revenue', growth_rate_periods)), 1/growth_rate_periods)-1
     
     return ratio_df
 
@@ -449,12 +1304,13 @@ def calc_rev_ga_ratios(rev_xga_df, time_period, use_segment = False, growth_rate
 
 ### Join the user growth accounting dataframe with the revenue growth accounting
 ### dataframe
+@instrumented()
 def consolidate_ga_dfs(user_ga_df, rev_ga_df, time_period):
     
     time_fields = get_time_period_dict(time_period)
     grouping_col = time_fields['grouping_col']
     
-    print('Joining user and revenue dataframes')
+    logger.info('Joining user and revenue dataframes')
     
     consolidated_ga_df = pd.merge(user_ga_df, rev_ga_df,
                                   how = 'inner', on = [grouping_col, 'segment'])
@@ -465,6 +1321,7 @@ def consolidate_ga_dfs(user_ga_df, rev_ga_df, time_period):
 
 
 ### Bring together all the Weekly/Monthly Growth Accounting Functions into a complete dataframe
+@instrumented()
 def consolidate_all_ga(xau_decorated_df, 
                        time_period, 
                        use_segment = False, 
@@ -475,6 +1332,15 @@ def consolidate_all_ga(xau_decorated_df,
     user_ga, rev_ga = create_growth_accounting_dfs(xau_decorated_df, time_period, 
                                                    use_segment, keep_last_period, 
                                                    date_limit)
+    return consolidate_ga_with_ratios(user_ga, rev_ga, time_period, use_segment, growth_rate_periods)
+
+
+
+### Adds the ratios to the user and revenue growth accounting dataframes 
+### created by create_growth_accounting_dfs and joins them. This is the part of
+### consolidate_all_ga that follows create_growth_accounting_dfs
+@instrumented()
+def consolidate_ga_with_ratios(user_ga, rev_ga, time_period, use_segment = False, growth_rate_periods = 12):
     user_ga_with_ratios = calc_user_ga_ratios(user_ga, time_period, use_segment, growth_rate_periods)
     rev_ga_with_ratios = calc_rev_ga_ratios(rev_ga, time_period, use_segment, growth_rate_periods)
     all_ga_df = consolidate_ga_dfs(user_ga_with_ratios, rev_ga_with_ratios, time_period)
@@ -488,75 +1354,181 @@ def consolidate_all_ga(xau_decorated_df,
 
 
 
+
+### Bring together the growth accounting of every grouping set in
+### create_growth_accounting_cube into a complete dataframe, with the ratios
+### of each grouping set and segment value calculated in one pass
+@instrumented()
+def consolidate_ga_cube(xau_decorated_df, 
+                        time_period, 
+                        user_segments_df,
+                        grouping_sets = None,
+                        growth_rate_periods = 12,
+                        keep_last_period = True, 
+                        date_limit = None):
+    
+    user_cube, rev_cube = create_growth_accounting_cube(xau_decorated_df, time_period, 
+                                                        user_segments_df, grouping_sets,
+                                                        keep_last_period, date_limit)
+    
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    frequency = time_fields['frequency']
+    segment_cols = [c for c in user_segments_df.columns if c != 'user_id']
+    
+    user_cube_with_ratios = calc_user_ga_ratios(user_cube, time_period, True, growth_rate_periods)
+    rev_cube_with_ratios = calc_rev_ga_ratios(rev_cube, time_period, True, growth_rate_periods)
+    
+    logger.info('Joining user and revenue dataframes')
+    all_ga_df = pd.merge(user_cube_with_ratios, rev_cube_with_ratios, how = 'inner', 
+                         on = [grouping_col, 'segment'] + segment_cols)
+    all_ga_df['Revenue per User'] = all_ga_df[frequency + ' Revenue'] / \
+                                    all_ga_df[frequency + ' Active Users']
+    
+    return all_ga_df
+
+
+
+### Adds a column per number of periods since the first one, holding 
+### cum_inc_per_cohort_cust in the rows of that age and NaN elsewhere (zero is
+### also shown as NaN). The columns are filled in one block rather than one at
+### a time
 def add_period_n_cum_inc_per_cohort_cust_columns(cohort_df, since_col, unit):
-    c_df = cohort_df.copy()
-    since_vector = c_df[since_col].unique()
-    for n in since_vector:
-        new_column_name = unit + ' %s' % n
-        c_df[new_column_name] = c_df['cum_inc_per_cohort_cust'] * (c_df[since_col] == n)
-        c_df[new_column_name] = c_df[new_column_name].replace(0, np.nan)
-    return c_df
+    since_vector = cohort_df[since_col].unique()
+    since_idx = pd.Index(since_vector).get_indexer(cohort_df[since_col])
+    
+    period_n_values = np.full((len(cohort_df), len(since_vector)), np.nan)
+    period_n_values[np.arange(len(cohort_df)), since_idx] = cohort_df['cum_inc_per_cohort_cust'].values
+    period_n_values[period_n_values == 0] = np.nan
+    
+    period_n_df = pd.DataFrame(period_n_values, index = cohort_df.index,
+                               columns = [unit + ' %s' % n for n in since_vector])
+    return pd.concat([cohort_df, period_n_df], axis = 1)
+
+
+
+### Pivots the cohort retention dataframe of xau_retention_by_cohort_df into a
+### triangular matrix with one row per cohort (and segment) and one column per
+### value and number of periods since the first one
+def create_cohort_matrix(cohort_df, time_period, use_segment = False, 
+                         values = ['cust_ret_pct', 'cum_inc_per_cohort_cust']):
+    time_fields = get_time_period_dict(time_period)
+    first_period_col = time_fields['first_period_col']
+    since_col = '%ss Since First' % time_fields['unit']
+    
+    index_cols = [first_period_col]
+    if use_segment:
+        index_cols = index_cols + ['segment']
+    
+    return cohort_df.pivot(index = index_cols, columns = since_col, values = values)
     
 
 
+### Layouts of the cohort retention dataframes, see xau_retention_by_cohort_df
+COHORT_LAYOUTS = ['wide', 'long', 'triangle']
+
+
+
+### Raises a ValueError for a cohort layout that is not one of COHORT_LAYOUTS
+def check_cohort_layout(layout):
+    if layout not in COHORT_LAYOUTS:
+        raise ValueError('Unknown cohort layout %s, expected one of %s' % (layout, COHORT_LAYOUTS))
+
+
+
 ### Calculate the user retention by cohort defined by any weekly or monthly time period
+### With the default 'wide' layout, the dataframe has one row per cohort and 
+### period and a cumulative revenue per customer column per number of periods 
+### since the first one (see add_period_n_cum_inc_per_cohort_cust_columns). 
+### 'long' leaves those columns out, and 'triangle' returns the cohort matrix
+### of create_cohort_matrix instead, which grow with the number of cohorts 
+### rather than with the number of rows times the number of periods
+@instrumented()
 def xau_retention_by_cohort_df(xau_decorated_df, time_period, use_segment = False,
-                               recent_periods_back_to_exclude = 1, date_limit = None):
+                               recent_periods_back_to_exclude = 1, date_limit = None, layout = 'wide'):
+    check_cohort_layout(layout)
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    
+    if date_limit is not None:
+        xau_d = xau_decorated_df[period_start_time(xau_decorated_df[grouping_col], time_period) <= date_limit]
+    else:
+        xau_d = xau_decorated_df
+    
+    cohort_counts = calc_cohort_period_counts(xau_d, time_period, use_segment)
+    
+    return finish_cohort_df(cohort_counts, time_period, use_segment, recent_periods_back_to_exclude, layout)
+
+
+
+### Revenue and number of users of each cohort in each period, with one row per
+### cohort, period (and segment), sorted in that order. These are the counts 
+### that xau_retention_by_cohort_df derives the retention figures from
+@instrumented()
+def calc_cohort_period_counts(xau_decorated_df, time_period, use_segment = False):
     
     time_fields = get_time_period_dict(time_period)
     grouping_col = time_fields['grouping_col']
     first_period_col = time_fields['first_period_col']
     unit = time_fields['unit']
-    period_abbr = time_fields['period_abbr']
-        
-    since_col = '%ss Since First' % unit
     
-    if date_limit is not None:
-        xau_d = xau_decorated_df[pd.PeriodIndex(xau_decorated_df[grouping_col], freq = period_abbr).start_time <= date_limit].copy()
-    else:
-        xau_d = xau_decorated_df.copy()
+    since_col = '%ss Since First' % unit
     
-    xau_d[since_col] = xau_d[grouping_col] - xau_d[first_period_col]
+    since = period_to_ordinal(xau_decorated_df[grouping_col]) - period_to_ordinal(xau_decorated_df[first_period_col])
     
     first_groupby_cols = [first_period_col, grouping_col, since_col]
     if use_segment:
         first_groupby_cols = first_groupby_cols + ['segment']
     
-    xau_d = xau_d.groupby(first_groupby_cols)\
+    cohort_counts = xau_decorated_df.assign(**{since_col : since})\
+                    .groupby(first_groupby_cols)\
                     .agg({'inc_amt' : 'sum', 
                           'user_id' : 'nunique'})\
-                    .rename(columns = { 'user_id' : 'cust_ct' })
-                    
+                    .rename(columns = { 'user_id' : 'cust_ct' })\
+                    .reset_index()
+    
+    return cohort_counts
+
+
+
+### Turns the counts of calc_cohort_period_counts into the cohort retention 
+### dataframe returned by xau_retention_by_cohort_df
+@instrumented()
+def finish_cohort_df(cohort_counts, time_period, use_segment = False, recent_periods_back_to_exclude = 1,
+                     layout = 'wide'):
+    check_cohort_layout(layout)
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    unit = time_fields['unit']
+    
+    since_col = '%ss Since First' % unit
+    
     second_groupby_cols = [first_period_col]
     if use_segment:
         second_groupby_cols = second_groupby_cols + ['segment']
     
+    xau_d = cohort_counts.reset_index(drop = True)
     xau_d['cohort_cust_ct'] = xau_d.groupby(second_groupby_cols)['cust_ct'].transform('first')
     xau_d['cum_inc_amt'] = xau_d.groupby(second_groupby_cols)['inc_amt'].cumsum()
     
     xau_d['cum_inc_per_cohort_cust'] = xau_d['cum_inc_amt'] / xau_d['cohort_cust_ct']
     xau_d['cust_ret_pct'] = xau_d['cust_ct'] / xau_d['cohort_cust_ct']
     
-    xau_d = xau_d.reset_index()
-    
-    if time_period == 'month':
-#        td = timedelta(months = recent_periods_back_to_exclude)
-        td = pd.DateOffset(months = recent_periods_back_to_exclude)
-    elif time_period == 'week':
-        td = timedelta(weeks = recent_periods_back_to_exclude)
-    
-    last_period = pd.to_datetime(datetime.today() - td).to_period(period_abbr)
-    xau_d = xau_d.loc[xau_d[grouping_col] <= last_period]
+    last_period = date_to_period_ordinal([datetime.today()], time_period)[0] - recent_periods_back_to_exclude
+    xau_d = xau_d.loc[period_to_ordinal(xau_d[grouping_col]) <= last_period]
     
-    xau_d[first_period_col] = pd.PeriodIndex(xau_d[first_period_col], freq = period_abbr).start_time + timedelta(hours = 7)
-    xau_d[grouping_col] = pd.PeriodIndex(xau_d[grouping_col], freq = period_abbr).start_time + timedelta(hours = 7)
+    xau_d[first_period_col] = period_start_time(xau_d[first_period_col], time_period) + timedelta(hours = 7)
+    xau_d[grouping_col] = period_start_time(xau_d[grouping_col], time_period) + timedelta(hours = 7)
     
     if use_segment:
         xau_d['segment_first_month'] = xau_d[first_period_col].dt.strftime('%Y-%m') + '-' + xau_d['segment']  
     
-    xau_d = add_period_n_cum_inc_per_cohort_cust_columns(xau_d, since_col, unit)
+    if layout == 'triangle':
+        return create_cohort_matrix(xau_d, time_period, use_segment)
+    if layout == 'wide':
+        xau_d = add_period_n_cum_inc_per_cohort_cust_columns(xau_d, since_col, unit)
     
-   
     return xau_d
 
 
@@ -604,30 +1576,62 @@ def assign_user_status(x):
 
 
 
+### Status codes used by the vectorized and incremental window calculations. 
+### They index the columns of the status count arrays, so NO_STATUS must stay 0
+NO_STATUS, NEW, RETAINED, RESURRECTED, CHURNED = range(5)
+WINDOW_STATUS_NAMES = np.array(['prior', 'new', 'retained', 'resurrected', 'churned'])
+
+
+
+### Vectorized equivalent of assign_ga_date_range followed by assign_user_status.
+### Takes each user's number of active days in the current window ("this 
+### period") and in the window before it ("last period") and returns the status
+### codes above. assign_ga_date_range and assign_user_status are the row-wise 
+### reference implementation of the same rules
+def classify_window_status(this_ct, last_ct, first_dt, curr_period_start_dt):
+    return np.select([(this_ct > 0) & (first_dt >= curr_period_start_dt),
+                      (this_ct > 0) & (last_ct > 0),
+                      this_ct > 0,
+                      last_ct > 0],
+                     [NEW, RETAINED, RESURRECTED, CHURNED],
+                     NO_STATUS)
+
+
+
 ### Combines the above functions to determine the growth accounting for a 
 ### window specified by its end date. If use_segment is False, it returns a
 ### dataframe of one row. If use_segment is True, it returns a dataframe with 
 ### one row per segment
+### dau_decorated_df can also be the path of a store of the DAU decorated 
+### dataframe written by save_dau_store, in which case only the months covering
+### the two windows are read
+@instrumented()
 def calc_ga_for_window(dau_decorated_df, last_date, window_days, use_segment):
-    window_start_date = last_date - timedelta(days = 2*window_days-1)
+    dau_decorated_df = get_dau_window_df(dau_decorated_df, last_date - timedelta(days = 2*window_days-1), last_date)
+    dates = dau_decorated_df['activity_date']
+    window_start_date = as_column_date(dates, last_date - timedelta(days = 2*window_days-1))
+    curr_period_start_dt = as_column_date(dates, last_date - timedelta(days = window_days-1))
     dau_dec = (dau_decorated_df
-            .loc[(dau_decorated_df['activity_date'] >= window_start_date) & (dau_decorated_df['activity_date'] <= last_date)]
-            .copy()
+            .loc[(dates >= window_start_date) & (dates <= as_column_date(dates, last_date))]
             )
     
-    dau_dec['ga_date_range'] = dau_dec.apply(lambda x: assign_ga_date_range(x, last_date, window_days), axis = 1)
-    
-    groupings = ['user_id', 'ga_date_range']
+    groupings = ['user_id']
     if use_segment:
         groupings.insert(1, 'segment')
-        
-    dau_grouped = (dau_dec.groupby(groupings)['inc_amt']
-                                .sum()
-                                .unstack()
-                                .reset_index()
-                                )
-          
-    dau_grouped['user_status'] = dau_grouped.apply(assign_user_status, axis = 1)
+    
+    is_this_period = (dau_dec['activity_date'] >= curr_period_start_dt).values
+    dau_grouped = (dau_dec[groupings + ['first_dt']]
+                   .assign(this_period = is_this_period, last_period = ~is_this_period)
+                   .groupby(groupings)
+                   .agg({'first_dt' : 'first', 'this_period' : 'sum', 'last_period' : 'sum'})
+                   .reset_index()
+                   )
+    
+    status = classify_window_status(dau_grouped['this_period'].values, 
+                                    dau_grouped['last_period'].values, 
+                                    dau_grouped['first_dt'].values, 
+                                    curr_period_start_dt)
+    dau_grouped['user_status'] = WINDOW_STATUS_NAMES[status]
 
     groupings2 = ['user_status']
     if use_segment == True:
@@ -636,6 +1640,7 @@ def calc_ga_for_window(dau_decorated_df, last_date, window_days, use_segment):
         dau_grouped_2 = (dau_grouped.groupby(groupings2)['user_id']
                             .count()
                             .unstack(level = 'user_status')
+                            .rename_axis(columns = None)
                             .reset_index()
                             )
         dau_grouped_2['window_end_date'] = last_date
@@ -644,94 +1649,568 @@ def calc_ga_for_window(dau_decorated_df, last_date, window_days, use_segment):
                             .count()
                             .to_frame(name = last_date)
                             .T
+                            .rename_axis(columns = None)
                             .reset_index()
                             .rename(columns = { 'index' : 'window_end_date'})
                             )  
     
-    new_users = dau_grouped_2.new if hasattr(dau_grouped_2, 'new') else 0 
-    res_users = dau_grouped_2.resurrected if hasattr(dau_grouped_2, 'resurrected') else 0
-    dau_grouped_2.churned = -1 * dau_grouped_2.churned if hasattr(dau_grouped_2, 'churned') else 0
-    churned_users = dau_grouped_2.churned if hasattr(dau_grouped_2, 'churned') else 0
-    ret_users = dau_grouped_2.retained if hasattr(dau_grouped_2, 'retained') else 0
-    
-    dau_grouped_2['active_users'] = new_users + res_users + ret_users
-    dau_grouped_2['user_quick_ratio'] = dau_grouped_2.apply(calc_user_qr, axis = 1)
-    dau_grouped_2['user_retention_rate'] = ret_users / (ret_users - churned_users)
-    dau_grouped_2['window_days'] = window_days
-    dau_grouped_2['Growth Threshold'] = 1
+    if 'churned' in dau_grouped_2:
+        dau_grouped_2['churned'] = -1 * dau_grouped_2['churned']
         
-    return dau_grouped_2
+    return add_window_ga_ratios(dau_grouped_2, window_days)
+    
+
+    
+### Lays the DAU out as arrays sorted by day for the incremental window engines.
+### A "key" is a user_id, or a user_id and segment pair when use_segment is True.
+### The keys active on day index d are day_keys[day_ptr[d]:day_ptr[d+1]], where
+### day index 0 is start_day, the earliest activity date in the dataframe
+@instrumented()
+def create_daily_activity_arrays(dau_decorated_df, use_segment = False):
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    
+    key_codes = dau_decorated_df.groupby(key_cols, sort = False).ngroup().values
+    activity = pd.DataFrame({'key' : key_codes,
+                             'day' : date_to_day_number(dau_decorated_df['activity_date']),
+                             'inc_amt' : dau_decorated_df['inc_amt'].values})
+    start_day = activity['day'].min()
+    activity['day'] = activity['day'] - start_day
+    n_days = activity['day'].max() + 1 if len(activity) > 0 else 0
+    
+    # One entry per key and day, even if the dataframe has several rows for it
+    activity = activity.groupby(['day', 'key'], as_index = False)['inc_amt'].sum()
+    
+    # A user's first day can be before the first day of the data when it only 
+    # holds some of the user's activity, e.g. one segment or a slice of a store.
+    # Counting it as day 0 does not change any status, as every window 
+    # calculated starts after day 0
+    keys = (dau_decorated_df[key_cols]
+            .assign(key = key_codes,
+                    first_day = np.maximum(date_to_day_number(dau_decorated_df['first_dt']) - start_day, 0))
+            .drop_duplicates('key')
+            .sort_values('key'))
     
+    if use_segment:
+        segment_codes, segments = pd.factorize(keys['segment'], sort = True)
+    else:
+        segment_codes, segments = np.zeros(len(keys), dtype = np.int64), pd.Index(['All'])
+    
+    day_ptr = np.concatenate([[0], np.cumsum(np.bincount(activity['day'], minlength = n_days))])
+    
+    return {'use_segment' : use_segment,
+            'start_day' : start_day,
+            'n_days' : n_days,
+            'day_ptr' : day_ptr,
+            'day_keys' : activity['key'].values,
+            'day_inc_amt' : activity['inc_amt'].values,
+            'key_user_id' : keys['user_id'].values,
+            'key_segment' : segment_codes,
+            'key_first_day' : keys['first_day'].values,
+            'segments' : segments
+            }
+
+
+
+### Sparse key-by-day matrices of activity flags ('active') and inc_amt, built 
+### once from dau_decorated so that any window metric becomes a column-range 
+### sum instead of a re-filter of the dataframe. Row k is key k of 
+### create_daily_activity_arrays (a user_id, or a user_id and segment pair) and
+### column d is day start_day + d. The matrices are CSC, so the rows active on a
+### day are one contiguous block, and they share their index arrays with 
+### day_keys and day_ptr, which means day_ptr[d] is also the cumulative number 
+### of active days before day d. The incremental engines run on it directly.
+### Requires scipy
+@instrumented(message = 'Creating activity matrix')
+def create_activity_matrix(dau_decorated_df, use_segment = False):
+    from scipy import sparse
+    
+    activity_matrix = create_daily_activity_arrays(dau_decorated_df, use_segment)
+    shape = (len(activity_matrix['key_first_day']), activity_matrix['n_days'])
+    inc_amt = sparse.csc_matrix((activity_matrix['day_inc_amt'], 
+                                 activity_matrix['day_keys'], 
+                                 activity_matrix['day_ptr']), shape = shape)
+    active = sparse.csc_matrix((np.ones(inc_amt.nnz, dtype = np.int8), 
+                                inc_amt.indices, 
+                                inc_amt.indptr), shape = shape)
+    
+    activity_matrix.update({'active' : active,
+                            'inc_amt' : inc_amt,
+                            'day_keys' : inc_amt.indices,
+                            'day_ptr' : inc_amt.indptr,
+                            'day_inc_amt' : inc_amt.data})
+    return activity_matrix
+
+
+
+### First and last date covered by an activity matrix (or the arrays returned by
+### create_daily_activity_arrays)
+def get_activity_date_range(activity):
+    start_dt = pd.to_datetime(activity['start_day'], unit = 'D')
+    return start_dt, start_dt + timedelta(days = int(activity['n_days']) - 1)
+
+
+
+### Number of active days and total inc_amt of every key of an activity matrix
+### in the window of window_days days ending on last_date
+def calc_window_key_totals(activity_matrix, last_date, window_days):
+    last_day_idx = date_to_day_number([last_date])[0] - activity_matrix['start_day']
+    first_col = min(max(last_day_idx - window_days + 1, 0), activity_matrix['n_days'])
+    last_col = min(max(last_day_idx + 1, 0), activity_matrix['n_days'])
+    
+    active_days = activity_matrix['active'][:, first_col:last_col].getnnz(axis = 1)
+    inc_amt = np.asarray(activity_matrix['inc_amt'][:, first_col:last_col].sum(axis = 1)).ravel()
+    
+    return active_days, inc_amt
+
+
+
+### Slides the current window ("this period") and the window before it ("last 
+### period") forward one day at a time over the arrays created by 
+### create_daily_activity_arrays, keeping each key's active day count in both
+### windows. Only the keys that enter a window, move from the current window to 
+### the previous one, leave the previous window, or stop being new are 
+### reclassified each day, so the total cost scales with rows plus days.
+### Returns an array of shape (days, segments, 5) with the number of keys in 
+### each status for each window end day index from first_day_idx to 
+### last_day_idx. A window only depends on the 2*window_days days ending on it, 
+### so the slide starts that many days before first_day_idx, which lets a long
+### series be computed in independent chunks
+def calc_rolling_status_counts(activity, window_days, first_day_idx = 0, last_day_idx = None):
+    if last_day_idx is None:
+        last_day_idx = activity['n_days'] - 1
+    n_segments = len(activity['segments'])
+    
+    results = np.zeros((max(last_day_idx - first_day_idx + 1, 0), n_segments, 5), dtype = np.int64)
+    for i, status_counts in enumerate(iter_rolling_status_counts(activity, window_days, 
+                                                                 first_day_idx, last_day_idx)):
+        results[i] = status_counts
+    
+    return results
+
+
+
+### Generator behind calc_rolling_status_counts. Yields the (segments, 5) array
+### of status counts for each window end day index from first_day_idx to 
+### last_day_idx. The array is updated in place, so copy it to keep it
+def iter_rolling_status_counts(activity, window_days, first_day_idx = 0, last_day_idx = None):
+    for status_counts in iter_multi_window_status_counts(activity, [window_days], 
+                                                         first_day_idx, last_day_idx):
+        yield status_counts[0]
+
+
+
+### iter_rolling_status_counts for several window sizes in the same pass over
+### the days. The keys entering the windows each day are looked up once for all
+### of them, and each window size keeps its own counts and statuses. Yields the
+### (window sizes, segments, 5) array of status counts for each window end day
+### index from first_day_idx to last_day_idx, updated in place. The slide starts 
+### 2*window_days before first_day_idx for the largest window size, which does
+### not change the counts of the smaller ones
+def iter_multi_window_status_counts(activity, window_day_sizes, first_day_idx = 0, last_day_idx = None):
+    day_ptr = activity['day_ptr']
+    day_keys = activity['day_keys']
+    key_segment = activity['key_segment']
+    key_first_day = activity['key_first_day']
+    n_days = activity['n_days']
+    n_keys = len(key_first_day)
+    n_segments = len(activity['segments'])
+    n_windows = len(window_day_sizes)
+    
+    # Keys grouped by their first day, to find the keys that stop being new
+    first_order = np.argsort(key_first_day, kind = 'stable')
+    first_ptr = np.concatenate([[0], np.cumsum(np.bincount(key_first_day, minlength = n_days))])
+    
+    first_day_idx = max(first_day_idx, 0)
+    if last_day_idx is None:
+        last_day_idx = n_days - 1
+    slide_start_idx = max(first_day_idx - 2*max(window_day_sizes, default = 0), 0)
+    
+    # Days before slide_start_idx never entered the windows, so they cannot
+    # leave them either. Keys can stop being new whatever their first day
+    def keys_on(ptr, keys, d, min_d = slide_start_idx):
+        if min_d <= d < n_days:
+            return keys[ptr[d]:ptr[d + 1]]
+        return keys[:0]
+    
+    this_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    last_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    status = np.zeros((n_windows, n_keys), dtype = np.int64)
+    status_counts = np.zeros((n_windows, n_segments * 5), dtype = np.int64)
+    
+    for d in range(slide_start_idx, last_day_idx + 1):
+        entering = keys_on(day_ptr, day_keys, d)
+        
+        for i, window_days in enumerate(window_day_sizes):
+            moving = keys_on(day_ptr, day_keys, d - window_days)
+            leaving = keys_on(day_ptr, day_keys, d - 2*window_days)
+            aging = keys_on(first_ptr, first_order, d - window_days, min_d = 0)
+            
+            this_ct[i, entering] += 1
+            this_ct[i, moving] -= 1
+            last_ct[i, moving] += 1
+            last_ct[i, leaving] -= 1
+            
+            changed = np.unique(np.concatenate([entering, moving, leaving, aging]))
+            new_status = classify_window_status(this_ct[i, changed], last_ct[i, changed], 
+                                                key_first_day[changed], d - window_days + 1)
+            seg = key_segment[changed] * 5
+            status_counts[i] -= np.bincount(seg + status[i, changed], minlength = n_segments * 5)
+            status_counts[i] += np.bincount(seg + new_status, minlength = n_segments * 5)
+            status[i, changed] = new_status
+        
+        if d >= first_day_idx:
+            yield status_counts.reshape(n_windows, n_segments, 5)
+
+
+
+### Adds the active users, quick ratio, and retention rate columns to a
+### dataframe with one row of new/resurrected/retained/churned user counts per
+### window (and segment). Churned users are negative. As in calc_ga_for_window,
+### a status that no segment has in a window counts as 0 in the active users 
+### and the retention rate, but a status that only some segments have leaves
+### them NaN for the others. The quick ratio treats every missing count as 0, 
+### matching calc_user_qr
+def add_window_ga_ratios(window_ga_df, window_days):
+    counts = {}
+    for c in ['new', 'resurrected', 'retained', 'churned']:
+        if c not in window_ga_df:
+            counts[c] = pd.Series(0, index = window_ga_df.index)
+            continue
+        in_window = window_ga_df[c].notnull().groupby(window_ga_df['window_end_date']).transform('any')
+        counts[c] = window_ga_df[c].where(in_window, 0)
+    
+    window_ga_df['active_users'] = counts['new'] + counts['resurrected'] + counts['retained']
+    window_ga_df['user_quick_ratio'] = calc_user_qr_col(window_ga_df)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        window_ga_df['user_retention_rate'] = counts['retained'] / (counts['retained'] - counts['churned'])
+    window_ga_df['window_days'] = window_days
+    window_ga_df['Growth Threshold'] = 1
+    
+    return window_ga_df
+
+
+
+### Builds the rolling quick ratio dataframe from the status counts produced by
+### calc_rolling_status_counts. A status with no users in a window is NaN, the
+### same as when calc_ga_for_window finds no users with that status
+def create_rolling_ga_df(status_counts, window_end_dates, window_days, segments = None):
+    n_windows, n_segments, _ = status_counts.shape
+    
+    rolling_qr_df = pd.DataFrame({'window_end_date' : np.repeat(pd.to_datetime(window_end_dates), n_segments)})
+    if segments is not None:
+        rolling_qr_df.insert(0, 'segment', np.tile(np.asarray(segments), n_windows))
+        
+    flat_counts = status_counts.reshape(n_windows * n_segments, 5)
+    for c, s in [('churned', CHURNED), ('new', NEW), ('resurrected', RESURRECTED), ('retained', RETAINED)]:
+        sign = -1 if s == CHURNED else 1
+        rolling_qr_df[c] = sign * flat_counts[:, s]
+        rolling_qr_df[c] = rolling_qr_df[c].where(rolling_qr_df[c] != 0)
+    
+    # Segments with no users at all in a window do not get a row, but without
+    # segments every window does, as in calc_ga_for_window
+    if segments is not None:
+        rolling_qr_df = rolling_qr_df.loc[flat_counts[:, 1:].sum(axis = 1) > 0].reset_index(drop = True)
+    
+    return add_window_ga_ratios(rolling_qr_df, window_days)
+
+
+
+### Data shared with the worker processes of run_parallel. Each worker gets it 
+### once when it starts, instead of with every task
+POOL_DATA = {}
+
 
+def init_pool_worker(pool_data):
+    POOL_DATA.update(pool_data)
+
+
+def run_pool_task(task):
+    func, args = task
+    return func(POOL_DATA, *args)
+
+
+
+### Runs func(pool_data, *args) for each tuple of args in tasks and returns the
+### results in the same order as tasks. With n_jobs > 1 (or -1 for one process 
+### per CPU) the tasks are spread across a process pool. Where the platform can
+### fork, the workers inherit pool_data (the DAU dataframe or activity arrays) 
+### from the parent without copying or pickling it. Elsewhere it is pickled 
+### once per worker, and the calling script needs an if __name__ == '__main__' 
+### guard, as for any process pool
+def run_parallel(func, tasks, pool_data, n_jobs = 1):
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs is None or n_jobs <= 1 or len(tasks) <= 1:
+        return [func(pool_data, *args) for args in tasks]
     
-### Calls calc_ga_for_window for each available window of length window_days
-### and compiles the resultant dataframe into a single dataframe for plotting
-### and analysis
-def calc_rolling_qr_window(dau_decorated_df, window_days = 28, use_segment = False):
-    start_dt = min(dau_decorated_df['activity_date']) + timedelta(days = 2*window_days)
-    end_dt = max(dau_decorated_df['activity_date'])
-    date_range = pd.date_range(start = start_dt, end = end_dt, freq = 'D')
+    mp_context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers = min(n_jobs, len(tasks)), 
+                             mp_context = mp_context,
+                             initializer = init_pool_worker, 
+                             initargs = (pool_data,)) as executor:
+        return list(executor.map(run_pool_task, [(func, args) for args in tasks]))
 
-    rolling_qr_df = pd.DataFrame()
-    for d in date_range:
-        d2 = d.date()
-        print(window_days, d2)
-        this_window = calc_ga_for_window(dau_decorated_df, d2, window_days, use_segment)
-        rolling_qr_df = rolling_qr_df.append(this_window)
+
+
+### Splits a range of window end dates into up to n_chunks contiguous pieces
+def split_date_range(date_range, n_chunks):
+    bounds = np.linspace(0, len(date_range), max(n_chunks, 1) + 1).astype(int)
+    return [date_range[a:b] for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+
+### Generator of the rolling growth accounting for a contiguous range of window
+### end dates. Yields a (window_days, dataframe) pair per window end date and 
+### window size in window_day_sizes. A window size only gets the dates at least
+### 2*window_days after the start of the data. The incremental method computes
+### every window size in the same pass over the dates
+def iter_rolling_qr_chunk(pool_data, method, window_day_sizes, date_range):
+    use_segment = pool_data['use_segment']
+    
+    if method == 'incremental':
+        activity = pool_data['activity']
+        day_idxs = date_to_day_number(date_range) - activity['start_day']
+        segments = activity['segments'] if use_segment else None
+        status_counts = iter_multi_window_status_counts(activity, window_day_sizes, 
+                                                        day_idxs[0], day_idxs[-1])
+        for d, day_idx, day_counts in zip(date_range, day_idxs, status_counts):
+            for i, w in enumerate(window_day_sizes):
+                if day_idx >= 2*w:
+                    yield w, create_rolling_ga_df(day_counts[i][np.newaxis], [d], w, segments)
+    else:
+        for d in date_range:
+            d2 = d.date()
+            for w in window_day_sizes:
+                if d < pool_data['start_dt'] + timedelta(days = 2*w):
+                    continue
+                logger.debug('%s-day window ending %s' % (w, d2))
+                this_window = calc_ga_for_window(pool_data['dau_decorated_df'], d2, w, use_segment)
+                this_window['window_end_date'] = pd.to_datetime(this_window['window_end_date'])
+                yield w, this_window
+
+
+
+### Rolling growth accounting for a contiguous range of window end dates, run 
+### by calc_rolling_qr_window in the current process or a pool worker. Returns
+### a (window_days, dataframe) pair per window size with any dates in the range
+@instrumented()
+def calc_rolling_qr_chunk(pool_data, method, window_day_sizes, date_range):
+    if method == 'incremental':
+        activity = pool_data['activity']
+        day_idxs = date_to_day_number(date_range) - activity['start_day']
+        segments = activity['segments'] if pool_data['use_segment'] else None
+        
+        kernels = get_kernels(pool_data.get('backend'))
+        if kernels is not None:
+            status_counts = kernels['rolling_status_counts'](get_kernel_activity(activity, 'day_ptr'),
+                                                             get_kernel_activity(activity, 'day_keys'),
+                                                             get_kernel_activity(activity, 'key_segment'),
+                                                             get_kernel_activity(activity, 'key_first_day'),
+                                                             len(activity['segments']), 
+                                                             np.array(window_day_sizes, dtype = np.int64),
+                                                             day_idxs[0], day_idxs[-1])
+        else:
+            status_counts = np.zeros((len(date_range), len(window_day_sizes), len(activity['segments']), 5), 
+                                     dtype = np.int64)
+            for i, day_counts in enumerate(iter_multi_window_status_counts(activity, window_day_sizes, 
+                                                                           day_idxs[0], day_idxs[-1])):
+                status_counts[i] = day_counts
         
-    rolling_qr_df['window_end_date'] = pd.to_datetime(rolling_qr_df['window_end_date'])
-    return rolling_qr_df
+        rolling_qr_dfs = []
+        for i, w in enumerate(window_day_sizes):
+            in_window = day_idxs >= 2*w
+            if in_window.any():
+                rolling_qr_dfs.append((w, create_rolling_ga_df(status_counts[in_window, i], 
+                                                               date_range[in_window], w, segments)))
+        return rolling_qr_dfs
+    
+    rolling_qr_dfs = {}
+    for w, this_window in iter_rolling_qr_chunk(pool_data, method, window_day_sizes, date_range):
+        rolling_qr_dfs.setdefault(w, []).append(this_window)
+    return [(w, pd.concat(dfs)) for w, dfs in rolling_qr_dfs.items()]
+
+
+
+### Common set up of calc_rolling_qr_window and iter_rolling_qr_window: the data
+### the window calculations run on, the window sizes, and the window end dates,
+### from 2*window_days after the start of the data for the smallest window size
+def create_rolling_qr_tasks(dau_decorated_df, window_days, use_segment, method, activity_matrix):
+    if activity_matrix is not None:
+        start_dt, end_dt = get_activity_date_range(activity_matrix)
+        use_segment = activity_matrix['use_segment']
+    else:
+        start_dt = min(dau_decorated_df['activity_date'])
+        end_dt = max(dau_decorated_df['activity_date'])
+    if method != 'incremental' and dau_decorated_df is None:
+        raise ValueError("The '%s' method runs on dau_decorated_df, only the incremental method can "
+                         "run on an activity matrix alone" % method)
+    window_day_sizes = [window_days] if np.isscalar(window_days) else list(window_days)
+    
+    pool_data = {'use_segment' : use_segment,
+                 'start_dt' : pd.Timestamp(start_dt),
+                 'backend' : BACKEND_SETTINGS['backend']}
+    if method == 'incremental':
+        logger.info('Calculating rolling %s-day growth accounting' % ', '.join(str(w) for w in window_day_sizes))
+        activity = activity_matrix
+        if activity is None:
+            activity = create_daily_activity_arrays(dau_decorated_df, use_segment)
+        pool_data['activity'] = activity
+    else:
+        pool_data['dau_decorated_df'] = dau_decorated_df
+    
+    date_range = pd.date_range(start = start_dt + timedelta(days = 2*min(window_day_sizes)), 
+                               end = end_dt, freq = 'D')
+    return pool_data, window_day_sizes, date_range
 
-################### NEW AS OF 11/5/18
 
+
+### Concatenates the (window_days, dataframe) pairs of the chunks of a rolling
+### calculation in window size and then date order
+def concat_window_chunks(window_day_sizes, chunk_results):
+    window_dfs = {w : [] for w in window_day_sizes}
+    for chunk_dfs in chunk_results:
+        for w, window_df in chunk_dfs:
+            window_dfs[w].append(window_df)
     
+    window_dfs = [df for w in window_dfs for df in window_dfs[w]]
+    if len(window_dfs) == 0:
+        return pd.DataFrame()
+    return pd.concat(window_dfs)
+
+
+
+### Calculates the growth accounting for every available window of length 
+### window_days and compiles it into a single dataframe for plotting and 
+### analysis. The default 'incremental' method slides the windows forward one
+### day at a time; 'window' calls calc_ga_for_window for each window end date
+### and is kept as the reference implementation
+### The incremental method can also run on an activity matrix created by 
+### create_activity_matrix, in which case dau_decorated_df may be None and the
+### segmentation is the one the matrix was built with. The 'window' method 
+### raises a ValueError without dau_decorated_df
+### window_days can be a list of window sizes, which the incremental method 
+### computes together in one pass over the days. The rows are tagged with their
+### window_days and are in window size and then date order. n_jobs spreads the
+### window end dates across processes (see run_parallel)
+@instrumented()
+def calc_rolling_qr_window(dau_decorated_df, window_days = 28, use_segment = False, method = 'incremental',
+                           activity_matrix = None, n_jobs = 1):
+    pool_data, window_day_sizes, date_range = create_rolling_qr_tasks(dau_decorated_df, window_days, 
+                                                                      use_segment, method, activity_matrix)
+    tasks = [(method, window_day_sizes, chunk) for chunk in split_date_range(date_range, n_jobs)]
+    
+    chunk_results = run_parallel(calc_rolling_qr_chunk, tasks, pool_data, n_jobs)
+    return concat_window_chunks(window_day_sizes, chunk_results)
+
+
+
+### Generator version of calc_rolling_qr_window. Yields one dataframe per window
+### end date and window size, in date order, so a long series can be written 
+### out as it is computed without holding all of it in memory
+def iter_rolling_qr_window(dau_decorated_df, window_days = 28, use_segment = False, method = 'incremental',
+                           activity_matrix = None):
+    pool_data, window_day_sizes, date_range = create_rolling_qr_tasks(dau_decorated_df, window_days, 
+                                                                      use_segment, method, activity_matrix)
+    if len(date_range) > 0:
+        for w, this_window in iter_rolling_qr_chunk(pool_data, method, window_day_sizes, date_range):
+            yield this_window
+
+
+
+################### NEW AS OF 11/5/18
 
-def calc_user_daily_usage(dau_decorated_df, last_date, window_days, breakouts, use_segment):
-    window_start_date = last_date - timedelta(days = window_days-1)
-    dau_dec = (dau_decorated_df
-               .loc[(dau_decorated_df['activity_date'] >= window_start_date) & 
-                    (dau_decorated_df['activity_date'] <= last_date)]
-               .copy()
-               )
     
+
+### Number of active days and total inc_amt of each user (and segment) in the 
+### window_days window ending on last_date. If an activity matrix is given, the
+### totals are column-range sums of the matrix and dau_decorated_df is not used
+### dau_decorated_df can also be the path of a store written by save_dau_store
+### The revenue concentration columns (cum_inc_amt, cum_inc_amt_pct_of_total 
+### and revenue_80pct_ratio) need the users sorted by inc_amt. Without 
+### revenue_concentration they are left out, along with the sort
+@instrumented()
+def calc_user_daily_usage(dau_decorated_df, last_date, window_days, breakouts, use_segment,
+                          activity_matrix = None, revenue_concentration = True):
     if use_segment:
         groupby_cols = ['user_id', 'segment']
     else:
         groupby_cols = ['user_id']
+    
+    if activity_matrix is not None:
+        dau_grouped_df = calc_user_daily_usage_from_matrix(activity_matrix, last_date, window_days)
+    else:
+        dau_decorated_df = get_dau_window_df(dau_decorated_df, last_date - timedelta(days = window_days-1), last_date)
+        dates = dau_decorated_df['activity_date']
+        window_start_date = as_column_date(dates, last_date - timedelta(days = window_days-1))
+        dau_dec = (dau_decorated_df
+                   .loc[(dates >= window_start_date) & 
+                        (dates <= as_column_date(dates, last_date))]
+                   )
         
-    dau_grouped_df = (dau_dec
-                      .groupby(groupby_cols)['inc_amt']
-                      .agg(['count', 'sum'])
-                      .reset_index()
-                      .rename(columns = {'count' : 'active_days', 'sum': 'inc_amt' })
-                      )
+        dau_grouped_df = (dau_dec
+                          .groupby(groupby_cols)['inc_amt']
+                          .agg(['count', 'sum'])
+                          .reset_index()
+                          .rename(columns = {'count' : 'active_days', 'sum': 'inc_amt' })
+                          )
     for b in breakouts:
         dau_grouped_df['%sd+ users' % b] = (dau_grouped_df['active_days'] >= b)
+    
+    if not revenue_concentration:
+        return dau_grouped_df
         
     dau_grouped_df_sorted = dau_grouped_df.sort_values('inc_amt', ascending = False)  
-    if use_segment:
-        dau_grouped_df_sorted = dau_grouped_df_sorted.groupby('segment')
-    ############# THIS NEEDS WORK TO HANDLE CUMSUM WITH SEGMENTATION GROUPBY
-
-#    total_active_days = dau_grouped_df_sorted.active_days.sum()
-    total_inc_amt = dau_grouped_df_sorted.inc_amt.sum()
     
-    dau_grouped_df_sorted['cum_inc_amt'] = dau_grouped_df_sorted.inc_amt.cumsum()
+    # With segmentation, the revenue concentration is calculated within each 
+    # segment: the users are ranked by inc_amt and their share of the segment's
+    # total is accumulated separately for each segment
+    if use_segment:
+        segment_groups = dau_grouped_df_sorted.groupby('segment', sort = False)
+        total_inc_amt = segment_groups['inc_amt'].transform('sum')
+        dau_grouped_df_sorted['cum_inc_amt'] = segment_groups['inc_amt'].cumsum()
+    else:
+        total_inc_amt = dau_grouped_df_sorted.inc_amt.sum()
+        dau_grouped_df_sorted['cum_inc_amt'] = dau_grouped_df_sorted.inc_amt.cumsum()
     dau_grouped_df_sorted['cum_inc_amt_pct_of_total'] = dau_grouped_df_sorted['cum_inc_amt'] / total_inc_amt
     
-    revenue_80pct_user_count = len(dau_grouped_df_sorted[dau_grouped_df_sorted.cum_inc_amt_pct_of_total <= .80])
-    total_user_count = len(dau_grouped_df_sorted)
-    
-    revenue_80pct_ratio = revenue_80pct_user_count / total_user_count
-    dau_grouped_df_sorted['revenue_80pct_ratio'] = revenue_80pct_ratio
+    is_80pct_user = dau_grouped_df_sorted.cum_inc_amt_pct_of_total <= .80
+    if use_segment:
+        dau_grouped_df_sorted['revenue_80pct_ratio'] = is_80pct_user.groupby(dau_grouped_df_sorted['segment'])\
+                                                                    .transform('mean')
+    else:
+        dau_grouped_df_sorted['revenue_80pct_ratio'] = is_80pct_user.sum() / len(dau_grouped_df_sorted)
     
     return dau_grouped_df_sorted
+
+
+
+### The active_days and inc_amt per user (and segment) part of 
+### calc_user_daily_usage, computed from an activity matrix
+def calc_user_daily_usage_from_matrix(activity_matrix, last_date, window_days):
+    active_days, inc_amt = calc_window_key_totals(activity_matrix, last_date, window_days)
+    in_window = active_days > 0
+    
+    dau_grouped_df = pd.DataFrame({'user_id' : activity_matrix['key_user_id'][in_window]})
+    groupby_cols = ['user_id']
+    if activity_matrix['use_segment']:
+        segment_codes = activity_matrix['key_segment'][in_window]
+        dau_grouped_df['segment'] = activity_matrix['segments'].take(segment_codes)
+        groupby_cols = groupby_cols + ['segment']
+    dau_grouped_df['active_days'] = active_days[in_window]
+    dau_grouped_df['inc_amt'] = inc_amt[in_window]
+    
+    return dau_grouped_df.sort_values(groupby_cols).reset_index(drop = True)
         
 
 
 
-def calc_dau_xau_ratio_for_window(dau_decorated_df, last_date, window_days, breakouts, use_segment):
-    dau_grouped = calc_user_daily_usage(dau_decorated_df, last_date, window_days, breakouts, use_segment)
+@instrumented()
+def calc_dau_xau_ratio_for_window(dau_decorated_df, last_date, window_days, breakouts, use_segment,
+                                  activity_matrix = None):
+    dau_grouped = calc_user_daily_usage(dau_decorated_df, last_date, window_days, breakouts, use_segment,
+                                        activity_matrix, revenue_concentration = False)
     
     dau_agg = pd.DataFrame()
     
@@ -746,10 +2225,13 @@ def calc_dau_xau_ratio_for_window(dau_decorated_df, last_date, window_days, brea
     dau_agg['window_frequency'] = dau_agg['dau_window_ratio'] * window_days
     for b in breakouts:
         col_name = '%sd+ users' % b
-        dau_agg[col_name] = dau_grouped[col_name].sum()
+        dau_agg[col_name] = grouped_df[col_name].sum()
         ratio_col_name = '%sd+ users / total %sd users' % (b, window_days)
         dau_agg[ratio_col_name] = dau_agg[col_name] / dau_agg['1d+ users']
     dau_agg['window_end_dt'] = last_date
+    # A window without any activity loses the segment index name in the groupby
+    if use_segment:
+        dau_agg = dau_agg.rename_axis('segment')
     dau_agg = dau_agg.reset_index()
     
     return dau_agg
@@ -757,27 +2239,1544 @@ def calc_dau_xau_ratio_for_window(dau_decorated_df, last_date, window_days, brea
 
 
 
-def create_dau_window_df(dau_decorated_df, window_days = 28, breakouts = [2, 4], use_segment = False):
-    start_dt = min(dau_decorated_df['activity_date']) + timedelta(days = window_days)
-    end_dt = max(dau_decorated_df['activity_date'])
-    date_range = pd.date_range(start = start_dt, end = end_dt, freq = 'D')
+### Rolling stickiness engine behind create_dau_window_df. Slides windows of
+### each size in window_day_sizes forward one day at a time over the arrays
+### created by create_daily_activity_arrays (or an activity matrix), keeping 
+### each key's active day count in the window and a histogram of the keys of
+### each segment by active day count. Only the keys active on the day entering
+### or the day leaving a window are updated. Yields, for each window end day 
+### index from first_day_idx to last_day_idx, the (window sizes, segments) 
+### array of total active days and the (window sizes, segments, max window 
+### size + 1) histogram, both updated in place. A window only depends on its 
+### own days, so the slide starts the largest window size before first_day_idx
+def iter_rolling_usage_counts(activity, window_day_sizes, first_day_idx = 0, last_day_idx = None):
+    day_ptr = activity['day_ptr']
+    day_keys = activity['day_keys']
+    key_segment = activity['key_segment']
+    n_days = activity['n_days']
+    n_keys = len(key_segment)
+    n_segments = len(activity['segments'])
+    n_windows = len(window_day_sizes)
+    n_bins = max(window_day_sizes, default = 0) + 1
+    
+    first_day_idx = max(first_day_idx, 0)
+    if last_day_idx is None:
+        last_day_idx = n_days - 1
+    slide_start_idx = max(first_day_idx - max(window_day_sizes, default = 0), 0)
+    
+    def keys_on(d):
+        if slide_start_idx <= d < n_days:
+            return day_keys[day_ptr[d]:day_ptr[d + 1]]
+        return day_keys[:0]
+    
+    window_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    active_days = np.zeros((n_windows, n_segments), dtype = np.int64)
+    usage_hist = np.zeros((n_windows, n_segments * n_bins), dtype = np.int64)
+    
+    for d in range(slide_start_idx, last_day_idx + 1):
+        entering = keys_on(d)
+        entering_seg = key_segment[entering]
+        
+        for i, window_days in enumerate(window_day_sizes):
+            leaving = keys_on(d - window_days)
+            leaving_seg = key_segment[leaving]
+            
+            changed = np.concatenate([entering, leaving])
+            changed_bin = np.concatenate([entering_seg, leaving_seg]) * n_bins
+            usage_hist[i] -= np.bincount(changed_bin + window_ct[i, changed], minlength = n_segments * n_bins)
+            window_ct[i, entering] += 1
+            window_ct[i, leaving] -= 1
+            usage_hist[i] += np.bincount(changed_bin + window_ct[i, changed], minlength = n_segments * n_bins)
+            
+            active_days[i] += np.bincount(entering_seg, minlength = n_segments)
+            active_days[i] -= np.bincount(leaving_seg, minlength = n_segments)
+        
+        if d >= first_day_idx:
+            yield active_days, usage_hist.reshape(n_windows, n_segments, n_bins)
+
+
+
+### Builds the rows of create_dau_window_df for one window size from the 
+### active days and usage histograms of iter_rolling_usage_counts, stacked by
+### window end date. The number of users active at least b days is the sum of
+### the histogram from b up. As with calc_dau_xau_ratio_for_window, segments 
+### without users in a window do not get a row
+def create_rolling_dau_window_df(active_days, usage_hists, window_end_dates, window_days, 
+                                 breakouts, segments = None):
+    n_windows, n_segments = active_days.shape
+    n_bins = usage_hists.shape[2]
+    users_at_least = np.cumsum(usage_hists[:, :, ::-1], axis = 2)[:, :, ::-1]
+    
+    def users_with(min_days):
+        min_days = min(max(min_days, 1), n_bins)
+        if min_days == n_bins:
+            return np.zeros(n_windows * n_segments, dtype = np.int64)
+        return users_at_least[:, :, min_days].ravel()
+    
+    dau_agg = pd.DataFrame()
+    if segments is not None:
+        dau_agg['segment'] = np.tile(np.asarray(segments), n_windows)
+    else:
+        dau_agg['index'] = np.zeros(n_windows, dtype = np.int64)
+    dau_agg['active_days'] = active_days.ravel()
+    dau_agg['1d+ users'] = users_with(1)
+    dau_agg['dau_window_ratio'] = (dau_agg['active_days'] / window_days) / dau_agg['1d+ users']
+    dau_agg['window_frequency'] = dau_agg['dau_window_ratio'] * window_days
+    for b in breakouts:
+        col_name = '%sd+ users' % b
+        dau_agg[col_name] = users_with(b)
+        ratio_col_name = '%sd+ users / total %sd users' % (b, window_days)
+        dau_agg[ratio_col_name] = dau_agg[col_name] / dau_agg['1d+ users']
+    dau_agg['window_end_dt'] = np.repeat(pd.to_datetime(window_end_dates), n_segments)
+    dau_agg['window_days'] = window_days
+    
+    if segments is not None:
+        dau_agg = dau_agg.loc[dau_agg['1d+ users'] > 0].reset_index(drop = True)
+    return dau_agg
 
-    rolling_dau_xau_df = pd.DataFrame()
+
+
+### Generator of the DAU/MAU style ratios for a contiguous range of window end
+### dates. Yields a (window_days, dataframe) pair per window end date and 
+### window size in window_day_sizes that fits in the data. The default 
+### 'incremental' method runs the rolling stickiness engine over every window
+### size at once. With 'window', the rows of the largest window size ending on
+### each date are selected once, and calc_dau_xau_ratio_for_window calculates 
+### the smaller windows from them
+def iter_dau_window_chunk(pool_data, method, window_day_sizes, breakouts, date_range):
+    dau_decorated_df = pool_data['dau_decorated_df']
+    activity_matrix = pool_data['activity_matrix']
+    
+    if method == 'incremental':
+        activity = pool_data['activity']
+        day_idxs = date_to_day_number(date_range) - activity['start_day']
+        segments = activity['segments'] if pool_data['use_segment'] else None
+        usage_counts = iter_rolling_usage_counts(activity, window_day_sizes, day_idxs[0], day_idxs[-1])
+        for d, day_idx, (active_days, usage_hist) in zip(date_range, day_idxs, usage_counts):
+            for i, w in enumerate(window_day_sizes):
+                if day_idx >= w:
+                    yield w, create_rolling_dau_window_df(active_days[i][np.newaxis], usage_hist[i][np.newaxis], 
+                                                          [d], w, breakouts, segments)
+        return
+    
     for d in date_range:
         d2 = d.date()
-        print(window_days, d2)
-        this_window = calc_dau_xau_ratio_for_window(dau_decorated_df, 
-                                                    last_date = d2, 
-                                                    window_days = window_days, 
-                                                    breakouts = breakouts,
-                                                    use_segment = use_segment)
-        rolling_dau_xau_df = rolling_dau_xau_df.append(this_window)
+        day_window_sizes = [w for w in window_day_sizes if d >= pool_data['start_dt'] + timedelta(days = w)]
         
-    rolling_dau_xau_df['window_end_dt'] = pd.to_datetime(rolling_dau_xau_df['window_end_dt'])
-    return rolling_dau_xau_df
-
+        window_df = dau_decorated_df
+        if activity_matrix is None:
+            window_start_date = d2 - timedelta(days = max(day_window_sizes) - 1)
+            window_df = get_dau_window_df(dau_decorated_df, window_start_date, d2)
+            dates = window_df['activity_date']
+            window_df = window_df.loc[(dates >= as_column_date(dates, window_start_date)) & 
+                                      (dates <= as_column_date(dates, d2))]
+        
+        for w in day_window_sizes:
+            logger.debug('%s-day window ending %s' % (w, d2))
+            this_window = calc_dau_xau_ratio_for_window(window_df, 
+                                                        last_date = d2, 
+                                                        window_days = w, 
+                                                        breakouts = breakouts,
+                                                        use_segment = pool_data['use_segment'],
+                                                        activity_matrix = activity_matrix)
+            this_window['window_end_dt'] = pd.to_datetime(this_window['window_end_dt'])
+            this_window['window_days'] = w
+            yield w, this_window
+
+
+
+### DAU/MAU style ratios for a contiguous range of window end dates, run by
+### create_dau_window_df in the current process or a pool worker. Returns a 
+### (window_days, dataframe) pair per window size with any dates in the range
+@instrumented()
+def calc_dau_window_chunk(pool_data, method, window_day_sizes, breakouts, date_range):
+    if method == 'incremental':
+        activity = pool_data['activity']
+        day_idxs = date_to_day_number(date_range) - activity['start_day']
+        segments = activity['segments'] if pool_data['use_segment'] else None
+        
+        kernels = get_kernels(pool_data.get('backend'))
+        if kernels is not None:
+            active_days, usage_hists = kernels['rolling_usage_counts'](get_kernel_activity(activity, 'day_ptr'),
+                                                                       get_kernel_activity(activity, 'day_keys'),
+                                                                       get_kernel_activity(activity, 'key_segment'),
+                                                                       len(activity['segments']), 
+                                                                       np.array(window_day_sizes, dtype = np.int64),
+                                                                       day_idxs[0], day_idxs[-1])
+        else:
+            n_bins = max(window_day_sizes) + 1
+            active_days = np.zeros((len(date_range), len(window_day_sizes), len(activity['segments'])), 
+                                   dtype = np.int64)
+            usage_hists = np.zeros(active_days.shape + (n_bins,), dtype = np.int64)
+            for i, (day_active_days, day_usage_hist) in enumerate(iter_rolling_usage_counts(activity, window_day_sizes, 
+                                                                                            day_idxs[0], day_idxs[-1])):
+                active_days[i] = day_active_days
+                usage_hists[i] = day_usage_hist
+        
+        rolling_dau_xau_dfs = []
+        for i, w in enumerate(window_day_sizes):
+            in_window = day_idxs >= w
+            if in_window.any():
+                rolling_dau_xau_dfs.append((w, create_rolling_dau_window_df(active_days[in_window, i], 
+                                                                            usage_hists[in_window, i], 
+                                                                            date_range[in_window], w, 
+                                                                            breakouts, segments)))
+        return rolling_dau_xau_dfs
+    
+    rolling_dau_xau_dfs = {}
+    for w, this_window in iter_dau_window_chunk(pool_data, method, window_day_sizes, breakouts, date_range):
+        rolling_dau_xau_dfs.setdefault(w, []).append(this_window)
+    return [(w, pd.concat(dfs)) for w, dfs in rolling_dau_xau_dfs.items()]
+
+
+
+### Common set up of create_dau_window_df and iter_dau_window_df: the data the 
+### window calculations run on, the window sizes, and the window end dates, from
+### window_days after the start of the data for the smallest window size
+def create_dau_window_tasks(dau_decorated_df, window_days, use_segment, method, activity_matrix):
+    if activity_matrix is not None:
+        start_dt, end_dt = get_activity_date_range(activity_matrix)
+        use_segment = activity_matrix['use_segment']
+    else:
+        start_dt = min(dau_decorated_df['activity_date'])
+        end_dt = max(dau_decorated_df['activity_date'])
+    window_day_sizes = [window_days] if np.isscalar(window_days) else list(window_days)
+    date_range = pd.date_range(start = start_dt + timedelta(days = min(window_day_sizes)), 
+                               end = end_dt, freq = 'D')
+    
+    pool_data = {'dau_decorated_df' : dau_decorated_df,
+                 'activity_matrix' : activity_matrix,
+                 'use_segment' : use_segment,
+                 'start_dt' : pd.Timestamp(start_dt),
+                 'backend' : BACKEND_SETTINGS['backend']}
+    if method == 'incremental':
+        logger.info('Calculating rolling %s-day DAU ratios' % ', '.join(str(w) for w in window_day_sizes))
+        activity = activity_matrix
+        if activity is None:
+            activity = create_daily_activity_arrays(dau_decorated_df, use_segment)
+        pool_data['activity'] = activity
+    return pool_data, window_day_sizes, date_range
+
+
+
+### Calculates the DAU/MAU style ratios for every available window of length
+### window_days. The default 'incremental' method slides the windows forward 
+### one day at a time, keeping a histogram of users by active days (see 
+### iter_rolling_usage_counts); 'window' calls calc_dau_xau_ratio_for_window 
+### for each window end date and is kept as the reference implementation
+### Either method can run on an activity matrix created by 
+### create_activity_matrix, in which case dau_decorated_df may be None and the
+### segmentation is the one the matrix was built with
+### window_days can be a list of window sizes, all calculated in the same pass 
+### over the dates. The rows are tagged with their window_days and are in 
+### window size and then date order. n_jobs spreads the window end dates across
+### processes (see run_parallel)
+@instrumented()
+def create_dau_window_df(dau_decorated_df, window_days = 28, breakouts = [2, 4], use_segment = False,
+                         activity_matrix = None, n_jobs = 1, method = 'incremental'):
+    pool_data, window_day_sizes, date_range = create_dau_window_tasks(dau_decorated_df, window_days, 
+                                                                      use_segment, method, activity_matrix)
+    tasks = [(method, window_day_sizes, breakouts, chunk) for chunk in split_date_range(date_range, n_jobs)]
+    
+    chunk_results = run_parallel(calc_dau_window_chunk, tasks, pool_data, n_jobs)
+    return concat_window_chunks(window_day_sizes, chunk_results)
+
+
+
+### Generator version of create_dau_window_df. Yields one dataframe per window
+### end date and window size, in date order, so a long series can be written 
+### out as it is computed
+def iter_dau_window_df(dau_decorated_df, window_days = 28, breakouts = [2, 4], use_segment = False,
+                       activity_matrix = None, method = 'incremental'):
+    pool_data, window_day_sizes, date_range = create_dau_window_tasks(dau_decorated_df, window_days, 
+                                                                      use_segment, method, activity_matrix)
+    if len(date_range) > 0:
+        for w, this_window in iter_dau_window_chunk(pool_data, method, window_day_sizes, breakouts, date_range):
+            yield this_window
+
+
+
+### Approximate distinct counts (HyperLogLog)
+### For very large datasets, the active user counts can be estimated from
+### HyperLogLog sketches instead of exact distinct counts. create_hll_sketches 
+### keeps one sketch of the users active each day in each segment, a row of 
+### 2**precision one-byte registers. Sketches merge by taking the register-wise
+### maximum, so the active users of any window or period are estimated from the
+### union of its daily sketches, without going back to the user IDs. The 
+### relative standard error of an estimate is 1.04 / sqrt(2**precision), 0.8% 
+### with the default precision of 14, and the approximate dataframes report it
+### as an absolute std_error column next to each estimate. The sketches take 
+### 2**precision bytes per day and segment with active users, so days and 
+### segments without activity cost nothing
+HLL_STD_ERROR_FACTOR = 1.04
+HLL_POWERS_OF_2 = 2.0 ** -np.arange(65)
+
+
+
+### Register index and rank (position of the first 1 bit, counting from 1) of 
+### the 64-bit hash of each user ID
+def calc_hll_registers(user_ids, precision):
+    hashes = pd.util.hash_pandas_object(pd.Series(user_ids), index = False).values
+    register_idx = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    bit_length = np.zeros(len(rest), dtype = np.int64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        is_longer = rest >= np.uint64(1 << shift)
+        bit_length += shift * is_longer
+        rest = np.where(is_longer, rest >> np.uint64(shift), rest)
+    bit_length += (rest > 0)
+    
+    return register_idx, (64 - precision - bit_length + 1).astype(np.uint8)
+
+
+
+### Estimated number of distinct users of each sketch in an array of sketches, 
+### whose last axis is the registers
+def estimate_hll_count(registers):
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / HLL_POWERS_OF_2[registers].sum(axis = -1)
+    
+    # Linear counting of the empty registers is more accurate for small counts
+    empty_registers = (registers == 0).sum(axis = -1)
+    is_small = (estimate <= 2.5 * m) & (empty_registers > 0)
+    with np.errstate(divide = 'ignore'):
+        small_estimate = m * np.log(m / np.maximum(empty_registers, 1))
+    return np.where(is_small, small_estimate, estimate)
+
+
+
+### Standard error of HyperLogLog estimates made with the given precision
+def calc_hll_std_error(estimate, precision):
+    return np.asarray(estimate) * HLL_STD_ERROR_FACTOR / np.sqrt(2 ** precision)
+
+
+
+### Builds a sketch of the users active on each day in each segment (or in 
+### 'All' without use_segment) of the DAU decorated dataframe, along with the 
+### exact number of user-days ('active_days') and new users ('new_users', 
+### users on their first_dt) of each day and segment, which need no sketch. 
+### Only the days and segments with active users get a sketch: the rows of 
+### 'registers' are ordered by segment and then day, the day index of each row
+### is in 'cell_days', and the rows of segment s start at 'segment_offsets'[s]
+@instrumented(message = 'Creating HyperLogLog sketches')
+def create_hll_sketches(dau_decorated_df, use_segment = False, precision = 14):
+    day = date_to_day_number(dau_decorated_df['activity_date'])
+    start_day = day.min() if len(day) > 0 else 0
+    day = day - start_day
+    n_days = day.max() + 1 if len(day) > 0 else 0
     
+    if use_segment:
+        segment_codes, segments = pd.factorize(dau_decorated_df['segment'], sort = True)
+    else:
+        segment_codes, segments = np.zeros(len(day), dtype = np.int64), pd.Index(['All'])
+    n_segments = len(segments)
+    
+    m = 2 ** precision
+    register_idx, rank = calc_hll_registers(dau_decorated_df['user_id'].values, precision)
+    cells, cell_idx = np.unique(segment_codes * n_days + day, return_inverse = True)
+    registers = np.zeros(len(cells) * m, dtype = np.uint8)
+    np.maximum.at(registers, cell_idx * m + register_idx, rank)
+    
+    day_segment = day * n_segments + segment_codes
+    is_new = (date_to_day_number(dau_decorated_df['first_dt']) - start_day) == day
+    
+    return {'use_segment' : use_segment,
+            'precision' : precision,
+            'start_day' : start_day,
+            'n_days' : n_days,
+            'segments' : segments,
+            'registers' : registers.reshape(len(cells), m),
+            'cell_days' : cells % max(n_days, 1),
+            'segment_offsets' : np.searchsorted(cells // max(n_days, 1), np.arange(n_segments + 1)),
+            'active_days' : np.bincount(day_segment, minlength = n_days * n_segments).reshape(n_days, n_segments),
+            'new_users' : np.bincount(day_segment[is_new], minlength = n_days * n_segments).reshape(n_days, n_segments)
+            }
+
+
+
+### Estimated active users of each segment in the window of window_days days 
+### ending on last_date, from the union of the daily sketches
+def calc_approx_window_active_users(sketches, last_date, window_days):
+    last_day_idx = date_to_day_number([last_date])[0] - sketches['start_day']
+    offsets = sketches['segment_offsets']
+    
+    window_registers = np.zeros((len(offsets) - 1, sketches['registers'].shape[1]), dtype = np.uint8)
+    for s in range(len(offsets) - 1):
+        cell_days = sketches['cell_days'][offsets[s]:offsets[s + 1]]
+        first_row = offsets[s] + np.searchsorted(cell_days, last_day_idx - window_days + 1, side = 'left')
+        last_row = offsets[s] + np.searchsorted(cell_days, last_day_idx, side = 'right')
+        window_registers[s] = sketches['registers'][first_row:last_row].max(axis = 0, initial = 0)
+    return estimate_hll_count(window_registers)
+
+
+
+### Approximate version of create_dau_window_df, from the sketches of 
+### create_hll_sketches (built from dau_decorated_df if not given). The active
+### days are exact and the 1d+ users are estimated from the union of the daily
+### sketches of each window, with their standard error in '1d+ users std_error'.
+### The Nd+ users breakouts need each user's active days, so they are not 
+### available here
+@instrumented()
+def create_approx_dau_window_df(dau_decorated_df, window_days = 28, use_segment = False, 
+                                sketches = None, precision = 14):
+    if sketches is None:
+        sketches = create_hll_sketches(dau_decorated_df, use_segment, precision)
+    use_segment = sketches['use_segment']
+    window_day_sizes = [window_days] if np.isscalar(window_days) else list(window_days)
+    start_dt = pd.to_datetime(sketches['start_day'], unit = 'D')
+    cum_active_days = np.concatenate([np.zeros((1, len(sketches['segments'])), dtype = np.int64), 
+                                      np.cumsum(sketches['active_days'], axis = 0)])
+    
+    rolling_dau_xau_dfs = []
+    for w in window_day_sizes:
+        logger.info('Calculating approximate rolling %s-day DAU ratios' % w)
+        date_range = pd.date_range(start = start_dt + timedelta(days = w), 
+                                   end = start_dt + timedelta(days = int(sketches['n_days']) - 1), freq = 'D')
+        if len(date_range) == 0:
+            continue
+        day_idxs = date_to_day_number(date_range) - sketches['start_day']
+        users = np.array([calc_approx_window_active_users(sketches, d, w) for d in date_range])
+        
+        dau_agg = pd.DataFrame({'segment' : np.tile(np.asarray(sketches['segments']), len(date_range))})
+        dau_agg['active_days'] = (cum_active_days[day_idxs + 1] - cum_active_days[day_idxs + 1 - w]).ravel()
+        dau_agg['1d+ users'] = users.ravel()
+        dau_agg['1d+ users std_error'] = calc_hll_std_error(dau_agg['1d+ users'], sketches['precision'])
+        dau_agg['dau_window_ratio'] = (dau_agg['active_days'] / w) / dau_agg['1d+ users']
+        dau_agg['window_frequency'] = dau_agg['dau_window_ratio'] * w
+        dau_agg['window_end_dt'] = np.repeat(date_range, len(sketches['segments']))
+        dau_agg['window_days'] = w
+        if use_segment:
+            dau_agg = dau_agg.loc[dau_agg['active_days'] > 0]
+        else:
+            dau_agg = dau_agg.drop(columns = 'segment')
+        rolling_dau_xau_dfs.append(dau_agg.reset_index(drop = True))
+    
+    if len(rolling_dau_xau_dfs) == 0:
+        return pd.DataFrame()
+    return pd.concat(rolling_dau_xau_dfs)
+
+
+
+### Approximate version of the user growth accounting dataframe of 
+### create_growth_accounting_dfs, from the sketches of create_hll_sketches 
+### (built from dau_decorated_df if not given). The active users of each period
+### are estimated from the union of its daily sketches, and the retained users
+### from the active users of the period and the one before it and the union of
+### both (|A and B| = |A| + |B| - |A or B|). New users are exact, and 
+### resurrected and churned users are derived from the others: the union less
+### the active users of the period before and the new users, and the active 
+### users less the union. The standard errors of the estimated counts are in 
+### std_error columns, adding up those of the estimates each count is derived
+### from. The result can go through calc_user_ga_ratios like the exact one
+@instrumented(message = 'Calculating approximate user growth accounting')
+def create_approx_user_ga_df(dau_decorated_df, time_period, use_segment = False, 
+                             sketches = None, precision = 14):
+    if sketches is None:
+        sketches = create_hll_sketches(dau_decorated_df, use_segment, precision)
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    frequency = time_fields['frequency']
+    precision = sketches['precision']
+    
+    n_days = sketches['n_days']
+    segments = sketches['segments']
+    ordinals = day_to_period_ordinal(sketches['start_day'] + np.arange(n_days), time_period)
+    period_starts = np.flatnonzero(np.diff(ordinals, prepend = ordinals[0] - 1))
+    periods = ordinals[period_starts]
+    n_periods = len(periods)
+    new = np.add.reduceat(sketches['new_users'], period_starts, axis = 0)
+    
+    # The sketches are ordered by segment and day and the days of a period are
+    # contiguous, so the sketches of each segment and period are a run of rows
+    # and each segment's periods with active users follow one another
+    cell_segments = np.repeat(np.arange(len(segments)), np.diff(sketches['segment_offsets']))
+    cell_periods = np.searchsorted(period_starts, sketches['cell_days'], side = 'right') - 1
+    group_keys = cell_segments * n_periods + cell_periods
+    group_starts = np.flatnonzero(np.diff(group_keys, prepend = -1))
+    group_segments = cell_segments[group_starts]
+    group_periods = cell_periods[group_starts]
+    if len(group_starts) > 0:
+        group_registers = np.maximum.reduceat(sketches['registers'], group_starts, axis = 0)
+    else:
+        group_registers = sketches['registers']
+    group_active = estimate_hll_count(group_registers)
+    
+    # Only periods right after a period with active users in the same segment
+    # have retained users, estimated from the union of the two
+    has_last = np.zeros(len(group_starts), dtype = bool)
+    has_last[1:] = (group_segments[1:] == group_segments[:-1]) & (group_periods[1:] == group_periods[:-1] + 1)
+    last_idx = np.flatnonzero(has_last) - 1
+    union = estimate_hll_count(np.maximum(group_registers[has_last], group_registers[last_idx]))
+    
+    active_std_error = calc_hll_std_error(group_active, precision)
+    last_active_std_error = calc_hll_std_error(group_active[last_idx], precision)
+    union_std_error = calc_hll_std_error(union, precision)
+    
+    cells = (group_periods, group_segments)
+    last_cells = (group_periods[has_last], group_segments[has_last])
+    active = np.zeros((n_periods, len(segments)))
+    active[cells] = group_active
+    last_active = np.zeros_like(active)
+    last_active[last_cells] = group_active[last_idx]
+    retained = np.zeros_like(active)
+    retained[last_cells] = group_active[has_last] + group_active[last_idx] - union
+    retained = np.clip(retained, 0, np.minimum(active, last_active))
+    
+    std_errors = {c : np.zeros_like(active) for c in ['active', 'retained', 'resurrected', 'churned']}
+    std_errors['active'][cells] = active_std_error
+    std_errors['resurrected'][cells] = active_std_error
+    std_errors['retained'][last_cells] = np.sqrt(active_std_error[has_last] ** 2 + 
+                                                 last_active_std_error ** 2 + union_std_error ** 2)
+    std_errors['resurrected'][last_cells] = np.sqrt(union_std_error ** 2 + last_active_std_error ** 2)
+    std_errors['churned'][last_cells] = np.sqrt(active_std_error[has_last] ** 2 + union_std_error ** 2)
+    
+    user_xga = pd.DataFrame({grouping_col : np.repeat(periods, len(segments)),
+                             'segment' : np.tile(np.asarray(segments), n_periods)})
+    user_xga[frequency + ' Active Users'] = active.ravel()
+    user_xga['Retained Users'] = retained.ravel()
+    user_xga['New Users'] = new.ravel()
+    user_xga['Resurrected Users'] = np.maximum(active - retained - new, 0).ravel()
+    user_xga['Churned Users'] = -1 * (last_active - retained).ravel()
+    user_xga[frequency + ' Active Users std_error'] = std_errors['active'].ravel()
+    user_xga['Retained Users std_error'] = std_errors['retained'].ravel()
+    user_xga['Resurrected Users std_error'] = std_errors['resurrected'].ravel()
+    user_xga['Churned Users std_error'] = std_errors['churned'].ravel()
+    
+    user_xga = user_xga[user_xga[frequency + ' Active Users'] > 0].reset_index(drop = True)
+    user_xga[grouping_col] = period_start_time(user_xga[grouping_col], time_period) + timedelta(hours = 7)
+    if not use_segment:
+        user_xga = user_xga.drop(columns = 'segment')
+    
+    return user_xga
+
+
+
+### Compiled kernels (optional numba backend)
+### The per-user state classification of create_growth_accounting_dfs and the
+### day loops of the incremental window engines can run as kernels compiled
+### with numba, one native loop over the sorted (key, day or period, inc_amt)
+### arrays that emits the counts and revenue components directly. The kernels 
+### are plain Python functions, compiled the first time they are needed, and 
+### give the same results as the pandas and numpy code. set_backend chooses 
+### between them: 'auto' (the default) uses numba when it is installed, 
+### 'numba' asks for it, 'pandas' never uses it, and 'python' runs the kernels
+### uncompiled, which is slow and only meant for checking them. Without numba,
+### 'auto' and 'numba' fall back to pandas. Whether numba could be imported is
+### kept in BACKEND_SETTINGS['numba_installed'] once it has been tried
+BACKEND_SETTINGS = {'backend' : 'auto', 'numba_installed' : None}
+BACKENDS = ['auto', 'numba', 'pandas', 'python']
+NUMBA_KERNELS = {}
+
+
+
+def set_backend(backend = 'auto'):
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend %s, expected one of %s' % (backend, BACKENDS))
+    BACKEND_SETTINGS['backend'] = backend
+
+
+
+### Rolling window status counts of several window sizes for every day index 
+### from first_day_idx to last_day_idx, as an array of shape (days, windows, 
+### segments, 5), the same counts iter_multi_window_status_counts yields. Each
+### day, the counts of the keys entering and leaving each window are updated,
+### then the keys whose counts changed or that stopped being new are 
+### classified again with the rules of classify_window_status
+def rolling_status_counts_kernel(day_ptr, day_keys, key_segment, key_first_day, n_segments,
+                                 window_day_sizes, first_day_idx, last_day_idx):
+    n_days = len(day_ptr) - 1
+    n_keys = len(key_first_day)
+    n_windows = len(window_day_sizes)
+    max_window = 0
+    for i in range(n_windows):
+        max_window = max(max_window, window_day_sizes[i])
+    slide_start_idx = max(first_day_idx - 2*max_window, 0)
+    
+    first_order = np.argsort(key_first_day, kind = 'mergesort')
+    first_ptr = np.zeros(n_days + 1, dtype = np.int64)
+    for k in range(n_keys):
+        first_ptr[key_first_day[k] + 1] += 1
+    for d in range(n_days):
+        first_ptr[d + 1] += first_ptr[d]
+    
+    this_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    last_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    status = np.zeros((n_windows, n_keys), dtype = np.int8)
+    status_counts = np.zeros((n_windows, n_segments, 5), dtype = np.int64)
+    results = np.zeros((max(last_day_idx - first_day_idx + 1, 0), n_windows, n_segments, 5), dtype = np.int64)
+    
+    for d in range(slide_start_idx, last_day_idx + 1):
+        for i in range(n_windows):
+            window_days = window_day_sizes[i]
+            curr_start = d - window_days + 1
+            
+            # Count updates of the entering (0), moving (1) and leaving (2) days
+            for j in range(3):
+                day = d - j*window_days
+                if slide_start_idx <= day < n_days:
+                    for p in range(day_ptr[day], day_ptr[day + 1]):
+                        k = day_keys[p]
+                        if j == 0:
+                            this_ct[i, k] += 1
+                        elif j == 1:
+                            this_ct[i, k] -= 1
+                            last_ct[i, k] += 1
+                        else:
+                            last_ct[i, k] -= 1
+            
+            # Classification of the keys of those days, and of the aging keys
+            for j in range(4):
+                day = d - j*window_days if j < 3 else d - window_days
+                min_day = 0 if j == 3 else slide_start_idx
+                if min_day <= day < n_days:
+                    ptr = first_ptr if j == 3 else day_ptr
+                    for p in range(ptr[day], ptr[day + 1]):
+                        k = first_order[p] if j == 3 else day_keys[p]
+                        if this_ct[i, k] > 0 and key_first_day[k] >= curr_start:
+                            new_status = 1
+                        elif this_ct[i, k] > 0 and last_ct[i, k] > 0:
+                            new_status = 2
+                        elif this_ct[i, k] > 0:
+                            new_status = 3
+                        elif last_ct[i, k] > 0:
+                            new_status = 4
+                        else:
+                            new_status = 0
+                        status_counts[i, key_segment[k], status[i, k]] -= 1
+                        status_counts[i, key_segment[k], new_status] += 1
+                        status[i, k] = new_status
+        
+        if d >= first_day_idx:
+            results[d - first_day_idx] = status_counts
+    
+    return results
+
+
+
+### Active days and usage histograms of several window sizes for every day 
+### index from first_day_idx to last_day_idx, as arrays of shape (days, 
+### windows, segments) and (days, windows, segments, max window + 1), the same
+### counts iter_rolling_usage_counts yields
+def rolling_usage_counts_kernel(day_ptr, day_keys, key_segment, n_segments, 
+                                window_day_sizes, first_day_idx, last_day_idx):
+    n_days = len(day_ptr) - 1
+    n_keys = len(key_segment)
+    n_windows = len(window_day_sizes)
+    max_window = 0
+    for i in range(n_windows):
+        max_window = max(max_window, window_day_sizes[i])
+    slide_start_idx = max(first_day_idx - max_window, 0)
+    
+    window_ct = np.zeros((n_windows, n_keys), dtype = np.int32)
+    active_days = np.zeros((n_windows, n_segments), dtype = np.int64)
+    usage_hist = np.zeros((n_windows, n_segments, max_window + 1), dtype = np.int64)
+    n_results = max(last_day_idx - first_day_idx + 1, 0)
+    active_days_results = np.zeros((n_results, n_windows, n_segments), dtype = np.int64)
+    usage_hist_results = np.zeros((n_results, n_windows, n_segments, max_window + 1), dtype = np.int64)
+    
+    for d in range(slide_start_idx, last_day_idx + 1):
+        for i in range(n_windows):
+            for j in range(2):
+                day = d - j*window_day_sizes[i]
+                step = 1 - 2*j
+                if slide_start_idx <= day < n_days:
+                    for p in range(day_ptr[day], day_ptr[day + 1]):
+                        k = day_keys[p]
+                        s = key_segment[k]
+                        usage_hist[i, s, window_ct[i, k]] -= 1
+                        window_ct[i, k] += step
+                        usage_hist[i, s, window_ct[i, k]] += 1
+                        active_days[i, s] += step
+        
+        if d >= first_day_idx:
+            active_days_results[d - first_day_idx] = active_days
+            usage_hist_results[d - first_day_idx] = usage_hist
+    
+    return active_days_results, usage_hist_results
+
+
+
+### Growth accounting counts and revenue components of each period and segment,
+### from the rows of an xau decorated dataframe sorted by key and period, as 
+### arrays of shape (periods, segments, 5) and (periods, segments, 7) in the 
+### order of get_user_ga_cols and get_rev_ga_cols. Period p is period ordinal 
+### min_period + p. Each row is classified the way calc_ga_flags classifies the
+### rows of join_xau_to_last_period, including the churned row of a key in the 
+### period after its row when it has no row there. A missing amount counts as 0
+def period_ga_kernel(key_codes, periods, next_periods, first_periods, inc_amt, segment_codes,
+                     min_period, n_periods, n_segments):
+    user_ga = np.zeros((n_periods, n_segments, 5), dtype = np.int64)
+    rev_ga = np.zeros((n_periods, n_segments, 7))
+    n_rows = len(key_codes)
+    
+    for r in range(n_rows):
+        has_next = (r + 1 < n_rows and key_codes[r + 1] == key_codes[r] 
+                    and next_periods[r] == periods[r + 1])
+        
+        # The row itself, then the churned row in the next period
+        for j in range(2):
+            if j == 0:
+                p = periods[r] - min_period
+                is_active = True
+                is_new = first_periods[r] == periods[r]
+                inc_t = inc_amt[r]
+                if r > 0 and key_codes[r - 1] == key_codes[r] and next_periods[r - 1] == periods[r]:
+                    inc_l = inc_amt[r - 1]
+                else:
+                    inc_l = np.nan
+            else:
+                if has_next:
+                    break
+                p = next_periods[r] - min_period
+                is_active = False
+                is_new = False
+                inc_t = np.nan
+                inc_l = inc_amt[r]
+            
+            is_retained = inc_t > 0 and inc_l > 0
+            is_resurrected = not is_new and not inc_l > 0
+            is_churned = not inc_t > 0
+            
+            s = segment_codes[r]
+            user_ga[p, s, 0] += int(is_active)
+            user_ga[p, s, 1] += int(is_retained)
+            user_ga[p, s, 2] += int(is_new)
+            user_ga[p, s, 3] += int(is_resurrected)
+            user_ga[p, s, 4] -= int(is_churned)
+            
+            # NaN amounts are skipped, as in the sums of sum_ga_flags
+            if is_active and not np.isnan(inc_t):
+                rev_ga[p, s, 0] += inc_t
+            if is_retained:
+                rev_ga[p, s, 1] += min(inc_t, inc_l)
+                if not is_new and inc_t > inc_l:
+                    rev_ga[p, s, 4] += inc_t - inc_l
+                if not is_new and inc_t < inc_l:
+                    rev_ga[p, s, 5] += inc_t - inc_l
+            if is_new and not np.isnan(inc_t):
+                rev_ga[p, s, 2] += inc_t
+            if is_resurrected and not np.isnan(inc_t):
+                rev_ga[p, s, 3] += inc_t
+            if is_churned and not np.isnan(inc_l):
+                rev_ga[p, s, 6] -= inc_l
+    
+    return user_ga, rev_ga
+
+
+
+### An array of the activity arrays of create_daily_activity_arrays (or of an
+### activity matrix, whose index arrays can be int32) as int64, the type the 
+### kernels are compiled for
+def get_kernel_activity(activity, name):
+    return np.asarray(activity[name], dtype = np.int64)
+
+
+
+KERNELS = {'rolling_status_counts' : rolling_status_counts_kernel,
+           'rolling_usage_counts' : rolling_usage_counts_kernel,
+           'period_ga' : period_ga_kernel}
+
+
+
+### The kernels of the backend (the one of set_backend unless given), or None
+### for the pandas backend. numba is imported and the kernels compiled the 
+### first time they are needed. Without numba, None is returned and the
+### import is not tried again
+def get_kernels(backend = None):
+    if backend is None:
+        backend = BACKEND_SETTINGS['backend']
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend %s, expected one of %s' % (backend, BACKENDS))
+    if backend == 'pandas':
+        return None
+    if backend == 'python':
+        return KERNELS
+    
+    if BACKEND_SETTINGS['numba_installed'] is False:
+        if backend == 'numba':
+            logger.warning('numba is not installed, using the pandas backend')
+        return None
+    if not NUMBA_KERNELS:
+        try:
+            import numba
+        except ImportError:
+            BACKEND_SETTINGS['numba_installed'] = False
+            if backend == 'numba':
+                logger.warning('numba is not installed, using the pandas backend')
+            return None
+        BACKEND_SETTINGS['numba_installed'] = True
+        with instrument_stage('compile_kernels', message = 'Compiling numba kernels'):
+            for name, kernel in KERNELS.items():
+                NUMBA_KERNELS[name] = numba.njit(cache = True)(kernel)
+    return NUMBA_KERNELS
+
+
+
+### Growth accounting dataframes of create_growth_accounting_dfs computed with
+### period_ga_kernel: the period ordinals are sorted by key, then the kernel's
+### counts are laid out as the sums of sum_ga_flags, one row per period and 
+### segment with rows
+@instrumented()
+def calc_period_ga_with_kernel(kernels, xau_decorated_df, time_period, use_segment = False,
+                               keep_last_period = True, date_limit = None):
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    frequency = time_fields['frequency']
     
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    key_codes = xau_decorated_df.groupby(key_cols, sort = False).ngroup().values
+    periods = period_to_ordinal(xau_decorated_df[grouping_col]).values.astype(np.int64)
+    next_periods = period_to_ordinal(xau_decorated_df['Next_' + grouping_col]).values.astype(np.int64)
+    first_periods = period_to_ordinal(xau_decorated_df[first_period_col]).values.astype(np.int64)
+    if use_segment:
+        segment_codes, segments = pd.factorize(xau_decorated_df['segment'], sort = True)
+    else:
+        segment_codes, segments = np.zeros(len(key_codes), dtype = np.int64), pd.Index(['All'])
+    order = np.lexsort((periods, key_codes))
+    
+    min_period = periods.min() if len(periods) > 0 else 0
+    n_periods = next_periods.max() - min_period + 1 if len(periods) > 0 else 0
+    user_ga, rev_ga = kernels['period_ga'](key_codes[order], periods[order], next_periods[order],
+                                           first_periods[order], 
+                                           xau_decorated_df['inc_amt'].values.astype(float)[order],
+                                           segment_codes.astype(np.int64)[order], 
+                                           min_period, n_periods, len(segments))
+    
+    xga = pd.DataFrame({grouping_col : np.repeat(np.arange(min_period, min_period + n_periods), len(segments))})
+    key_cols = [grouping_col]
+    if use_segment:
+        xga['segment'] = np.tile(np.asarray(segments), n_periods)
+        key_cols = key_cols + ['segment']
+    for c, values in zip(get_user_ga_cols(frequency), user_ga.reshape(-1, 5).T):
+        xga[c] = values
+    for c, values in zip(get_rev_ga_cols(frequency), rev_ga.reshape(-1, 7).T):
+        xga[c] = values
+    
+    # Every row is active or churned, so the periods and segments without rows
+    # are dropped, leaving the groups that sum_ga_flags has
+    has_rows = (user_ga[:, :, 0] != 0) | (user_ga[:, :, 4] != 0)
+    xga = xga.loc[has_rows.ravel()].reset_index(drop = True)
+    
+    return split_ga_sums(xga, key_cols, time_period, keep_last_period, date_limit)
+
+
+
+### DuckDB backend (out of core)
+### For transaction histories that do not fit in memory, the DAU and DAU 
+### decorated dataframes can be kept as tables of an embedded DuckDB database
+### instead, and the growth accounting, cohort and rolling window metrics 
+### calculated with SQL. DuckDB runs the queries on all cores and spills to 
+### temp_directory when a query needs more than memory_limit, so only the 
+### results, one row per period or window end date (and segment), are brought
+### into pandas, where the same ratio and layout functions as above finish 
+### them. The results are the same dataframes as those of the pandas functions,
+### up to the order in which the revenue is added up. The sources can be CSV
+### or Parquet files, directories of Parquet files such as a DAU store written
+### by save_dau_store, tables of the database, or dataframes. Requires duckdb
+### A typical run:
+###     con = connect_duckdb('ga.duckdb', memory_limit = '8GB', temp_directory = 'duckdb_tmp')
+###     create_dau_duckdb(con, 'transactions/*.parquet', activity_date = 'dt')
+###     create_dau_decorated_duckdb(con)
+###     weekly_ga = consolidate_all_ga_duckdb(con, 'week')
+DUCKDB_DAY_NUMBER = "date_diff('day', DATE '1970-01-01', %s)"
+
+
+
+### Connection to a DuckDB database, in memory unless a file is given, with
+### the memory limit (e.g. '8GB'), number of threads and spilling directory 
+### set when given
+def connect_duckdb(database = ':memory:', memory_limit = None, threads = None, temp_directory = None):
+    import duckdb
+    
+    con = duckdb.connect(database)
+    if memory_limit is not None:
+        con.execute("SET memory_limit = '%s'" % memory_limit)
+    if threads is not None:
+        con.execute('SET threads = %d' % threads)
+    if temp_directory is not None:
+        con.execute("SET temp_directory = '%s'" % temp_directory)
+    return con
+
+
+
+### The SQL for reading a source: a CSV or Parquet file or glob, a directory of
+### Parquet files (read with their hive partitions, such as the months of a 
+### DAU store), a table of the database, or a dataframe, which is registered 
+### with the connection under the name given
+def get_duckdb_source_sql(con, source, name = 'source_df'):
+    if isinstance(source, pd.DataFrame):
+        con.register(name, source)
+        return name
+    
+    path = source.replace("'", "''")
+    if os.path.isdir(source):
+        return "read_parquet('%s', hive_partitioning = true)" % os.path.join(path, '**', '*.parquet')
+    if '.csv' in source.lower():
+        return "read_csv_auto('%s')" % path
+    if '.parquet' in source.lower():
+        return "read_parquet('%s')" % path
+    return source
+
+
+
+def get_duckdb_columns(con, relation_sql):
+    return [c[0] for c in con.execute('SELECT * FROM %s LIMIT 0' % relation_sql).description]
+
+
+
+### Creates the DAU table of create_dau_df from a source of transactions (see
+### get_duckdb_source_sql): the inc_amt of each user, day (and segment) with 
+### positive amounts, with the dates truncated to days. Returns the table name
+@instrumented(message = 'Creating DAU table')
+def create_dau_duckdb(con, 
+                      transactions, 
+                      user_id = 'user_id', 
+                      activity_date = 'activity_date', 
+                      inc_amt = 'inc_amt', 
+                      segment_col = None,
+                      table = 'dau'):
+    
+    select_cols = ['"%s" AS user_id' % user_id,
+                   'CAST(CAST("%s" AS TIMESTAMP) AS DATE) AS activity_date' % activity_date]
+    if segment_col is not None:
+        select_cols = select_cols + ['"%s" AS segment' % segment_col]
+    
+    con.execute("""CREATE OR REPLACE TABLE %s AS
+                   SELECT %s, SUM("%s") AS inc_amt
+                   FROM %s
+                   WHERE "%s" > 0
+                   GROUP BY %s""" % (table, ', '.join(select_cols), inc_amt, 
+                                     get_duckdb_source_sql(con, transactions), inc_amt, 
+                                     ', '.join(str(i + 1) for i in range(len(select_cols)))))
+    return table
+
+
+
+### Creates the DAU decorated table of create_dau_decorated_df from a DAU 
+### table or source, adding each user's first activity date. The first week 
+### and month are calculated from it when needed. Returns the table name
+@instrumented(message = 'Creating DAU Decorated table')
+def create_dau_decorated_duckdb(con, dau = 'dau', table = 'dau_decorated'):
+    dau_sql = get_duckdb_source_sql(con, dau)
+    select_cols = ['user_id', 'CAST(activity_date AS DATE) AS activity_date']
+    if 'segment' in get_duckdb_columns(con, dau_sql):
+        select_cols = select_cols + ['segment']
+    
+    con.execute("""CREATE OR REPLACE TABLE %s AS
+                   SELECT %s, inc_amt, 
+                          MIN(CAST(activity_date AS DATE)) OVER (PARTITION BY user_id) AS first_dt
+                   FROM %s""" % (table, ', '.join(select_cols), dau_sql))
+    return table
+
+
+
+### Reads a DAU or DAU decorated table into the dataframe create_dau_df or 
+### create_dau_decorated_df returns for it, sorted the same way
+@instrumented()
+def read_duckdb_dau_df(con, table = 'dau'):
+    sort_cols = ['user_id', 'activity_date']
+    if 'segment' in get_duckdb_columns(con, table):
+        sort_cols = sort_cols + ['segment']
+    dau_df = con.execute('SELECT * FROM %s ORDER BY %s' % (table, ', '.join(sort_cols))).df()
     
+    dau_df['activity_date'] = pd.to_datetime(dau_df['activity_date']).dt.date
+    if 'first_dt' in dau_df:
+        dau_df['first_dt'] = pd.to_datetime(dau_df['first_dt']).dt.date
+        dau_df['first_week'] = date_to_period_col(dau_df['first_dt'], 'week', False)
+        dau_df['first_month'] = date_to_period_col(dau_df['first_dt'], 'month', False)
+    return dau_df
+
+
+
+### First and last activity date of a DAU decorated table, as day numbers
+def get_duckdb_day_range(con, table):
+    return con.execute('SELECT %s, %s FROM %s' % (DUCKDB_DAY_NUMBER % 'MIN(first_dt)', 
+                                                  DUCKDB_DAY_NUMBER % 'MAX(activity_date)', 
+                                                  table)).fetchone()
+
+
+
+### Registers the period ordinal of every day from the first to the day after
+### the last of a DAU decorated table as the table period_days_<time_period>,
+### so any registered time period can be used in the queries. Returns its name
+def create_duckdb_period_days(con, time_period, table):
+    first_day, last_day = get_duckdb_day_range(con, table)
+    days = np.arange(first_day, last_day + 2)
+    name = 'period_days_' + time_period
+    con.register(name, pd.DataFrame({'day' : days, 'period' : day_to_period_ordinal(days, time_period)}))
+    return name
+
+
+
+### The SQL of the xau decorated rows of create_xau_decorated_df: the inc_amt
+### of each period, user (and segment) with the user's first period, as period
+### ordinals. With date_limit, only the periods starting on or before it
+def get_duckdb_xau_sql(con, time_period, use_segment, table, date_limit = None):
+    period_days = create_duckdb_period_days(con, time_period, table)
+    segment = ', d.segment' if use_segment else ''
     
-    
\ No newline at end of file
+    where = ''
+    if date_limit is not None:
+        periods = np.unique(con.execute('SELECT period FROM %s' % period_days).df()['period'].values)
+        periods = periods[period_start_time(periods, time_period) <= date_limit]
+        where = 'WHERE p.period <= %d' % (periods.max() if len(periods) > 0 else np.iinfo(np.int64).min)
+    
+    return """SELECT p.period, f.period AS first_period, d.user_id%s, SUM(d.inc_amt) AS inc_amt
+              FROM %s d
+              JOIN %s p ON p.day = %s
+              JOIN %s f ON f.day = %s
+              %s
+              GROUP BY p.period, f.period, d.user_id%s""" % (segment, table, 
+                                                            period_days, DUCKDB_DAY_NUMBER % 'd.activity_date',
+                                                            period_days, DUCKDB_DAY_NUMBER % 'd.first_dt',
+                                                            where, segment)
+
+
+
+### The user and revenue growth accounting dataframes of 
+### create_growth_accounting_dfs, from a DAU decorated table. Each user's 
+### periods are matched to the one before with LAG over the periods of the user,
+### a user without a row for the next period gets a churned row there, and the
+### rows are classified and summed by the rules of calc_ga_flags
+@instrumented(message = 'Creating Growth Accounting dataframes with DuckDB')
+def create_growth_accounting_dfs_duckdb(con, 
+                                        time_period, 
+                                        use_segment = False,
+                                        keep_last_period = True, 
+                                        date_limit = None,
+                                        table = 'dau_decorated'):
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    frequency = time_fields['frequency']
+    user_cols = get_user_ga_cols(frequency)
+    rev_cols = get_rev_ga_cols(frequency)
+    segment = ', segment' if use_segment else ''
+    
+    xga = con.execute("""
+        WITH xau AS (%s),
+        lagged AS (
+            SELECT *,
+                   LAG(period) OVER key_periods AS last_period,
+                   LAG(inc_amt) OVER key_periods AS last_inc_amt,
+                   LEAD(period) OVER key_periods AS next_period
+            FROM xau
+            WINDOW key_periods AS (PARTITION BY user_id%s ORDER BY period)),
+        xga_interim AS (
+            SELECT period%s, TRUE AS is_active, first_period = period AS is_new, inc_amt AS inc_t,
+                   CASE WHEN last_period = period - 1 THEN last_inc_amt END AS inc_l
+            FROM lagged
+            UNION ALL
+            SELECT period + 1%s, FALSE, FALSE, NULL, inc_amt
+            FROM lagged
+            WHERE next_period IS NULL OR next_period <> period + 1),
+        xga_flags AS (
+            SELECT *,
+                   COALESCE(inc_t > 0 AND inc_l > 0, FALSE) AS is_retained,
+                   NOT is_new AND NOT COALESCE(inc_l > 0, FALSE) AS is_resurrected,
+                   NOT COALESCE(inc_t > 0, FALSE) AS is_churned
+            FROM xga_interim)
+        SELECT period AS "%s"%s,
+               COUNT(*) FILTER (WHERE is_active) AS "%s",
+               COUNT(*) FILTER (WHERE is_retained) AS "%s",
+               COUNT(*) FILTER (WHERE is_new) AS "%s",
+               COUNT(*) FILTER (WHERE is_resurrected) AS "%s",
+               -COUNT(*) FILTER (WHERE is_churned) AS "%s",
+               COALESCE(SUM(CASE WHEN is_active THEN inc_t ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN is_retained THEN LEAST(inc_t, inc_l) ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN is_new THEN inc_t ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN is_resurrected THEN inc_t ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN NOT is_new AND is_retained AND inc_t > inc_l 
+                                 THEN inc_t - inc_l ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN NOT is_new AND is_retained AND inc_t < inc_l 
+                                 THEN inc_t - inc_l ELSE 0 END), 0) AS "%s",
+               COALESCE(SUM(CASE WHEN is_churned THEN -inc_l ELSE 0 END), 0) AS "%s"
+        FROM xga_flags
+        GROUP BY period%s
+        ORDER BY period%s""" % ((get_duckdb_xau_sql(con, time_period, use_segment, table), 
+                                 segment, segment, segment, grouping_col, segment) 
+                                + tuple(user_cols) + tuple(rev_cols) + (segment, segment))).df()
+    
+    key_cols = [grouping_col, 'segment'] if use_segment else [grouping_col]
+    return split_ga_sums(xga, key_cols, time_period, keep_last_period, date_limit)
+
+
+
+### consolidate_all_ga of a DAU decorated table
+@instrumented()
+def consolidate_all_ga_duckdb(con, 
+                              time_period, 
+                              use_segment = False, 
+                              growth_rate_periods = 12,
+                              keep_last_period = True, 
+                              date_limit = None,
+                              table = 'dau_decorated'):
+    
+    user_ga, rev_ga = create_growth_accounting_dfs_duckdb(con, time_period, use_segment, 
+                                                          keep_last_period, date_limit, table)
+    return consolidate_ga_with_ratios(user_ga, rev_ga, time_period, use_segment, growth_rate_periods)
+
+
+
+### xau_retention_by_cohort_df of a DAU decorated table: the counts of 
+### calc_cohort_period_counts come from SQL and finish_cohort_df lays them out
+@instrumented()
+def xau_retention_by_cohort_duckdb(con, time_period, use_segment = False, recent_periods_back_to_exclude = 1, 
+                                   date_limit = None, layout = 'wide', table = 'dau_decorated'):
+    check_cohort_layout(layout)
+    time_fields = get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    since_col = '%ss Since First' % time_fields['unit']
+    segment = ', segment' if use_segment else ''
+    
+    cohort_counts = con.execute("""
+        WITH xau AS (%s)
+        SELECT first_period AS "%s", period AS "%s", period - first_period AS "%s"%s,
+               SUM(inc_amt) AS inc_amt, COUNT(DISTINCT user_id) AS cust_ct
+        FROM xau
+        GROUP BY first_period, period%s
+        ORDER BY first_period, period%s""" % (get_duckdb_xau_sql(con, time_period, use_segment, table, date_limit),
+                                              first_period_col, grouping_col, since_col, segment, 
+                                              segment, segment)).df()
+    
+    return finish_cohort_df(cohort_counts, time_period, use_segment, recent_periods_back_to_exclude, layout)
+
+
+
+### Creates the temporary table key_days of the distinct days each key (a 
+### user_id, or a user_id and segment pair) is active, with the key's first 
+### day, the key's next active day, and for each min_days in lag_days, the day 
+### min_days - 1 active days before
+def create_duckdb_key_days(con, use_segment, table, lag_days = []):
+    key = 'user_id, segment' if use_segment else 'user_id'
+    lag_cols = ''.join(', LAG(day, %d) OVER key_days AS lag_day_%d' % (b - 1, b) for b in lag_days)
+    
+    con.execute("""CREATE OR REPLACE TEMP TABLE key_days AS
+                   SELECT *, LEAD(day) OVER key_days AS next_day%s
+                   FROM (SELECT DISTINCT %s, %s AS day, %s AS first_day FROM %s)
+                   WINDOW key_days AS (PARTITION BY %s ORDER BY day)""" % (lag_cols, key,
+                                                                          DUCKDB_DAY_NUMBER % 'activity_date',
+                                                                          DUCKDB_DAY_NUMBER % 'first_dt',
+                                                                          table, key))
+
+
+
+### Counts of keys over the days of a rolling window calculation, from 
+### intervals of window end days. Each row of intervals_sql is an interval 
+### start to end (inclusive) of window size w, segment and measure, during 
+### which the row's key is counted. The intervals are added up in SQL as +1 at
+### their start and -1 after their end, and the cumulative sums of those 
+### changes taken in numpy. Returns an array of shape (windows, days from 
+### start_day to end_day, segments, measures)
+def calc_duckdb_interval_counts(con, intervals_sql, window_day_sizes, segments, n_measures, 
+                                start_day, end_day):
+    segment = ', segment' if segments is not None else ''
+    changes = con.execute("""
+        WITH intervals AS (%s)
+        SELECT w%s, measure, start_day AS day, COUNT(*) AS change
+        FROM intervals WHERE start_day <= end_day
+        GROUP BY ALL
+        UNION ALL
+        SELECT w%s, measure, end_day + 1 AS day, -COUNT(*) AS change
+        FROM intervals WHERE start_day <= end_day
+        GROUP BY ALL""" % (intervals_sql, segment, segment)).df()
+    changes = changes.loc[changes['day'] <= end_day]
+    
+    n_segments = len(segments) if segments is not None else 1
+    counts = np.zeros((len(window_day_sizes), end_day - start_day + 1, n_segments, n_measures), dtype = np.int64)
+    segment_codes = pd.Index(segments).get_indexer(changes['segment']) if segments is not None else 0
+    np.add.at(counts, (pd.Index(window_day_sizes).get_indexer(changes['w']), changes['day'].values - start_day, 
+                       segment_codes, changes['measure'].values), changes['change'].values)
+    return np.cumsum(counts, axis = 1)
+
+
+
+### Segments of a DAU decorated table in the sorted order of the incremental
+### engines, or None when use_segment is False
+def get_duckdb_segments(con, use_segment, table):
+    if not use_segment:
+        return None
+    return pd.Index(np.sort(con.execute('SELECT DISTINCT segment FROM %s' % table).df()['segment'].values))
+
+
+
+### calc_rolling_qr_window of a DAU decorated table. A key is counted in these
+### intervals of window end dates d, given its active days a, the next active
+### day n after each, and its first day f:
+###     active in the window (d-w, d]: from a to min(a+w-1, n-1)
+###     active in the last window (d-2w, d-w]: the same, w days later
+###     active in both: from max(a+w, n) to min(a+2w-1, n+w-1)
+###     new: from a to min(a+w-1, n-1, f+w-1)
+### as the key's last active day up to d (or d-w) is a. A key active in the 
+### last window cannot be new, so the new, retained, resurrected and churned 
+### counts of classify_window_status follow from those four counts
+@instrumented()
+def calc_rolling_qr_window_duckdb(con, window_days = 28, use_segment = False, table = 'dau_decorated'):
+    window_day_sizes = [int(window_days)] if np.isscalar(window_days) else [int(w) for w in window_days]
+    logger.info('Calculating rolling %s-day growth accounting with DuckDB' % 
+                ', '.join(str(w) for w in window_day_sizes))
+    
+    create_duckdb_key_days(con, use_segment, table)
+    start_day, end_day = con.execute('SELECT MIN(day), MAX(day) FROM key_days').fetchone()
+    segments = get_duckdb_segments(con, use_segment, table)
+    segment = ', segment' if use_segment else ''
+    
+    intervals_sql = """
+        SELECT w%s, 0 AS measure, day AS start_day, 
+               LEAST(day + w - 1, COALESCE(next_day - 1, day + w - 1)) AS end_day
+        FROM key_days, (SELECT UNNEST(%s) AS w)
+        UNION ALL
+        SELECT w%s, 1, day + w, LEAST(day + 2*w - 1, COALESCE(next_day - 1 + w, day + 2*w - 1))
+        FROM key_days, (SELECT UNNEST(%s) AS w)
+        UNION ALL
+        SELECT w%s, 2, GREATEST(day + w, next_day), LEAST(day + 2*w - 1, next_day + w - 1)
+        FROM key_days, (SELECT UNNEST(%s) AS w)
+        WHERE next_day IS NOT NULL
+        UNION ALL
+        SELECT w%s, 3, day, LEAST(day + w - 1, COALESCE(next_day - 1, day + w - 1), first_day + w - 1)
+        FROM key_days, (SELECT UNNEST(%s) AS w)""" % ((segment, window_day_sizes) * 4)
+    counts = calc_duckdb_interval_counts(con, intervals_sql, window_day_sizes, segments, 4, start_day, end_day)
+    
+    rolling_qr_dfs = []
+    for i, w in enumerate(window_day_sizes):
+        active, last_active, both_active, new = [counts[i, 2*w:, :, m] for m in range(4)]
+        if len(active) == 0:
+            continue
+        status_counts = np.zeros(active.shape + (5,), dtype = np.int64)
+        status_counts[:, :, NEW] = new
+        status_counts[:, :, RETAINED] = both_active
+        status_counts[:, :, RESURRECTED] = active - new - both_active
+        status_counts[:, :, CHURNED] = last_active - both_active
+        window_end_dates = (np.arange(start_day + 2*w, end_day + 1)).astype('datetime64[D]')
+        rolling_qr_dfs.append(create_rolling_ga_df(status_counts, window_end_dates, w, segments))
+    
+    if len(rolling_qr_dfs) == 0:
+        return pd.DataFrame()
+    return pd.concat(rolling_qr_dfs)
+
+
+
+### create_dau_window_df of a DAU decorated table. The active days of a window
+### are counted from each active day a to a+w-1, and a key has at least b 
+### active days in the window (d-w, d] ending on d from its active day a to 
+### min(n-1, l+w-1), where n is its next active day and l its active day b-1 
+### active days before a
+@instrumented()
+def create_dau_window_duckdb(con, window_days = 28, breakouts = [2, 4], use_segment = False, 
+                             table = 'dau_decorated'):
+    window_day_sizes = [int(window_days)] if np.isscalar(window_days) else [int(w) for w in window_days]
+    logger.info('Calculating rolling %s-day DAU ratios with DuckDB' % 
+                ', '.join(str(w) for w in window_day_sizes))
+    
+    min_days = sorted(set([1] + [max(b, 1) for b in breakouts]))
+    create_duckdb_key_days(con, use_segment, table, [b for b in min_days if b > 1])
+    start_day, end_day = con.execute('SELECT MIN(day), MAX(day) FROM key_days').fetchone()
+    segments = get_duckdb_segments(con, use_segment, table)
+    segment = ', segment' if use_segment else ''
+    
+    intervals_sqls = ["""SELECT w%s, 0 AS measure, day AS start_day, day + w - 1 AS end_day
+                         FROM key_days, (SELECT UNNEST(%s) AS w)""" % (segment, window_day_sizes)]
+    for i, b in enumerate(min_days):
+        lag_day = 'day' if b == 1 else 'lag_day_%d' % b
+        intervals_sqls.append("""SELECT w%s, %d, day, LEAST(COALESCE(next_day - 1, %s + w - 1), %s + w - 1)
+                                 FROM key_days, (SELECT UNNEST(%s) AS w)
+                                 WHERE %s IS NOT NULL""" % (segment, i + 1, lag_day, lag_day, 
+                                                            window_day_sizes, lag_day))
+    counts = calc_duckdb_interval_counts(con, '\nUNION ALL\n'.join(intervals_sqls), window_day_sizes, 
+                                         segments, len(min_days) + 1, start_day, end_day)
+    
+    rolling_dau_xau_dfs = []
+    for i, w in enumerate(window_day_sizes):
+        window_counts = counts[i, w:]
+        if len(window_counts) == 0:
+            continue
+        
+        # A usage histogram holding each count of users active at least b days
+        # as the difference to the next b, so its sums from b up are the counts
+        usage_hists = np.zeros(window_counts.shape[:2] + (w + 1,), dtype = np.int64)
+        in_window = [j for j, b in enumerate(min_days) if b <= w]
+        for j, k in zip(in_window, in_window[1:] + [None]):
+            next_counts = window_counts[:, :, k + 1] if k is not None else 0
+            usage_hists[:, :, min_days[j]] = window_counts[:, :, j + 1] - next_counts
+        
+        window_end_dates = (np.arange(start_day + w, end_day + 1)).astype('datetime64[D]')
+        rolling_dau_xau_dfs.append(create_rolling_dau_window_df(window_counts[:, :, 0], usage_hists, 
+                                                                window_end_dates, w, breakouts, segments))
+    
+    if len(rolling_dau_xau_dfs) == 0:
+        return pd.DataFrame()
+    return pd.concat(rolling_dau_xau_dfs)
+
+
+
+### Sharded segmented execution
+### For segmentations with many segments, run_segment_shards splits the DAU 
+### decorated dataframe by segment and runs one of the calculations below on 
+### each segment's rows separately, unsegmented, optionally across n_jobs 
+### processes (see run_parallel). The results are concatenated with a 'segment'
+### column in front. With include_all, the 'All' rollup over every segment is 
+### calculated as one more shard of the same run. It cannot be summed from the
+### segment results, because a user who is active in several segments is 
+### counted once in it
+### Each shard's rolling series starts 2*window_days after that segment's first
+### activity, while the segmented rolling engine starts every segment at the
+### first activity of any segment
+SEGMENT_SHARD_CALCS = {
+    'growth_accounting' : lambda shard_df, time_period, **kwargs: 
+        consolidate_all_ga(create_xau_decorated_df(shard_df, time_period, False), time_period, **kwargs),
+    'cohorts' : lambda shard_df, time_period, **kwargs: 
+        xau_retention_by_cohort_df(create_xau_decorated_df(shard_df, time_period, False), time_period, **kwargs),
+    'rolling_qr' : lambda shard_df, **kwargs: calc_rolling_qr_window(shard_df, **kwargs),
+    'dau_window' : lambda shard_df, **kwargs: create_dau_window_df(shard_df, **kwargs),
+    'user_daily_usage' : lambda shard_df, last_date, window_days, breakouts = []: 
+        calc_user_daily_usage(shard_df, last_date, window_days, breakouts, False),
+}
+
+
+
+### Runs a calculation of SEGMENT_SHARD_CALCS on a batch of segments, run by 
+### run_segment_shards in the current process or a pool worker
+@instrumented()
+def calc_segment_shard_batch(pool_data, calc_name, segments, calc_kwargs):
+    dau_decorated_df = pool_data['dau_decorated_df']
+    shard_rows = pool_data['shard_rows']
+    
+    shard_dfs = []
+    for segment in segments:
+        if segment is None:
+            shard_df = dau_decorated_df
+            segment = 'All'
+        else:
+            shard_df = dau_decorated_df.take(shard_rows[segment])
+        shard_result = SEGMENT_SHARD_CALCS[calc_name](shard_df, **calc_kwargs)
+        if 'segment' in shard_result:
+            shard_result = shard_result.drop(columns = 'segment')
+        shard_result.insert(0, 'segment', segment)
+        shard_dfs.append(shard_result)
+    
+    return pd.concat(shard_dfs)
+
+
+
+### calc_name is a key of SEGMENT_SHARD_CALCS and calc_kwargs are the arguments
+### of the function it runs, other than the dataframe and use_segment, e.g.
+### run_segment_shards(dau_decorated, 'growth_accounting', {'time_period' : 'week'})
+@instrumented()
+def run_segment_shards(dau_decorated_df, calc_name, calc_kwargs = {}, include_all = False, n_jobs = 1):
+    logger.info('Calculating ' + calc_name + ' by segment shard')
+    shard_rows = dau_decorated_df.groupby('segment', sort = True).indices
+    segments = list(shard_rows.keys())
+    if include_all:
+        segments = segments + [None]
+    
+    # A few batches per process keep the processes busy without sending each
+    # of thousands of small segments as a separate task
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_batches = max(min(4 * max(n_jobs, 1), len(segments)), 1)
+    tasks = [(calc_name, list(batch), calc_kwargs) for batch in np.array_split(np.array(segments, dtype = object), n_batches)
+             if len(batch) > 0]
+    
+    pool_data = {'dau_decorated_df' : dau_decorated_df, 'shard_rows' : shard_rows}
+    return pd.concat(run_parallel(calc_segment_shard_batch, tasks, pool_data, n_jobs), ignore_index = True)
+
+
+
+### Incremental daily updates
+### create_growth_accounting_state computes the growth accounting of the full
+### history once and saves it under path: the DAU decorated store (see 
+### save_dau_store), first_dt, the user and revenue growth accounting and the 
+### cohort counts of each time period, and the rolling growth accounting of each
+### window size. A nightly job then calls update_growth_accounting_state with 
+### only the new day's transactions, which reads back just the days of the store
+### those transactions affect, so its run time depends on one day of data rather
+### than on the full history. The dataframes consolidate_all_ga and 
+### xau_retention_by_cohort_df would return are derived from a state by 
+### get_state_all_ga and get_state_cohort_df
+### The state is built from a DAU decorated dataframe in the default, non-compact
+### format, and needs pyarrow for its Parquet files
+GA_STATE_FILE = 'state.json'
+GA_STATE_STORE = 'dau_store'
+
+@instrumented()
+def create_growth_accounting_state(dau_decorated_df, path, use_segment = False, window_days = [28],
+                                   time_periods = ['week', 'month']):
+    logger.info('Creating growth accounting state in ' + path)
+    window_day_sizes = [window_days] if np.isscalar(window_days) else list(window_days)
+    state = {'use_segment' : use_segment,
+             'window_days' : [int(w) for w in window_day_sizes],
+             'time_periods' : list(time_periods),
+             'last_date' : max(dau_decorated_df['activity_date']),
+             'first_dt' : create_first_dt_df(dau_decorated_df)}
+    
+    for time_period in time_periods:
+        xau_decorated = create_xau_decorated_df(dau_decorated_df, time_period, use_segment)
+        state[time_period + '_cohort_counts'] = calc_cohort_period_counts(xau_decorated, time_period, use_segment)
+        state[time_period + '_user_ga'], state[time_period + '_rev_ga'] = \
+            create_growth_accounting_dfs(xau_decorated, time_period, use_segment)
+    state['rolling_qr'] = calc_rolling_qr_window(dau_decorated_df, window_day_sizes, use_segment)
+    
+    save_dau_store(dau_decorated_df, os.path.join(path, GA_STATE_STORE))
+    save_growth_accounting_state(state, path)
+    return state
+
+
+
+### Names of the dataframes kept in a growth accounting state
+def get_state_df_names(state):
+    df_names = ['first_dt', 'rolling_qr']
+    for time_period in state['time_periods']:
+        df_names = df_names + [time_period + '_user_ga', time_period + '_rev_ga', 
+                               time_period + '_cohort_counts']
+    return df_names
+
+
+
+def save_growth_accounting_state(state, path):
+    os.makedirs(path, exist_ok = True)
+    for df_name in get_state_df_names(state):
+        state[df_name].to_parquet(os.path.join(path, df_name + '.parquet'))
+    
+    config = {'use_segment' : state['use_segment'],
+              'window_days' : state['window_days'],
+              'time_periods' : state['time_periods'],
+              'last_date' : str(state['last_date'])}
+    with open(os.path.join(path, GA_STATE_FILE), 'w') as f:
+        json.dump(config, f)
+
+
+
+def load_growth_accounting_state(path):
+    with open(os.path.join(path, GA_STATE_FILE)) as f:
+        state = json.load(f)
+    state['last_date'] = datetime.strptime(state['last_date'], '%Y-%m-%d').date()
+    for df_name in get_state_df_names(state):
+        state[df_name] = pd.read_parquet(os.path.join(path, df_name + '.parquet'))
+    return state
+
+
+
+### Replaces the rows of a state dataframe whose key_col value is in keys with
+### the rows of new_df that have those values
+def replace_state_rows(state_df, new_df, key_col, keys, sort_cols):
+    updated_df = pd.concat([state_df.loc[~state_df[key_col].isin(keys)], 
+                            new_df.loc[new_df[key_col].isin(keys)]])
+    return updated_df.sort_values(sort_cols, kind = 'mergesort').reset_index(drop = True)
+
+
+
+### Adds a batch of transactions, normally one new day, to the growth accounting
+### state saved under path and saves the updated state. It takes the earlier of
+### each user's first_dt and their first new transaction, sums the new activity
+### into the DAU store, recalculates the growth accounting and cohort rows of 
+### every period from the first one the transactions fall in through the last
+### one of the state or the transactions, and recalculates the rolling rows of
+### every window end date from the first new transaction or the day after the
+### last update, whichever is earlier, so days without activity also get rows.
+### The dataframes derived from the updated state are the same as those 
+### recalculated from the full history, except for the index_x and index_y 
+### columns of get_state_all_ga, which are row positions. Each batch of 
+### transactions must only be added once, as it is summed into the DAU store
+@instrumented()
+def update_growth_accounting_state(path, transactions,
+                                   user_id = 'user_id', 
+                                   activity_date = 'activity_date', 
+                                   inc_amt = 'inc_amt', 
+                                   segment_col = None):
+    state = load_growth_accounting_state(path)
+    use_segment = state['use_segment']
+    store_path = os.path.join(path, GA_STATE_STORE)
+    
+    dau = create_dau_df(transactions, user_id, activity_date, inc_amt, segment_col)
+    if len(dau) == 0:
+        return state
+    first_new_date = min(dau['activity_date'])
+    last_new_date = max(dau['activity_date'])
+    last_date = max(last_new_date, state['last_date'])
+    logger.info('Updating growth accounting state with activity from %s to %s' % (first_new_date, last_new_date))
+    
+    # A user's earlier late transactions move their first_dt back. All their
+    # rows are after the new first_dt, so in the months rewritten below
+    first_dts = state['first_dt'][['user_id', 'first_dt']].rename(columns = {'first_dt' : 'activity_date'})
+    state['first_dt'] = create_first_dt_df(pd.concat([first_dts, dau[['user_id', 'activity_date']]], 
+                                                     ignore_index = True))
+    
+    stored_months = load_dau_store(store_path, first_new_date.replace(day = 1))
+    dau_cols = [c for c in ['user_id', 'activity_date', 'segment'] if c in dau]
+    updated_months = (pd.concat([stored_months.reindex(columns = dau_cols + ['inc_amt']), dau], ignore_index = True)
+                      .groupby(dau_cols, as_index = False)['inc_amt'].sum())
+    save_dau_store(create_dau_decorated_df(updated_months, use_segment, state['first_dt']), store_path)
+    
+    # The growth accounting of a period also needs the period before it, and a
+    # rolling window also needs the window before it
+    first_window_end_date = min(first_new_date, state['last_date'] + timedelta(days = 1))
+    slice_start_dates = [first_window_end_date - timedelta(days = 2*max(state['window_days']) - 1)]
+    for time_period in state['time_periods']:
+        first_new_period = date_to_period_ordinal([first_new_date], time_period)[0]
+        slice_start_dates.append(period_start_time([first_new_period - 1], time_period)[0].date())
+    dau_slice = load_dau_store(store_path, min(slice_start_dates))
+    
+    segment_cols = ['segment'] if use_segment else []
+    for time_period in state['time_periods']:
+        time_fields = get_time_period_dict(time_period)
+        grouping_col = time_fields['grouping_col']
+        first_period_col = time_fields['first_period_col']
+        
+        # New activity in a period changes the growth accounting of the period
+        # after it too, up to the last period with any activity
+        first_period, last_period = date_to_period_ordinal([first_new_date, last_date], time_period)
+        new_periods = pd.Series(ordinal_to_period(np.arange(first_period, last_period + 1), time_period))
+        new_period_times = period_start_time(new_periods, time_period) + timedelta(hours = 7)
+        
+        xau_decorated = create_xau_decorated_df(dau_slice, time_period, use_segment)
+        cohort_counts = calc_cohort_period_counts(xau_decorated.loc[xau_decorated[grouping_col].isin(new_periods)],
+                                                  time_period, use_segment)
+        state[time_period + '_cohort_counts'] = replace_state_rows(state[time_period + '_cohort_counts'], 
+                                                                   cohort_counts, grouping_col, new_periods,
+                                                                   [first_period_col, grouping_col] + segment_cols)
+        
+        user_ga, rev_ga = create_growth_accounting_dfs(xau_decorated, time_period, use_segment)
+        state[time_period + '_user_ga'] = replace_state_rows(state[time_period + '_user_ga'], user_ga, 
+                                                             grouping_col, new_period_times, 
+                                                             [grouping_col] + segment_cols)
+        state[time_period + '_rev_ga'] = replace_state_rows(state[time_period + '_rev_ga'], rev_ga, 
+                                                            grouping_col, new_period_times, 
+                                                            [grouping_col] + segment_cols)
+    
+    # As in calc_rolling_qr_window, a window size starts 2*window_days after the
+    # first activity
+    first_activity_date = min(state['first_dt']['first_dt'])
+    window_end_dates = pd.date_range(start = first_window_end_date, end = last_date, freq = 'D')
+    new_windows = [calc_ga_for_window(dau_slice, d.date(), w, use_segment)
+                   for w in state['window_days'] for d in window_end_dates
+                   if d.date() >= first_activity_date + timedelta(days = 2*w)]
+    if len(new_windows) > 0:
+        new_windows = pd.concat(new_windows)
+        new_windows['window_end_date'] = pd.to_datetime(new_windows['window_end_date'])
+        state['rolling_qr'] = replace_state_rows(state['rolling_qr'], 
+                                                 new_windows.reindex(columns = state['rolling_qr'].columns),
+                                                 'window_end_date', window_end_dates, 
+                                                 ['window_days', 'window_end_date'])
+    
+    state['last_date'] = last_date
+    save_growth_accounting_state(state, path)
+    return state
+
+
+
+### The dataframe consolidate_all_ga returns for the full history, from a growth
+### accounting state
+def get_state_all_ga(state, time_period, growth_rate_periods = 12):
+    return consolidate_ga_with_ratios(state[time_period + '_user_ga'], state[time_period + '_rev_ga'], 
+                                      time_period, state['use_segment'], growth_rate_periods)
+
+
+
+### The dataframe xau_retention_by_cohort_df returns for the full history, from
+### a growth accounting state
+def get_state_cohort_df(state, time_period, recent_periods_back_to_exclude = 1, layout = 'wide'):
+    return finish_cohort_df(state[time_period + '_cohort_counts'], time_period, 
+                            state['use_segment'], recent_periods_back_to_exclude, layout)
@@ -8,6 +8,7 @@ import growth_accounting as ga
 from datetime import datetime
 
 pd.set_option('display.max_columns', 500)
+ga.set_log_level('INFO')
 
 company_name = 'SampleCo'
 folder = 'C:\\Users\\dksmi\\Dropbox (TheVentureCity)\\David\\' + company_name + '\\'  # Change this to match your environment
@@ -23,7 +24,9 @@ dau = ga.create_dau_df(t,
                        inc_amt = 'inc_amt')
 dau.head()
 
-dau_decorated = ga.create_dau_decorated_df(dau, use_segment = False)
+### date_index sorts dau_decorated by activity_date and indexes its days, so each
+### window of calc_ga_for_window is a slice instead of a scan of every row
+dau_decorated = ga.create_dau_decorated_df(dau, use_segment = False, date_index = True)
 dau_decorated.head()
 
 single_window_df = ga.calc_ga_for_window(dau_decorated, datetime(2018, 6, 30).date(), 
@@ -31,11 +34,13 @@ single_window_df = ga.calc_ga_for_window(dau_decorated, datetime(2018, 6, 30).da
                                use_segment = False)
 single_window_df.head()
 
+### All the window sizes are computed in one pass over the days, tagged by 
+### window_days. n_jobs spreads the window end dates across processes. Process 
+### pools need the if __name__ == '__main__' guard on platforms that cannot fork
 window_day_sizes = [7, 28, 84]
-rolling_df_no_segment = pd.DataFrame()
-for w in window_day_sizes:
-    this_rolling_df = ga.calc_rolling_qr_window(dau_decorated, window_days = w, use_segment = False)
-    rolling_df_no_segment = rolling_df_no_segment.append(this_rolling_df)
-rolling_df_no_segment.to_csv(folder + 'rolling_qr_multiwindow.csv', index = False)
-rolling_df_no_segment.head()
+if __name__ == '__main__':
+    rolling_df_no_segment = ga.calc_rolling_qr_window(dau_decorated, window_days = window_day_sizes, 
+                                                      use_segment = False, n_jobs = 3)
+    rolling_df_no_segment.to_csv(folder + 'rolling_qr_multiwindow.csv', index = False)
+    rolling_df_no_segment.head()
 
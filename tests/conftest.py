@@ -0,0 +1,39 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import growth_accounting as ga
+from benchmark_growth_accounting import make_transactions
+
+
+@pytest.fixture(scope = 'session')
+def transactions():
+    return make_transactions(300, days = 200, seed = 1)
+
+
+@pytest.fixture(scope = 'session')
+def segmented_transactions():
+    return make_transactions(300, days = 200, seed = 2, n_segments = 3)
+
+
+### The segmented transactions with every fourth user moved to the next segment
+### from mid-April, so some users change segments on top of the gaps and 
+### resurrections of the generated activity
+@pytest.fixture(scope = 'session')
+def segment_change_transactions(segmented_transactions):
+    transactions = segmented_transactions.copy()
+    moved = (transactions['user_id'] % 4 == 0) & (transactions['dt'] >= datetime(2018, 4, 15))
+    segment_nums = transactions.loc[moved, 'segment'].str[-1].astype(int)
+    transactions.loc[moved, 'segment'] = 'segment_' + ((segment_nums + 1) % 3).astype(str)
+    return transactions
+
+
+@pytest.fixture(scope = 'session')
+def dau_decorated(transactions):
+    dau = ga.create_dau_df(transactions.copy(), activity_date = 'dt')
+    return ga.create_dau_decorated_df(dau, False)
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+@pytest.fixture(scope = 'module')
+def segmented_dau_decorated(segmented_transactions):
+    dau = ga.create_dau_df(segmented_transactions.copy(), activity_date = 'dt', segment_col = 'segment')
+    return ga.create_dau_decorated_df(dau, True)
+
+
+def test_sketches_only_cover_active_days(segmented_dau_decorated):
+    sketches = ga.create_hll_sketches(segmented_dau_decorated, True, precision = 10)
+    n_cells = len(segmented_dau_decorated[['activity_date', 'segment']].drop_duplicates())
+    assert sketches['registers'].shape == (n_cells, 2 ** 10)
+    assert sketches['segment_offsets'][-1] == n_cells
+    assert (sketches['active_days'] > 0).sum() == n_cells
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+def test_approx_user_ga_is_close(segmented_dau_decorated, time_period):
+    xau_decorated = ga.create_period_decorated_dfs(segmented_dau_decorated, True, [time_period])[time_period]
+    exact = ga.create_growth_accounting_dfs(xau_decorated, time_period, True)[0]
+    approx = ga.create_approx_user_ga_df(segmented_dau_decorated, time_period, True)
+    
+    key_cols = [ga.TIME_PERIODS[time_period]['grouping_col'], 'segment']
+    merged = exact.merge(approx, on = key_cols, suffixes = ('', ' approx'))
+    assert len(merged) == len(approx)
+    for c in [ga.TIME_PERIODS[time_period]['frequency'] + ' Active Users', 'Retained Users']:
+        error = (merged[c + ' approx'] - merged[c]).abs()
+        assert (error <= 4 * merged[c + ' std_error'] + 2).all()
+    pd.testing.assert_series_equal(merged['New Users approx'], merged['New Users'], check_names = False)
+
+
+def test_approx_std_errors(segmented_dau_decorated):
+    approx = ga.create_approx_user_ga_df(segmented_dau_decorated, 'month', True, precision = 10)
+    active_std_error = approx['Monthly Active Users std_error']
+    for c in ['Retained Users', 'Resurrected Users', 'Churned Users']:
+        assert (approx[c + ' std_error'] >= 0).all()
+    
+    # The first month of each segment has no month before it, so its retained
+    # and churned users are exact and its resurrected users only have the 
+    # error of its active users
+    is_first = ~approx.duplicated('segment')
+    assert (approx.loc[is_first, ['Retained Users std_error', 'Churned Users std_error']] == 0).all().all()
+    assert (approx.loc[is_first, 'Resurrected Users std_error'] == active_std_error[is_first]).all()
+    assert (approx.loc[~is_first, 'Retained Users std_error'] > active_std_error[~is_first]).all()
+    assert (approx.loc[~is_first, 'Churned Users std_error'] > active_std_error[~is_first]).all()
@@ -0,0 +1,79 @@
+import sys
+
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+def test_set_backend_rejects_unknown_backend(monkeypatch):
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'backend', 'pandas')
+    with pytest.raises(ValueError):
+        ga.set_backend('numpy')
+    assert ga.BACKEND_SETTINGS['backend'] == 'pandas'
+
+
+def test_auto_without_numba_keeps_backend(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'numba', None)
+    monkeypatch.setattr(ga, 'NUMBA_KERNELS', {})
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'backend', 'auto')
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'numba_installed', None)
+    assert ga.get_kernels() is None
+    assert ga.BACKEND_SETTINGS['backend'] == 'auto'
+    assert ga.BACKEND_SETTINGS['numba_installed'] is False
+    assert ga.get_kernels('python') is ga.KERNELS
+    assert ga.get_kernels('numba') is None
+
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ['python', pytest.param('numba', marks = pytest.mark.skipif(numba is None, reason = 'numba is not installed'))]
+
+BACKEND_FUNCTIONS = {
+    'create_growth_accounting_dfs_week' : lambda d, s: ga.create_growth_accounting_dfs(d['period']['week'], 'week', s),
+    'create_growth_accounting_dfs_month' : lambda d, s: ga.create_growth_accounting_dfs(d['period']['month'], 'month', s),
+    'consolidate_all_ga_week' : lambda d, s: ga.consolidate_all_ga(d['period']['week'], 'week', s),
+    'consolidate_all_ga_month' : lambda d, s: ga.consolidate_all_ga(d['period']['month'], 'month', s),
+    'calc_rolling_qr_window' : lambda d, s: ga.calc_rolling_qr_window(d['dau_decorated'], 28, s),
+    'create_dau_window_df' : lambda d, s: ga.create_dau_window_df(d['dau_decorated'], 28, [2, 4], s),
+}
+
+
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['all', 'segments'])
+def backend_data(request, transactions, segmented_transactions):
+    use_segment = request.param
+    source = segmented_transactions if use_segment else transactions
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = 'segment' if use_segment else None)
+    return use_segment, {'dau_decorated' : ga.create_dau_decorated_df(dau, use_segment),
+                         'period' : ga.create_period_decorated_dfs(dau, use_segment)}
+
+
+def assert_same_ga(expected, result):
+    expected = expected.reset_index(drop = True)
+    result = result.reset_index(drop = True)
+    assert list(result.columns) == list(expected.columns)
+    revenue_cols = [c for c in expected.columns if 'Revenue' in c]
+    count_cols = [c for c in expected.columns if c not in revenue_cols]
+    pd.testing.assert_frame_equal(result[count_cols], expected[count_cols], check_exact = True)
+    pd.testing.assert_frame_equal(result[revenue_cols], expected[revenue_cols], rtol = 1e-9)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name', list(BACKEND_FUNCTIONS))
+def test_backend_matches_pandas(monkeypatch, backend_data, name, backend):
+    use_segment, data = backend_data
+    func = BACKEND_FUNCTIONS[name]
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'backend', 'pandas')
+    expected = func(data, use_segment)
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'backend', backend)
+    result = func(data, use_segment)
+    
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    result = result if isinstance(result, tuple) else (result,)
+    assert len(result) == len(expected)
+    for expected_df, result_df in zip(expected, result):
+        assert len(result_df) > 0
+        assert_same_ga(expected_df, result_df)
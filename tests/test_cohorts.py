@@ -0,0 +1,25 @@
+import pytest
+
+import growth_accounting as ga
+
+
+@pytest.fixture(scope = 'module')
+def cohort_counts(transactions):
+    dau = ga.create_dau_df(transactions.copy(), activity_date = 'dt')
+    mau_decorated = ga.create_period_decorated_dfs(dau, False, ['month'])['month']
+    return ga.calc_cohort_period_counts(mau_decorated, 'month', False)
+
+
+def test_layouts(cohort_counts):
+    wide = ga.finish_cohort_df(cohort_counts, 'month', layout = 'wide')
+    long = ga.finish_cohort_df(cohort_counts, 'month', layout = 'long')
+    triangle = ga.finish_cohort_df(cohort_counts, 'month', layout = 'triangle')
+    assert len(wide) == len(long)
+    assert set(long.columns) < set(wide.columns)
+    assert len(triangle) == long['first_month'].nunique()
+
+
+@pytest.mark.parametrize('layout', ['matrix', 'Wide', None])
+def test_unknown_layout_raises(cohort_counts, layout):
+    with pytest.raises(ValueError, match = 'Unknown cohort layout'):
+        ga.finish_cohort_df(cohort_counts, 'month', layout = layout)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+@pytest.fixture(scope = 'module')
+def mau_decorated(transactions):
+    dau = ga.create_dau_df(transactions.copy(), activity_date = 'dt')
+    return ga.create_period_decorated_dfs(dau, False, ['month'])['month']
+
+
+@pytest.fixture(scope = 'module')
+def user_segments(transactions):
+    user_ids = np.sort(transactions['user_id'].unique())
+    return pd.DataFrame({'user_id' : user_ids,
+                         'plan' : np.where(user_ids % 3 == 0, 'Pro', 'Free'),
+                         'country' : np.where(user_ids % 2 == 0, 'US', 'FR')})
+
+
+def test_cube_all_matches_growth_accounting(mau_decorated, user_segments):
+    user_cube, rev_cube = ga.create_growth_accounting_cube(mau_decorated, 'month', user_segments)
+    user_ga = ga.create_growth_accounting_dfs(mau_decorated, 'month')[0]
+    all_users = user_cube[user_cube['segment'] == 'All'].reset_index(drop = True)
+    pd.testing.assert_frame_equal(all_users[user_ga.columns], user_ga.reset_index(drop = True))
+    
+    plan_users = user_cube[user_cube['plan'] != 'All'].groupby('Month_Year')['Monthly Active Users'].sum()
+    np.testing.assert_array_equal(plan_users.values, all_users['Monthly Active Users'].values)
+
+
+@pytest.mark.parametrize('bad_segments, message', [
+    (lambda s: s.rename(columns = {'plan' : 'segment'}), "'segment' column"),
+    (lambda s: pd.concat([s, s.iloc[:3].assign(plan = 'Enterprise')]), 'one row per user_id'),
+])
+def test_cube_rejects_bad_user_segments(mau_decorated, user_segments, bad_segments, message):
+    with pytest.raises(ValueError, match = message):
+        ga.create_growth_accounting_cube(mau_decorated, 'month', bad_segments(user_segments))
@@ -0,0 +1,39 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+import growth_accounting as ga
+
+
+WINDOW_END_DATES = [date(2018, 2, 15), date(2018, 4, 10), date(2018, 6, 30)]
+
+
+def scan_window(dau_df, start_date, end_date):
+    return dau_df[(dau_df['activity_date'] >= start_date) & (dau_df['activity_date'] <= end_date)]
+
+
+def test_indexed_window_matches_scan(dau_decorated):
+    indexed = ga.index_dau_by_date(dau_decorated)
+    for d in WINDOW_END_DATES:
+        start_date = d - timedelta(days = 27)
+        window = ga.get_dau_window_df(indexed, start_date, d)
+        assert len(window) == len(scan_window(dau_decorated, start_date, d))
+        assert (window['activity_date'] >= start_date).all() and (window['activity_date'] <= d).all()
+
+
+def test_resorted_copy_falls_back_to_scan(dau_decorated):
+    indexed = ga.index_dau_by_date(dau_decorated)
+    for resorted in [indexed.sort_values('user_id').reset_index(drop = True), indexed.sort_values('user_id')]:
+        assert ga.get_date_index_rows(resorted, date(2018, 3, 1), date(2018, 3, 28)) is None
+        for d in WINDOW_END_DATES:
+            pd.testing.assert_frame_equal(ga.calc_ga_for_window(resorted, d, 28, False),
+                                          ga.calc_ga_for_window(dau_decorated, d, 28, False))
+
+
+def test_filtered_copy_keeps_index(dau_decorated):
+    indexed = ga.index_dau_by_date(dau_decorated)
+    filtered = indexed[indexed['inc_amt'] > 20]
+    assert ga.get_date_index_rows(filtered, date(2018, 3, 1), date(2018, 3, 28)) is not None
+    d = date(2018, 4, 10)
+    pd.testing.assert_frame_equal(ga.calc_ga_for_window(filtered, d, 28, False),
+                                  ga.calc_ga_for_window(dau_decorated[dau_decorated['inc_amt'] > 20], d, 28, False))
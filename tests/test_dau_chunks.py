@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+### Splits the transactions, in a shuffled order, into n_chunks dataframes so
+### the rows of a user and day end up in several chunks
+def split_transactions(transactions, n_chunks):
+    shuffled = transactions.sample(frac = 1, random_state = 0)
+    return [shuffled.iloc[idx] for idx in np.array_split(np.arange(len(shuffled)), n_chunks)]
+
+
+@pytest.mark.parametrize('n_chunks', [1, 7, 50])
+@pytest.mark.parametrize('use_segment', [False, True], ids = ['all', 'segments'])
+@pytest.mark.parametrize('compact', [False, True], ids = ['dates', 'compact'])
+def test_chunks_match_create_dau_df(transactions, segmented_transactions, n_chunks, use_segment, compact):
+    source = segmented_transactions if use_segment else transactions
+    segment_col = 'segment' if use_segment else None
+    expected = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = segment_col, compact = compact)
+    result = ga.create_dau_df_from_chunks(split_transactions(source, n_chunks), activity_date = 'dt',
+                                          segment_col = segment_col, compact = compact)
+    
+    if compact:
+        expected_dau, expected_lookup = expected
+        dau, first_dt, user_id_lookup = result
+        np.testing.assert_array_equal(user_id_lookup, expected_lookup)
+    else:
+        expected_dau = expected
+        dau, first_dt = result
+    pd.testing.assert_frame_equal(dau, expected_dau, check_dtype = False, rtol = 1e-9)
+    pd.testing.assert_frame_equal(first_dt, ga.create_first_dt_df(expected_dau))
+
+
+def test_csv_chunks_match_create_dau_df(tmp_path, segmented_transactions):
+    path = str(tmp_path / 'transactions.csv')
+    segmented_transactions.to_csv(path, index = False)
+    
+    expected = ga.create_dau_df(pd.read_csv(path), activity_date = 'dt', segment_col = 'segment')
+    dau, first_dt = ga.create_dau_df_from_chunks(pd.read_csv(path, chunksize = 500), activity_date = 'dt',
+                                                 segment_col = 'segment')
+    pd.testing.assert_frame_equal(dau, expected, check_dtype = False, rtol = 1e-9)
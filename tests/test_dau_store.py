@@ -0,0 +1,31 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture(scope = 'module')
+def dau_store(tmp_path_factory, dau_decorated):
+    path = str(tmp_path_factory.mktemp('dau_store'))
+    ga.save_dau_store(dau_decorated, path)
+    return path
+
+
+def test_store_window_matches_dataframe(dau_store, dau_decorated):
+    for d in [date(2018, 3, 1), date(2018, 5, 31)]:
+        pd.testing.assert_frame_equal(ga.calc_ga_for_window(dau_store, d, 28, False),
+                                      ga.calc_ga_for_window(dau_decorated, d, 28, False))
+
+
+def test_empty_store_range_keeps_schema(dau_store, dau_decorated):
+    empty = ga.load_dau_store(dau_store, date(2020, 1, 1), date(2020, 1, 31))
+    assert len(empty) == 0
+    pd.testing.assert_series_equal(empty.dtypes, ga.load_dau_store(dau_store).dtypes)
+    
+    for d in [date(2017, 6, 1), date(2020, 1, 31)]:
+        pd.testing.assert_frame_equal(ga.calc_ga_for_window(dau_store, d, 7, False),
+                                      ga.calc_ga_for_window(dau_decorated, d, 7, False))
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+pytest.importorskip('duckdb')
+
+
+def assert_same_df(result, expected):
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True),
+                                  check_dtype = False, rtol = 1e-9)
+
+
+### The transactions are loaded from a CSV file, the way the DuckDB backend is
+### meant to be used, and the pandas results come from the same transactions.
+### Segment_2 has no activity in March and April, so some segments miss periods
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['all', 'segments'])
+def duckdb_data(request, tmp_path_factory, transactions, segmented_transactions):
+    use_segment = request.param
+    source = segmented_transactions if use_segment else transactions
+    if use_segment:
+        months = pd.to_datetime(source['dt']).dt.month
+        source = source.loc[~((source['segment'] == 'segment_2') & months.isin([3, 4]))]
+    segment_col = 'segment' if use_segment else None
+    
+    path = str(tmp_path_factory.mktemp('duckdb') / 'transactions.csv')
+    source.to_csv(path, index = False)
+    con = ga.connect_duckdb()
+    ga.create_dau_duckdb(con, path, activity_date = 'dt', segment_col = segment_col)
+    ga.create_dau_decorated_duckdb(con)
+    
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = segment_col)
+    yield use_segment, con, source, dau, ga.create_dau_decorated_df(dau, use_segment)
+    con.close()
+
+
+def test_dau(duckdb_data):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    assert_same_df(ga.read_duckdb_dau_df(con, 'dau'), dau)
+    assert_same_df(ga.read_duckdb_dau_df(con, 'dau_decorated'), dau_decorated)
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+@pytest.mark.parametrize('kwargs', [{}, {'keep_last_period' : False}, {'date_limit' : datetime(2018, 5, 1)}],
+                         ids = ['default', 'no_last_period', 'date_limit'])
+def test_consolidate_all_ga(duckdb_data, time_period, kwargs):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    xau_decorated = ga.create_xau_decorated_df(dau_decorated, time_period, use_segment)
+    assert_same_df(ga.consolidate_all_ga_duckdb(con, time_period, use_segment, **kwargs),
+                   ga.consolidate_all_ga(xau_decorated, time_period, use_segment, **kwargs))
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+@pytest.mark.parametrize('layout', ['wide', 'long'])
+def test_xau_retention_by_cohort(duckdb_data, time_period, layout):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    xau_decorated = ga.create_xau_decorated_df(dau_decorated, time_period, use_segment)
+    assert_same_df(ga.xau_retention_by_cohort_duckdb(con, time_period, use_segment, layout = layout),
+                   ga.xau_retention_by_cohort_df(xau_decorated, time_period, use_segment, layout = layout))
+
+
+@pytest.mark.parametrize('window_days', [7, [7, 28]])
+def test_calc_rolling_qr_window(duckdb_data, window_days):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    assert_same_df(ga.calc_rolling_qr_window_duckdb(con, window_days, use_segment),
+                   ga.calc_rolling_qr_window(dau_decorated, window_days, use_segment))
+
+
+@pytest.mark.parametrize('window_days', [7, [7, 28]])
+@pytest.mark.parametrize('breakouts', [[2, 4], []])
+def test_create_dau_window(duckdb_data, window_days, breakouts):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    assert_same_df(ga.create_dau_window_duckdb(con, window_days, breakouts, use_segment),
+                   ga.create_dau_window_df(dau_decorated, window_days, breakouts, use_segment))
+
+
+def test_dataframe_and_store_sources(duckdb_data, tmp_path):
+    use_segment, con, source, dau, dau_decorated = duckdb_data
+    ga.create_dau_duckdb(con, source.copy(), activity_date = 'dt', 
+                         segment_col = 'segment' if use_segment else None, table = 'dau_from_df')
+    assert_same_df(ga.read_duckdb_dau_df(con, 'dau_from_df'), dau)
+    
+    pytest.importorskip('pyarrow')
+    ga.save_dau_store(dau, str(tmp_path))
+    ga.create_dau_decorated_duckdb(con, str(tmp_path), 'store_decorated')
+    xau_decorated = ga.create_xau_decorated_df(dau_decorated, 'week', use_segment)
+    assert_same_df(ga.consolidate_all_ga_duckdb(con, 'week', use_segment, table = 'store_decorated'),
+                   ga.consolidate_all_ga(xau_decorated, 'week', use_segment))
@@ -0,0 +1,41 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import growth_accounting as ga
+
+
+YEAR_START_DATES = [date(2017, 1, 1), date(2017, 12, 31), date(2018, 12, 30)]
+
+
+@pytest.fixture(scope = 'module')
+def fiscal_periods():
+    ga.register_fiscal_445_periods(YEAR_START_DATES)
+    return ga.TIME_PERIODS['fiscal_month']
+
+
+def test_fiscal_months(fiscal_periods):
+    days = ga.date_to_day_number([date(2017, 12, 31), date(2018, 1, 27), date(2018, 1, 28), 
+                                  date(2018, 3, 31), date(2018, 4, 1), date(2018, 12, 29)])
+    ordinals = fiscal_periods['to_ordinal'](days)
+    np.testing.assert_array_equal(ordinals, [12, 12, 13, 14, 15, 23])
+    np.testing.assert_array_equal(fiscal_periods['start_day'](ordinals[[0, 2, 4]]), days[[0, 2, 4]])
+
+
+@pytest.mark.parametrize('d', [date(2016, 12, 31), date(2018, 12, 30), date(2019, 6, 1)])
+def test_days_outside_fiscal_years_raise(fiscal_periods, d):
+    days = ga.date_to_day_number([date(2018, 6, 1), d])
+    with pytest.raises(ValueError):
+        fiscal_periods['to_ordinal'](days)
+    with pytest.raises(ValueError):
+        ga.TIME_PERIODS['fiscal_year']['to_ordinal'](days)
+
+
+def test_fiscal_growth_accounting(fiscal_periods, transactions):
+    dau = ga.create_dau_df(transactions.copy(), activity_date = 'dt')
+    xau_decorated = ga.create_period_decorated_dfs(dau, time_periods = ['fiscal_month'])['fiscal_month']
+    user_ga, rev_ga = ga.create_growth_accounting_dfs(xau_decorated, 'fiscal_month')
+    assert len(user_ga) > 0
+    assert (user_ga['Fiscal Monthly Active Users'] == user_ga['Retained Users'] + user_ga['New Users'] 
+            + user_ga['Resurrected Users']).all()
@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['all', 'segments'])
+def period_data(request, transactions, segmented_transactions):
+    use_segment = request.param
+    source = segmented_transactions if use_segment else transactions
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = 'segment' if use_segment else None)
+    return use_segment, ga.create_dau_decorated_df(dau, use_segment)
+
+
+### The two-pass growth accounting that create_growth_accounting_dfs replaced:
+### an outer self-merge on the next period, then calc_user_ga and calc_rev_ga
+### applied to each period group
+def calc_reference_ga(xau_decorated, time_period, use_segment, keep_last_period = True, date_limit = None):
+    time_fields = ga.get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    frequency = time_fields['frequency']
+    
+    xau_this = xau_decorated.assign(**{grouping_col + '_join' : xau_decorated[grouping_col]})
+    xau_last = xau_decorated.assign(**{grouping_col + '_join' : xau_decorated['Next_' + grouping_col]})
+    join_cols = ['user_id', grouping_col + '_join'] + (['segment'] if use_segment else [])
+    xga_interim = pd.merge(xau_this, xau_last, suffixes = ['.t', '.l'], how = 'outer', on = join_cols)
+    
+    groupby_cols = [grouping_col + '_join'] + (['segment'] if use_segment else [])
+    xgas = []
+    for calc, cols, total_col in [(ga.calc_user_ga, ga.get_user_ga_cols(frequency), frequency + ' Active Users'),
+                                  (ga.calc_rev_ga, ga.get_rev_ga_cols(frequency), frequency + ' Revenue')]:
+        xga = (xga_interim.groupby(groupby_cols)
+               .apply(lambda x: pd.Series(calc(x, grouping_col, first_period_col), index = cols))
+               .reset_index()
+               .rename(columns = {grouping_col + '_join' : grouping_col}))
+        xga = xga[xga[total_col] > 0].reset_index(drop = True)
+        xga[grouping_col] = ga.period_start_time(xga[grouping_col], time_period) + timedelta(hours = 7)
+        if not keep_last_period:
+            xga = xga[:-1]
+        if date_limit is not None:
+            xga = xga[xga[grouping_col] <= date_limit]
+        xgas.append(xga.reset_index(drop = True))
+    return xgas
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+@pytest.mark.parametrize('kwargs', [{}, {'keep_last_period' : False}, {'date_limit' : datetime(2018, 5, 1)}],
+                         ids = ['default', 'no_last_period', 'date_limit'])
+def test_single_pass_matches_two_pass(monkeypatch, period_data, time_period, kwargs):
+    monkeypatch.setitem(ga.BACKEND_SETTINGS, 'backend', 'pandas')
+    use_segment, dau_decorated = period_data
+    xau_decorated = ga.create_xau_decorated_df(dau_decorated, time_period, use_segment)
+    
+    expected_user, expected_rev = calc_reference_ga(xau_decorated, time_period, use_segment, **kwargs)
+    user_xga, rev_xga = ga.create_growth_accounting_dfs(xau_decorated, time_period, use_segment, **kwargs)
+    assert len(expected_user) > 0
+    pd.testing.assert_frame_equal(user_xga.reset_index(drop = True), expected_user, check_dtype = False)
+    pd.testing.assert_frame_equal(rev_xga.reset_index(drop = True), expected_rev, check_dtype = False, rtol = 1e-9)
+
+
+### Integer ordinals of a pandas Period column, NaN where the period is missing
+def to_period_ordinals(periods):
+    return ga.period_to_ordinal(periods).where(periods.notnull())
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+@pytest.mark.parametrize('use_segment', [False, True], ids = ['all', 'segments'])
+def test_last_period_join_matches_self_merge(segment_change_transactions, time_period, use_segment):
+    time_fields = ga.get_time_period_dict(time_period)
+    grouping_col = time_fields['grouping_col']
+    first_period_col = time_fields['first_period_col']
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    
+    dau = ga.create_dau_df(segment_change_transactions.copy(), activity_date = 'dt',
+                           segment_col = 'segment' if use_segment else None)
+    xau_decorated = ga.create_xau_decorated_df(ga.create_dau_decorated_df(dau, use_segment), time_period, use_segment)
+    columns_before = list(xau_decorated.columns)
+    
+    xau_this = xau_decorated.assign(**{grouping_col + '_join' : xau_decorated[grouping_col]})
+    xau_last = xau_decorated.assign(**{grouping_col + '_join' : xau_decorated['Next_' + grouping_col]})
+    expected = pd.merge(xau_this, xau_last, suffixes = ['.t', '.l'], how = 'outer', 
+                        on = key_cols + [grouping_col + '_join'])
+    for c in [grouping_col + '_join', grouping_col + '.t', first_period_col + '.t']:
+        expected[c] = to_period_ordinals(expected[c])
+    
+    cols = [grouping_col + '_join'] + key_cols + [grouping_col + '.t', first_period_col + '.t', 'inc_amt.t', 'inc_amt.l']
+    sort_cols = key_cols + [grouping_col + '_join']
+    expected = expected[cols].sort_values(sort_cols).reset_index(drop = True)
+    xga_interim = ga.join_xau_to_last_period(xau_decorated, time_period, use_segment)
+    xga_interim = xga_interim[cols].sort_values(sort_cols).reset_index(drop = True)
+    
+    resurrected = (expected['inc_amt.l'].isnull() & expected['inc_amt.t'].notnull()
+                   & (expected[first_period_col + '.t'] < expected[grouping_col + '.t']))
+    assert resurrected.any()
+    assert (expected['inc_amt.t'].isnull()).any()
+    if use_segment:
+        assert (xau_decorated.groupby('user_id')['segment'].nunique() > 1).any()
+    assert list(xau_decorated.columns) == columns_before
+    pd.testing.assert_frame_equal(xga_interim, expected, check_dtype = False)
+
+
+### The segmented transactions without any activity of segment_2 in March and
+### April, so that segment has no growth accounting rows for those periods
+@pytest.fixture(scope = 'module')
+def gap_segment_xga(segmented_transactions):
+    transactions = segmented_transactions
+    in_gap = (transactions['segment'] == 'segment_2') & transactions['dt'].dt.month.isin([3, 4])
+    dau = ga.create_dau_df(transactions[~in_gap].copy(), activity_date = 'dt', segment_col = 'segment')
+    xau_decorated = ga.create_xau_decorated_df(ga.create_dau_decorated_df(dau, True), 'week', True)
+    return ga.create_growth_accounting_dfs(xau_decorated, 'week', True)
+
+
+### The segment by segment ratios that calc_user_ga_ratios and 
+### calc_rev_ga_ratios replaced: a positional shift over each segment's rows, 
+### so the row after a gap is compared with the last row before it, and the
+### quick ratio of calc_qr applied row by row
+def calc_reference_ratios(xga_df, value_col, ratio_cols, calc_qr, qr_kwargs, growth_rate_periods):
+    bop_col, retained_col, retention_col, qr_col, cgr_col = ratio_cols
+    ratio_dfs = []
+    for s in xga_df['segment'].unique():
+        ratio_df = xga_df.loc[xga_df['segment'] == s].reset_index()
+        ratio_df[bop_col] = ratio_df[value_col].shift(1)
+        ratio_df[retention_col] = ratio_df[retained_col] / ratio_df[bop_col]
+        ratio_df[qr_col] = ratio_df.apply(lambda x: calc_qr(x, **qr_kwargs), axis = 1)
+        ratio_df[cgr_col] = np.power(ratio_df[value_col] / ratio_df[value_col].shift(growth_rate_periods), 
+                                     1/growth_rate_periods) - 1
+        ratio_dfs.append(ratio_df)
+    return pd.concat(ratio_dfs)
+
+
+def test_ratios_keep_nan_positions_with_missing_periods(gap_segment_xga):
+    user_xga, rev_xga = gap_segment_xga
+    rows_per_segment = user_xga.groupby('segment').size()
+    assert rows_per_segment['segment_2'] < rows_per_segment['segment_0']
+    
+    user_ratio_cols = ['Users BOP', 'Retained Users', 'WoW User Retention', 'User Quick Ratio', 'T4W User CWGR']
+    expected_user = calc_reference_ratios(user_xga, 'Weekly Active Users', user_ratio_cols, ga.calc_user_qr,
+                                          {'new_col' : 'New Users', 'res_col' : 'Resurrected Users', 
+                                           'churned_col' : 'Churned Users'}, 4)
+    user_ratios = ga.calc_user_ga_ratios(user_xga, 'week', True, growth_rate_periods = 4)
+    
+    rev_ratio_cols = ['Revenue BOP', 'Retained Revenue', 'WoW Revenue Retention', 'Revenue Quick Ratio', 
+                      'T4W Revenue CWGR']
+    expected_rev = calc_reference_ratios(rev_xga, 'Weekly Revenue', rev_ratio_cols, ga.calc_rev_qr,
+                                         {'new_col' : 'New Revenue', 'res_col' : 'Resurrected Revenue', 
+                                          'exp_col' : 'Expansion Revenue', 'churned_col' : 'Churned Revenue', 
+                                          'con_col' : 'Contraction Revenue'}, 4)
+    expected_rev['Net Expansion Revenue'] = expected_rev['Expansion Revenue'] + expected_rev['Contraction Revenue']
+    rev_ratios = ga.calc_rev_ga_ratios(rev_xga, 'week', True, growth_rate_periods = 4)
+    
+    for result, expected, ratio_cols in [(user_ratios, expected_user, user_ratio_cols), 
+                                         (rev_ratios, expected_rev, rev_ratio_cols)]:
+        assert expected[ratio_cols].isnull().values.any()
+        assert sorted(result.columns) == sorted(expected.columns)
+        pd.testing.assert_frame_equal(result[expected.columns].isnull(), expected.isnull())
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype = False, rtol = 1e-9)
+
+
+@pytest.mark.parametrize('use_segment', [False, True], ids = ['all', 'segments'])
+@pytest.mark.parametrize('compact', [False, True], ids = ['dates', 'compact'])
+def test_period_decorated_dfs_match_xau_decorated(transactions, segmented_transactions, use_segment, compact):
+    source = segmented_transactions if use_segment else transactions
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = 'segment' if use_segment else None,
+                           compact = compact)
+    if compact:
+        dau = dau[0]
+    dau_decorated = ga.create_dau_decorated_df(dau, use_segment)
+    time_periods = ['week', 'month', 'quarter', 'year']
+    
+    period_dfs = ga.create_period_decorated_dfs(dau, use_segment, time_periods)
+    pd.testing.assert_frame_equal(period_dfs['first_dt'][['user_id', 'first_dt', 'first_week', 'first_month']],
+                                  ga.create_first_dt_df(dau))
+    for time_period in time_periods:
+        expected = ga.create_xau_decorated_df(dau_decorated, time_period, use_segment)
+        # The groupby of create_xau_decorated_df widens the int32 compact user codes
+        pd.testing.assert_frame_equal(period_dfs[time_period], expected, check_dtype = False, rtol = 1e-9)
+    
+    decorated_period_dfs = ga.create_period_decorated_dfs(dau_decorated, use_segment, time_periods)
+    for key, period_df in period_dfs.items():
+        pd.testing.assert_frame_equal(decorated_period_dfs[key], period_df)
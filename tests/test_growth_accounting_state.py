@@ -0,0 +1,70 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+pytest.importorskip('pyarrow')
+
+
+LAST_STATE_DATE = pd.Timestamp('2018-04-10')
+TIME_PERIODS = ['week', 'month']
+WINDOW_DAYS = [7, 28]
+
+
+def create_dau_decorated(transactions):
+    return ga.create_dau_decorated_df(ga.create_dau_df(transactions.copy(), activity_date = 'dt'), False)
+
+
+### Splits the transactions into those the state is built from and a batch 
+### added to it, and returns them with the transactions of a full recompute
+def split_batch(transactions, case):
+    dt = pd.to_datetime(transactions['dt'])
+    history = transactions.loc[dt <= LAST_STATE_DATE]
+    if case == 'next_day':
+        batch = transactions.loc[dt == LAST_STATE_DATE + pd.Timedelta(days = 1)]
+    elif case == 'gap':
+        batch = transactions.loc[dt == LAST_STATE_DATE + pd.Timedelta(days = 3)]
+    else:
+        # Late transactions of the week just closed, including the first 
+        # transactions of users who are already in the state
+        is_late = (dt >= pd.Timestamp('2018-04-02')) & (dt <= pd.Timestamp('2018-04-06'))
+        late_users = transactions.loc[is_late, 'user_id'].drop_duplicates().sample(frac = 0.3, random_state = 0)
+        batch = transactions.loc[is_late & transactions['user_id'].isin(late_users)]
+        history = history.drop(batch.index)
+        history_first = pd.to_datetime(history['dt']).groupby(history['user_id']).min()
+        batch_first = pd.to_datetime(batch['dt']).groupby(batch['user_id']).min()
+        assert (batch_first < history_first.reindex(batch_first.index)).any()
+    return history, batch, pd.concat([history, batch])
+
+
+@pytest.mark.parametrize('case', ['next_day', 'gap', 'late'])
+def test_update_matches_full_recompute(tmp_path, transactions, case):
+    history, batch, full = split_batch(transactions, case)
+    path = str(tmp_path / 'state')
+    ga.create_growth_accounting_state(create_dau_decorated(history), path, window_days = WINDOW_DAYS,
+                                      time_periods = TIME_PERIODS)
+    state = ga.update_growth_accounting_state(path, batch.copy(), activity_date = 'dt')
+    state = ga.load_growth_accounting_state(path)
+    
+    full_dau_decorated = create_dau_decorated(full)
+    pd.testing.assert_frame_equal(state['first_dt'].reset_index(drop = True), 
+                                  ga.create_first_dt_df(full_dau_decorated))
+    
+    store = ga.load_dau_store(str(tmp_path / 'state' / ga.GA_STATE_STORE))
+    sort_cols = ['user_id', 'activity_date']
+    pd.testing.assert_frame_equal(store.sort_values(sort_cols).reset_index(drop = True)[full_dau_decorated.columns],
+                                  full_dau_decorated.sort_values(sort_cols).reset_index(drop = True))
+    
+    for time_period in TIME_PERIODS:
+        xau_decorated = ga.create_xau_decorated_df(full_dau_decorated, time_period, False)
+        pd.testing.assert_frame_equal(ga.get_state_all_ga(state, time_period).drop(columns = ['index_x', 'index_y']),
+                                      ga.consolidate_all_ga(xau_decorated, time_period)
+                                        .drop(columns = ['index_x', 'index_y']))
+        pd.testing.assert_frame_equal(ga.get_state_cohort_df(state, time_period, layout = 'long'),
+                                      ga.xau_retention_by_cohort_df(xau_decorated, time_period, layout = 'long'))
+    
+    rolling_qr = ga.calc_rolling_qr_window(full_dau_decorated, WINDOW_DAYS).reset_index(drop = True)
+    pd.testing.assert_frame_equal(state['rolling_qr'][rolling_qr.columns], rolling_qr, check_dtype = False)
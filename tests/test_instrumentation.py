@@ -0,0 +1,35 @@
+import tracemalloc
+import numpy as np
+from conftest import ga
+
+
+
+@ga.instrumented('allocate')
+def allocate(n_bytes):
+    return np.ones(n_bytes, dtype = np.uint8).sum()
+
+
+
+def test_outer_tracemalloc_peak_is_kept():
+    tracemalloc.start()
+    try:
+        spike = np.ones(2**25, dtype = np.uint8)
+        del spike
+        allocate(2**20)
+        assert tracemalloc.get_traced_memory()[1] >= 2**25
+    finally:
+        tracemalloc.stop()
+
+
+
+def test_recorded_stage_peaks():
+    with ga.record_stages(trace_memory = True) as records:
+        with ga.instrument_stage('outer') as outer:
+            spike = np.ones(2**24, dtype = np.uint8)
+            del spike
+            allocate(2**22)
+    inner = [record for record in records if record['stage'] == 'allocate'][0]
+    assert inner['parent'] == 'outer'
+    assert 3.9 <= inner['peak_mb'] <= outer['peak_mb']
+    assert outer['peak_mb'] >= 16
+    assert not tracemalloc.is_tracing()
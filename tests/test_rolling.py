@@ -0,0 +1,137 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+WINDOW_SIZES = [1, 7, 28]
+
+
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['all', 'segments'])
+def rolling_data(request, transactions, segmented_transactions):
+    use_segment = request.param
+    source = segmented_transactions if use_segment else transactions
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = 'segment' if use_segment else None)
+    return use_segment, ga.create_dau_decorated_df(dau, use_segment)
+
+
+### The per-window frames of the 'window' method are concatenated, so their
+### column order and int or float types depend on the statuses each window 
+### happens to have. The values, including the NaNs, must be the same
+def assert_same_windows(result, expected):
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True),
+                                  check_like = True, check_dtype = False)
+
+
+@pytest.mark.parametrize('window_days', WINDOW_SIZES)
+def test_incremental_matches_window(rolling_data, window_days):
+    use_segment, dau_decorated = rolling_data
+    expected = ga.calc_rolling_qr_window(dau_decorated, window_days, use_segment, method = 'window')
+    result = ga.calc_rolling_qr_window(dau_decorated, window_days, use_segment, method = 'incremental')
+    assert len(expected) > 0
+    assert_same_windows(result, expected)
+
+
+def create_missing_status_dau():
+    days = [date(2018, 1, 1) + timedelta(days = i) for i in range(6)]
+    transactions = pd.DataFrame({'user_id' : [1] * 6 + [2] + [3] * 6,
+                                 'dt' : days + days[5:] + days,
+                                 'inc_amt' : 1.0,
+                                 'segment' : ['A'] * 7 + ['B'] * 6})
+    dau = ga.create_dau_df(transactions, activity_date = 'dt', segment_col = 'segment')
+    return ga.create_dau_decorated_df(dau, True)
+
+
+### Segment B has no new users in the window ending on the 6th, while A has one,
+### so B's active users are NaN. No segment has resurrected or churned users, 
+### so they count as 0 and the retention rates are 1
+@pytest.mark.parametrize('method', ['window', 'incremental'])
+def test_status_missing_from_one_segment(method):
+    rolling_qr = ga.calc_rolling_qr_window(create_missing_status_dau(), 2, True, method = method)
+    last_window = rolling_qr[rolling_qr['window_end_date'] == pd.Timestamp('2018-01-06')].set_index('segment')
+    assert last_window.loc['A', 'active_users'] == 2
+    assert np.isnan(last_window.loc['B', 'active_users'])
+    assert (last_window['user_retention_rate'] == 1).all()
+
+
+### The rolling window functions under test, called as func(dau_decorated, 
+### window_days, use_segment, **kwargs)
+ROLLING_FUNCS = {'rolling_qr' : ga.calc_rolling_qr_window,
+                 'dau_window' : ga.create_dau_window_df}
+
+
+@pytest.fixture(scope = 'module')
+def activity_matrix(rolling_data):
+    use_segment, dau_decorated = rolling_data
+    return ga.create_activity_matrix(dau_decorated, use_segment)
+
+
+### The methods each function can run on an activity matrix alone
+MATRIX_CASES = [('rolling_qr', 'incremental'), ('dau_window', 'incremental'), ('dau_window', 'window')]
+
+
+@pytest.mark.parametrize('func_name, method', MATRIX_CASES, ids = ['-'.join(c) for c in MATRIX_CASES])
+@pytest.mark.parametrize('window_days', [7, [7, 28]], ids = ['single', 'multi'])
+def test_activity_matrix_matches_dataframe(rolling_data, activity_matrix, func_name, method, window_days):
+    use_segment, dau_decorated = rolling_data
+    func = ROLLING_FUNCS[func_name]
+    expected = func(dau_decorated, window_days, use_segment = use_segment, method = method)
+    result = func(None, window_days, activity_matrix = activity_matrix, method = method)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True))
+
+
+### The 'window' method of calc_rolling_qr_window reads the DAU rows, so an
+### activity matrix alone is not enough for it
+def test_window_method_needs_dataframe(activity_matrix):
+    with pytest.raises(ValueError):
+        ga.calc_rolling_qr_window(None, 7, activity_matrix = activity_matrix, method = 'window')
+
+
+### Splitting the window end dates across processes must give the same rows, 
+### in the same order, as the serial run, including for chunk boundaries that
+### fall before 2*window_days for the larger window size
+@pytest.mark.parametrize('func_name', list(ROLLING_FUNCS))
+@pytest.mark.parametrize('method', ['incremental', 'window'])
+def test_parallel_matches_serial(rolling_data, func_name, method):
+    use_segment, dau_decorated = rolling_data
+    func = ROLLING_FUNCS[func_name]
+    expected = func(dau_decorated, [7, 28], use_segment = use_segment, method = method)
+    result = func(dau_decorated, [7, 28], use_segment = use_segment, method = method, n_jobs = 3)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True))
+
+
+### A list of window sizes gives the rows of each window size, in the order of
+### the list, exactly as one call per window size does. The slower 'window' 
+### method gets fewer sizes
+@pytest.mark.parametrize('func_name', list(ROLLING_FUNCS))
+@pytest.mark.parametrize('method, window_day_sizes', [('incremental', [7, 28, 3]), ('window', [7, 3])],
+                         ids = ['incremental', 'window'])
+def test_multi_window_matches_single_windows(rolling_data, func_name, method, window_day_sizes):
+    use_segment, dau_decorated = rolling_data
+    func = ROLLING_FUNCS[func_name]
+    expected = pd.concat([func(dau_decorated, w, use_segment = use_segment, method = method) 
+                          for w in window_day_sizes])
+    result = func(dau_decorated, window_day_sizes, use_segment = use_segment, method = method)
+    assert list(result['window_days'].unique()) == window_day_sizes
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True))
+
+
+### Window sizes and breakouts of the stickiness checks, including no breakouts
+### and breakouts of 0 days and of more days than the window has
+DAU_WINDOW_CASES = [(1, [2, 4]), (7, [2, 4]), (28, [2, 4]), (7, []), (7, [0, 2, 7, 50])]
+
+
+@pytest.mark.parametrize('window_days, breakouts', DAU_WINDOW_CASES, 
+                         ids = ['%s-%s' % (w, '_'.join(str(b) for b in bs)) for w, bs in DAU_WINDOW_CASES])
+def test_dau_window_incremental_matches_window(rolling_data, window_days, breakouts):
+    use_segment, dau_decorated = rolling_data
+    expected = ga.create_dau_window_df(dau_decorated, window_days, breakouts, use_segment, method = 'window')
+    result = ga.create_dau_window_df(dau_decorated, window_days, breakouts, use_segment, method = 'incremental')
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(result.reset_index(drop = True), expected.reset_index(drop = True), 
+                                  check_dtype = False, rtol = 1e-9)
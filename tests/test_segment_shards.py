@@ -0,0 +1,128 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+USAGE_KWARGS = {'last_date' : date(2018, 6, 1), 'window_days' : 30, 'breakouts' : [2, 5]}
+
+
+@pytest.fixture(scope = 'module')
+def shard_dau_decorated(segment_change_transactions):
+    dau = ga.create_dau_df(segment_change_transactions.copy(), activity_date = 'dt', segment_col = 'segment')
+    return ga.create_dau_decorated_df(dau, True)
+
+
+### Rows of a sharded result for the segments or for the 'All' rollup, without
+### the 'segment' column in the 'All' case
+def get_shard_rows(sharded, all_rows = False):
+    if all_rows:
+        return sharded[sharded['segment'] == 'All'].drop(columns = 'segment').reset_index(drop = True)
+    return sharded[sharded['segment'] != 'All'].reset_index(drop = True)
+
+
+@pytest.mark.parametrize('time_period', ['week', 'month'])
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_growth_accounting_shards_match_segmented(shard_dau_decorated, time_period, n_jobs):
+    dau_decorated = shard_dau_decorated
+    grouping_col = ga.get_time_period_dict(time_period)['grouping_col']
+    sharded = ga.run_segment_shards(dau_decorated, 'growth_accounting', {'time_period' : time_period},
+                                    include_all = True, n_jobs = n_jobs)
+    # index_x and index_y are the row positions of the frames the ratios were
+    # calculated from, which differ between a shard and the full dataframe
+    sharded = sharded.drop(columns = ['index_x', 'index_y'])
+    
+    expected = ga.consolidate_all_ga(ga.create_xau_decorated_df(dau_decorated, time_period, True), time_period, True)
+    expected = expected[sharded.columns].sort_values(['segment', grouping_col]).reset_index(drop = True)
+    pd.testing.assert_frame_equal(get_shard_rows(sharded), expected, check_dtype = False, rtol = 1e-9)
+    
+    expected_all = ga.consolidate_all_ga(ga.create_xau_decorated_df(dau_decorated, time_period, False),
+                                         time_period, False)
+    expected_all = expected_all[sharded.columns.drop('segment')]
+    pd.testing.assert_frame_equal(get_shard_rows(sharded, True), expected_all, check_dtype = False, rtol = 1e-9)
+
+
+### Users who change segments are counted in each of their segments but once
+### in the 'All' rollup, so it is not the sum of the segments
+def test_all_rollup_counts_users_once(shard_dau_decorated):
+    sharded = ga.run_segment_shards(shard_dau_decorated, 'growth_accounting', {'time_period' : 'month'},
+                                    include_all = True)
+    segment_users = get_shard_rows(sharded).groupby('Month_Year')['Monthly Active Users'].sum()
+    all_users = get_shard_rows(sharded, True).set_index('Month_Year')['Monthly Active Users']
+    assert (all_users <= segment_users).all()
+    assert (all_users < segment_users).any()
+
+
+def test_usage_shards_match_segmented(shard_dau_decorated):
+    sharded = ga.run_segment_shards(shard_dau_decorated, 'user_daily_usage', USAGE_KWARGS, include_all = True)
+    expected = ga.calc_user_daily_usage(shard_dau_decorated, use_segment = True, **USAGE_KWARGS)
+    
+    # The order of users with the same inc_amt, and so their cum_inc_amt,
+    # depends on the sort, which test_usage_revenue_concentration_by_segment
+    # checks independently of the order
+    expected_all = ga.calc_user_daily_usage(shard_dau_decorated, use_segment = False, **USAGE_KWARGS)
+    for result, expected_usage in [(get_shard_rows(sharded), expected), (get_shard_rows(sharded, True), expected_all)]:
+        cols = [c for c in expected_usage.columns if not c.startswith('cum_inc_amt')]
+        sort_cols = [c for c in ['segment', 'user_id'] if c in cols]
+        pd.testing.assert_frame_equal(result[cols].sort_values(sort_cols).reset_index(drop = True),
+                                      expected_usage[cols].sort_values(sort_cols).reset_index(drop = True),
+                                      check_dtype = False)
+
+
+### The revenue concentration of each segment is that of the segment's users
+### alone: the running total of their inc_amt from the largest down, its share
+### of the segment's total, and the share of users within 80% of that total
+def test_usage_revenue_concentration_by_segment(shard_dau_decorated):
+    usage = ga.calc_user_daily_usage(shard_dau_decorated, use_segment = True, **USAGE_KWARGS)
+    assert usage['segment'].nunique() > 1
+    for segment, segment_usage in usage.groupby('segment'):
+        inc_amt = np.sort(segment_usage['inc_amt'].values)[::-1]
+        cum_inc_amt = np.cumsum(inc_amt)
+        np.testing.assert_allclose(np.sort(segment_usage['cum_inc_amt'].values), cum_inc_amt)
+        np.testing.assert_allclose(np.sort(segment_usage['cum_inc_amt_pct_of_total'].values),
+                                   cum_inc_amt / inc_amt.sum())
+        np.testing.assert_allclose(segment_usage['revenue_80pct_ratio'].values,
+                                   np.mean(cum_inc_amt / inc_amt.sum() <= .80))
+
+
+### Each shard's rolling series starts 2*window_days after its own segment's
+### first activity, so the shard rows are compared with the segmented rows of
+### the same segment and window end date. A status that a segment lacks in a
+### window can be NaN on either side, and counts as 0
+def test_rolling_shards_match_segmented(shard_dau_decorated):
+    sharded = ga.run_segment_shards(shard_dau_decorated, 'rolling_qr', {'window_days' : 7},
+                                    include_all = True, n_jobs = 2)
+    shard_rows = get_shard_rows(sharded)
+    expected = ga.calc_rolling_qr_window(shard_dau_decorated, 7, True)
+    merged = shard_rows.merge(expected, on = ['segment', 'window_end_date'], suffixes = ['', '_expected'])
+    assert len(merged) == len(shard_rows)
+    for c in ['new', 'retained', 'resurrected', 'churned']:
+        np.testing.assert_array_equal(merged[c].fillna(0), merged[c + '_expected'].fillna(0))
+    np.testing.assert_allclose(merged['user_quick_ratio'], merged['user_quick_ratio_expected'])
+    
+    expected_all = ga.calc_rolling_qr_window(shard_dau_decorated, 7, False)
+    pd.testing.assert_frame_equal(get_shard_rows(sharded, True),
+                                  expected_all[sharded.columns.drop('segment')].reset_index(drop = True),
+                                  check_dtype = False)
+
+
+### Segments without any active users in a window have no row in the segmented
+### result, while their shard keeps the row, with no users
+def test_dau_window_shards_match_segmented(shard_dau_decorated):
+    sharded = ga.run_segment_shards(shard_dau_decorated, 'dau_window', {'window_days' : 7, 'breakouts' : [2, 4]},
+                                    include_all = True)
+    shard_rows = get_shard_rows(sharded).drop(columns = 'index')
+    expected = ga.create_dau_window_df(shard_dau_decorated, 7, [2, 4], True)
+    merged = shard_rows.merge(expected, how = 'left', on = ['segment', 'window_end_dt'],
+                              suffixes = ['', '_expected'], indicator = True)
+    assert (shard_rows.loc[merged['_merge'] == 'left_only', '1d+ users'] == 0).all()
+    merged = merged[merged['_merge'] == 'both']
+    for c in shard_rows.columns.drop(['segment', 'window_end_dt']):
+        np.testing.assert_allclose(merged[c].astype(float), merged[c + '_expected'].astype(float), err_msg = c)
+    
+    expected_all = ga.create_dau_window_df(shard_dau_decorated, 7, [2, 4], False)
+    pd.testing.assert_frame_equal(get_shard_rows(sharded, True), expected_all.reset_index(drop = True),
+                                  check_dtype = False)
@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth_accounting as ga
+
+
+WINDOW_END_DATES = [date(2018, 2, 20), date(2018, 4, 10), date(2018, 6, 30)]
+
+
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['all', 'segments'])
+def status_data(request, transactions, segmented_transactions):
+    use_segment = request.param
+    source = segmented_transactions if use_segment else transactions
+    dau = ga.create_dau_df(source.copy(), activity_date = 'dt', segment_col = 'segment' if use_segment else None)
+    return use_segment, ga.create_dau_decorated_df(dau, use_segment)
+
+
+### User statuses of the window of the row-wise reference implementation, 
+### assign_ga_date_range on each row and assign_user_status on each user
+def calc_reference_statuses(dau_decorated, last_date, window_days, use_segment):
+    window_start_date = last_date - timedelta(days = 2*window_days-1)
+    dau_dec = dau_decorated.loc[(dau_decorated['activity_date'] >= window_start_date) & 
+                                (dau_decorated['activity_date'] <= last_date)].copy()
+    dau_dec['ga_date_range'] = dau_dec.apply(lambda x: ga.assign_ga_date_range(x, last_date, window_days), axis = 1)
+    
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    dau_grouped = dau_dec.groupby(key_cols + ['ga_date_range'])['inc_amt'].sum().unstack().reset_index()
+    dau_grouped['user_status'] = dau_grouped.apply(ga.assign_user_status, axis = 1)
+    return dau_grouped.set_index(key_cols)['user_status'].sort_index()
+
+
+@pytest.mark.parametrize('window_days', [7, 28])
+def test_classification_matches_reference(status_data, window_days):
+    use_segment, dau_decorated = status_data
+    key_cols = ['user_id', 'segment'] if use_segment else ['user_id']
+    for last_date in WINDOW_END_DATES:
+        expected = calc_reference_statuses(dau_decorated, last_date, window_days, use_segment)
+        
+        curr_period_start_dt = last_date - timedelta(days = window_days-1)
+        window = dau_decorated.loc[(dau_decorated['activity_date'] >= last_date - timedelta(days = 2*window_days-1)) &
+                                   (dau_decorated['activity_date'] <= last_date)]
+        is_this_period = window['activity_date'] >= curr_period_start_dt
+        counts = (window[key_cols + ['first_dt']]
+                  .assign(this_period = is_this_period, last_period = ~is_this_period)
+                  .groupby(key_cols)
+                  .agg({'first_dt' : 'first', 'this_period' : 'sum', 'last_period' : 'sum'}))
+        status = ga.classify_window_status(counts['this_period'].values, counts['last_period'].values,
+                                           counts['first_dt'].values, curr_period_start_dt)
+        result = pd.Series(ga.WINDOW_STATUS_NAMES[status], index = counts.index, name = 'user_status')
+        
+        assert expected.nunique() > 1
+        pd.testing.assert_series_equal(result.sort_index(), expected)
+
+
+@pytest.mark.parametrize('window_days', [7, 28])
+def test_window_counts_match_reference(status_data, window_days):
+    use_segment, dau_decorated = status_data
+    for last_date in WINDOW_END_DATES:
+        expected = calc_reference_statuses(dau_decorated, last_date, window_days, use_segment)
+        if use_segment:
+            expected = expected.groupby([expected.index.get_level_values('segment'), expected]).size().unstack()
+        else:
+            expected = expected.value_counts().to_frame().T
+        
+        result = ga.calc_ga_for_window(dau_decorated, last_date, window_days, use_segment)
+        if use_segment:
+            result = result.set_index('segment')
+        for c in ['new', 'retained', 'resurrected', 'churned']:
+            expected_counts = expected[c].values if c in expected else np.full(len(result), np.nan)
+            if c == 'churned':
+                expected_counts = -1 * expected_counts
+            np.testing.assert_array_equal(result[c].values if c in result else np.full(len(result), np.nan), 
+                                          expected_counts)
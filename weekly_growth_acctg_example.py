@@ -12,6 +12,10 @@ PYTHON_FOLDER = 'C:\\Users\\dksmi\\Dropbox (TheVentureCity)\\David\\Python Scrip
 sys.path.append(PYTHON_FOLDER)
 import growth_accounting as ga # Up-to-date version located here https://github.com/dksmith01/TheVentureCity/blob/master/growth_accounting.py
 
+### Show the progress messages of the growth_accounting functions. 'DEBUG'
+### also shows the time each step took and every window end date
+ga.set_log_level('INFO')
+
 ### Set up Python output to show every dataframe column
 pd.set_option('display.max_columns', 500)
 
@@ -36,6 +40,13 @@ dau = ga.create_dau_df(t,
                        inc_amt = 'inc_amt')
 dau.head()
 
+### For transaction files too large to read into memory, read them in chunks
+### instead. This returns the first_dt dataframe below as well
+# dau, first_dt = ga.create_dau_df_from_chunks(pd.read_csv(filename, chunksize = 1000000),
+#                                              user_id = 'user_id',
+#                                              activity_date = 'dt',
+#                                              inc_amt = 'inc_amt')
+
 ### Calculate the first activity date for each user_id in the dataset
 ### This step is optional. If you do not include a dataframe in the  
 ### first_dt_df optional paramter as part of the create_dau_decorated function
@@ -50,12 +61,29 @@ first_dt.head()
 dau_decorated = ga.create_dau_decorated_df(dau, use_segment = False, first_dt_df = first_dt)
 dau_decorated.head()
 
-### Growth Accounting: WAU and WRR
-### Roll up the DAU dataframe into a weekly WAU dataframe
-wau = ga.create_wau_df(dau)
+### Optionally save dau_decorated as monthly Parquet files (requires pyarrow) so
+### later runs can load it, or only the months they need, instead of the CSV
+# ga.save_dau_store(dau_decorated, folder + 'dau_decorated_store')
+# dau_decorated = ga.load_dau_store(folder + 'dau_decorated_store')
+
+### For transaction histories too large for memory, the same steps can run as
+### SQL in an embedded DuckDB database (requires duckdb), which spills to disk
+### beyond memory_limit. The results are the same dataframes as below
+# con = ga.connect_duckdb(folder + 'growth_accounting.duckdb', memory_limit = '8GB',
+#                         temp_directory = folder + 'duckdb_tmp')
+# ga.create_dau_duckdb(con, filename, user_id = 'user_id', activity_date = 'dt', inc_amt = 'inc_amt')
+# ga.create_dau_decorated_duckdb(con)
+# w_all_ga = ga.consolidate_all_ga_duckdb(con, 'week', keep_last_period = False)
+# wau_retention_by_cohort = ga.xau_retention_by_cohort_duckdb(con, 'week')
+# rolling_dau_xau = ga.create_dau_window_duckdb(con, window_days = 28, breakouts = [2, 4, 7, 14, 21, 28])
+# rolling = ga.calc_rolling_qr_window_duckdb(con, window_days = 28)
 
-### Merges the WAU data with the first_dt dataframe to get the first week of behavior
-wau_decorated = ga.create_wau_decorated_df(wau, first_dt)
+### Growth Accounting: WAU and WRR
+### Roll up the DAU dataframe into a weekly WAU dataframe with the first week of
+### behavior of each user. create_period_decorated_dfs builds the weekly and
+### monthly dataframes and first_dt together in a single pass over dau
+period_dfs = ga.create_period_decorated_dfs(dau)
+wau_decorated = period_dfs['week']
 
 ### Calculate growth accounting metrics for each week in the wau_decorated
 ### dataframe and write to a CSV file in order to visualize (Visualization
@@ -63,6 +91,13 @@ wau_decorated = ga.create_wau_decorated_df(wau, first_dt)
 w_all_ga = ga.consolidate_all_ga(wau_decorated, 'week', keep_last_period = False)
 w_all_ga.to_csv(folder + company_name + '_weekly_all_ga.csv', index = False)
 
+### Weekly growth accounting for several segmentations in one pass. 
+### user_segments has a user_id column and one column per segment, e.g. 
+### country and plan, with a single value per user
+# w_ga_cube = ga.consolidate_ga_cube(wau_decorated, 'week', user_segments,
+#                                    grouping_sets = [[], ['country'], ['plan'], ['country', 'plan']])
+# w_ga_cube.to_csv(folder + company_name + '_weekly_ga_cube.csv', index = False)
+
 ### Calcualted weekly cohort retention curves and write to an output CSV file
 ### for visualization(s)
 wau_retention_by_cohort = ga.xau_retention_by_cohort_df(wau_decorated, 'week')
@@ -78,7 +113,8 @@ usage_hist_L100.to_csv(folder + company_name + '_usage_hist_L100.csv', index = F
 
 
 ### Engagement: Calculated the DAU/MAU Ratio for the 28-day trailing window with 
-### various minimum days active ratios also calculated
+### various minimum days active ratios also calculated. window_days can also be
+### a list such as [7, 28], computed together and tagged by window_days
 rolling_dau_xau = ga.create_dau_window_df(dau_decorated, 
                                           window_days = 28, 
                                           breakouts = [2, 4, 7, 14, 21, 28])
@@ -86,6 +122,5 @@ rolling_dau_xau.to_csv(folder + company_name + '_rolling_dau_xau.csv', index = F
 
 
 ### Growth Accounting: Rolling L28 Quick Ratio, unsegmented
-####### WARNING: THIS CAN TAKE A LONG TIME TO RUN #######
 rolling = ga.calc_rolling_qr_window(dau_decorated, window_days = 28, use_segment = False)
 rolling.to_csv(folder + company_name + '_rolling_qr.csv', index = False)